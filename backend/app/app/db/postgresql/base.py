@@ -0,0 +1,22 @@
+from django_prometheus.db.backends.common import get_postgres_cursor_class
+from django_prometheus.db.backends.postgresql import base
+from django_prometheus.db.common import ExportingCursorWrapper
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """django_prometheus' PostgreSQL backend, safe to use with a connection pool.
+
+    The upstream wrapper installs its metrics cursor factory every time a connection
+    is handed out. Pooled connections are handed out many times, so the factories
+    would nest and each query be counted once per checkout.
+    """
+
+    def get_new_connection(self, conn_params):
+        conn = super(base.DatabaseWrapper, self).get_new_connection(conn_params)
+        if not getattr(conn.cursor_factory, 'exports_metrics', False):
+            cursor_factory = ExportingCursorWrapper(
+                conn.cursor_factory or get_postgres_cursor_class(), self.alias, self.vendor
+            )
+            cursor_factory.exports_metrics = True
+            conn.cursor_factory = cursor_factory
+        return conn
@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+from django_prometheus.db.backends.sqlite3 import base
+
+from users.metrics import record_sqlite_lock_error, record_sqlite_lock_wait
+
+
+def is_lock_error(exc):
+    return 'database is locked' in str(exc) or 'database table is locked' in str(exc)
+
+
+def _record_if_locked(exc, query):
+    if is_lock_error(exc):
+        record_sqlite_lock_error('begin' if query.lstrip().upper().startswith('BEGIN') else 'execute')
+
+
+class LockCountingCursorWrapper(SQLiteCursorWrapper):
+    def execute(self, query, params=None):
+        try:
+            return super().execute(query, params)
+        except sqlite3.OperationalError as exc:
+            _record_if_locked(exc, query)
+            raise
+
+    def executemany(self, query, param_list):
+        try:
+            return super().executemany(query, param_list)
+        except sqlite3.OperationalError as exc:
+            _record_if_locked(exc, query)
+            raise
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """django_prometheus' SQLite backend that also measures write-lock contention.
+
+    With ``transaction_mode = IMMEDIATE`` the write lock is taken by the BEGIN that
+    opens every ``atomic()`` block, so its duration is the time spent waiting on
+    other writers.
+    """
+
+    CURSOR_CLASS = LockCountingCursorWrapper
+
+    def _start_transaction_under_autocommit(self):
+        started_at = time.perf_counter()
+        super()._start_transaction_under_autocommit()
+        record_sqlite_lock_wait(time.perf_counter() - started_at)
@@ -96,13 +96,67 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django_prometheus.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+# DB_ENGINE=postgresql switches to PostgreSQL (psycopg 3); SQLite stays the default.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite').lower()
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'True').lower() == 'true'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'app.db.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'backrail'),
+            'USER': os.environ.get('DB_USER', 'backrail'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Pooled connections are handed back after every request, so they must not also persist.
+            'CONN_MAX_AGE': 0 if DB_POOL_ENABLED else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
     }
-}
+    if DB_POOL_ENABLED:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        }
+elif DB_ENGINE == 'sqlite':
+    # WAL lets readers proceed while a writer holds the lock; synchronous=NORMAL is durable
+    # in WAL mode except for the last commits before a power loss.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+    # Negative values are KiB, positive values pages (SQLite's own convention).
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', '-65536'))
+    # IMMEDIATE takes the write lock at BEGIN, where busy_timeout applies, instead of
+    # failing at once when a read transaction later tries to write. The cost is that every
+    # atomic() block takes the write lock, read-only ones included, so keep atomic() to
+    # write paths; plain autocommit reads never take it.
+    SQLITE_TRANSACTION_MODE = os.environ.get('SQLITE_TRANSACTION_MODE', 'IMMEDIATE').upper()
+    DATABASES = {
+        'default': {
+            'ENGINE': 'app.db.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'OPTIONS': {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'transaction_mode': SQLITE_TRANSACTION_MODE,
+                'init_command': ';'.join([
+                    f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}',
+                    f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}',
+                    f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}',
+                    f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}',
+                    f'PRAGMA cache_size={SQLITE_CACHE_SIZE}',
+                ]),
+            },
+        }
+    }
+else:
+    raise ValueError(f"Unsupported DB_ENGINE {DB_ENGINE!r}; use 'sqlite' or 'postgresql'")
 
 
 # Password validation
@@ -162,6 +216,78 @@ CRAWLER_FALLBACK_TO_THREAD = os.environ.get('CRAWLER_FALLBACK_TO_THREAD', 'True'
 CRAWLER_JOB_TIMEOUT = int(os.environ.get('CRAWLER_JOB_TIMEOUT', '7200'))
 CRAWLER_LOG_TAIL_LIMIT = int(os.environ.get('CRAWLER_LOG_TAIL_LIMIT', '500'))
 CRAWLER_LOG_CACHE_TTL = int(os.environ.get('CRAWLER_LOG_CACHE_TTL', '86400'))
+FILE_SERVE_CHUNK_SIZE = int(os.environ.get('FILE_SERVE_CHUNK_SIZE', str(64 * 1024)))
+# Let nginx send unmodified files via X-Accel-Redirect to the internal locations below.
+FILE_SERVE_ACCEL_REDIRECT = os.environ.get('FILE_SERVE_ACCEL_REDIRECT', 'False').lower() == 'true'
+FILE_SERVE_ACCEL_STORAGE_PREFIX = os.environ.get('FILE_SERVE_ACCEL_STORAGE_PREFIX', '/protected/rdso/')
+FILE_SERVE_ACCEL_MEDIA_PREFIX = os.environ.get('FILE_SERVE_ACCEL_MEDIA_PREFIX', '/protected/media/')
+FILE_SERVE_TRACK_MEMORY = os.environ.get('FILE_SERVE_TRACK_MEMORY', 'False').lower() == 'true'
+WATERMARK_SPOOL_MAX_BYTES = int(os.environ.get('WATERMARK_SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+# 'incremental' streams the cached source and appends a small revision; 'rewrite' builds and
+# buffers the whole re-serialized PDF before sending it. Incremental falls back to rewrite when
+# no prepared source exists.
+WATERMARK_MODE = os.environ.get('WATERMARK_MODE', 'incremental').lower()
+WATERMARK_CACHE_ENABLED = os.environ.get('WATERMARK_CACHE_ENABLED', 'True').lower() == 'true'
+# Empty means "<RDSO_STORAGE_ROOT>/_watermark_cache".
+WATERMARK_CACHE_ROOT = os.environ.get('WATERMARK_CACHE_ROOT', '')
+WATERMARK_CACHE_MAX_BYTES = int(os.environ.get('WATERMARK_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+WATERMARK_USE_QUEUE = os.environ.get('WATERMARK_USE_QUEUE', 'False' if TESTING or not DJANGO_RQ_ENABLED else 'True').lower() == 'true'
+WATERMARK_JOB_TIMEOUT = int(os.environ.get('WATERMARK_JOB_TIMEOUT', '600'))
+WATERMARK_JOB_WORKERS = int(os.environ.get('WATERMARK_JOB_WORKERS', '4'))
+WATERMARK_JOB_MAX_DOCUMENTS = int(os.environ.get('WATERMARK_JOB_MAX_DOCUMENTS', '200'))
+WATERMARK_JOB_TTL = int(os.environ.get('WATERMARK_JOB_TTL', '86400'))
+# A running job that has not finished a document for this long has lost its worker.
+WATERMARK_JOB_STALE_SECONDS = int(os.environ.get('WATERMARK_JOB_STALE_SECONDS', str(WATERMARK_JOB_TIMEOUT + 300)))
+# Empty means "<RDSO_STORAGE_ROOT>/_watermark_jobs".
+WATERMARK_JOB_ROOT = os.environ.get('WATERMARK_JOB_ROOT', '')
+DOCUMENT_ARCHIVE_MAX_DOCUMENTS = int(os.environ.get('DOCUMENT_ARCHIVE_MAX_DOCUMENTS', '5000'))
+# Empty means "<RDSO_STORAGE_ROOT>/_previews".
+PREVIEW_ROOT = os.environ.get('PREVIEW_ROOT', '')
+PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', '320'))
+PREVIEW_QUALITY = int(os.environ.get('PREVIEW_QUALITY', '75'))
+PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', str(min(os.cpu_count() or 1, 4))))
+PREVIEW_CACHE_MAX_AGE = int(os.environ.get('PREVIEW_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+PREVIEW_GENERATE_ON_IMPORT = os.environ.get('PREVIEW_GENERATE_ON_IMPORT', 'False' if TESTING else 'True').lower() == 'true'
+PREVIEW_USE_QUEUE = os.environ.get('PREVIEW_USE_QUEUE', 'False' if TESTING or not DJANGO_RQ_ENABLED else 'True').lower() == 'true'
+PREVIEW_JOB_TIMEOUT = int(os.environ.get('PREVIEW_JOB_TIMEOUT', '600'))
+CATALOG_IMPORT_BATCH_SIZE = int(os.environ.get('CATALOG_IMPORT_BATCH_SIZE', '500'))
+CATALOG_IMPORT_USE_QUEUE = os.environ.get('CATALOG_IMPORT_USE_QUEUE', 'False' if TESTING or not DJANGO_RQ_ENABLED else 'True').lower() == 'true'
+CATALOG_IMPORT_JOB_TIMEOUT = int(os.environ.get('CATALOG_IMPORT_JOB_TIMEOUT', '3600'))
+# The import's own heartbeat commits with the import, so a run is only presumed dead once it
+# has been silent for longer than a job may take.
+CATALOG_IMPORT_STALE_SECONDS = int(os.environ.get('CATALOG_IMPORT_STALE_SECONDS', str(CATALOG_IMPORT_JOB_TIMEOUT + 300)))
+# off: import manually; stream: apply crawler records in batches as they arrive; complete: apply them when the crawl exits.
+CRAWLER_IMPORT_MODE = os.environ.get('CRAWLER_IMPORT_MODE', 'off').lower()
+# Archive crawler documents a successful crawl no longer lists; off so a partial crawl never hides drawings.
+CRAWLER_IMPORT_REMOVE_MISSING = os.environ.get('CRAWLER_IMPORT_REMOVE_MISSING', 'False').lower() == 'true'
+# Empty means "<RDSO_STORAGE_ROOT>/_transcodes".
+IMAGE_TRANSCODE_ROOT = os.environ.get('IMAGE_TRANSCODE_ROOT', '')
+IMAGE_DISPLAY_MAX_SIZE = int(os.environ.get('IMAGE_DISPLAY_MAX_SIZE', '2048'))
+IMAGE_TILE_SIZE = int(os.environ.get('IMAGE_TILE_SIZE', '256'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', str(500 * 1000 * 1000)))
+IMAGE_TILE_USE_QUEUE = os.environ.get('IMAGE_TILE_USE_QUEUE', 'False' if TESTING or not DJANGO_RQ_ENABLED else 'True').lower() == 'true'
+IMAGE_TILE_JOB_TIMEOUT = int(os.environ.get('IMAGE_TILE_JOB_TIMEOUT', '1800'))
+# sync: insert per call; memory: per-process buffer; redis: shared list that survives worker restarts.
+# memory loses whatever is buffered when a worker is killed, so it is never the default.
+AUDIT_BUFFER_BACKEND = os.environ.get('AUDIT_BUFFER_BACKEND', 'redis' if USE_REDIS else 'sync').lower()
+AUDIT_BUFFER_MAX_EVENTS = int(os.environ.get('AUDIT_BUFFER_MAX_EVENTS', '500'))
+# Cap on the memory backend while flushes keep failing; past it events are written through.
+AUDIT_BUFFER_LIMIT = int(os.environ.get('AUDIT_BUFFER_LIMIT', '50000'))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', '5'))
+AUDIT_FLUSH_USE_QUEUE = os.environ.get('AUDIT_FLUSH_USE_QUEUE', 'False').lower() == 'true'
+AUDIT_REDIS_KEY = os.environ.get('AUDIT_REDIS_KEY', 'backrail:audit')
+DUMP_SNAPSHOT_ENABLED = os.environ.get('DUMP_SNAPSHOT_ENABLED', 'False' if TESTING else 'True').lower() == 'true'
+DUMP_SNAPSHOT_ROOT = os.environ.get('DUMP_SNAPSHOT_ROOT', '')
+DUMP_SNAPSHOT_USE_QUEUE = os.environ.get('DUMP_SNAPSHOT_USE_QUEUE', 'False' if TESTING or not DJANGO_RQ_ENABLED else 'True').lower() == 'true'
+DUMP_SNAPSHOT_JOB_TIMEOUT = int(os.environ.get('DUMP_SNAPSHOT_JOB_TIMEOUT', '900'))
+DUMP_DELTA_PAGE_SIZE = int(os.environ.get('DUMP_DELTA_PAGE_SIZE', '1000'))
+CHANGE_JOURNAL_RETENTION_DAYS = int(os.environ.get('CHANGE_JOURNAL_RETENTION_DAYS', '90'))
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', '50'))
+API_PAGINATE_BY_DEFAULT = os.environ.get('API_PAGINATE_BY_DEFAULT', 'False').lower() == 'true'
+SEARCH_DEFAULT_LIMIT = int(os.environ.get('SEARCH_DEFAULT_LIMIT', '20'))
+SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', '100'))
+IDENTIFIER_MIN_SIMILARITY = float(os.environ.get('IDENTIFIER_MIN_SIMILARITY', '0.3'))
 PROMETHEUS_METRICS_ENABLED = os.environ.get('PROMETHEUS_METRICS_ENABLED', 'True').lower() == 'true'
 PROMETHEUS_METRICS_PATH = os.environ.get('PROMETHEUS_METRICS_PATH', 'metrics/')
 PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
@@ -198,6 +324,10 @@ RQ_QUEUES = {
         'URL': REDIS_URL,
         'DEFAULT_TIMEOUT': CRAWLER_JOB_TIMEOUT,
     },
+    'watermark': {
+        'URL': REDIS_URL,
+        'DEFAULT_TIMEOUT': WATERMARK_JOB_TIMEOUT,
+    },
 }
 
 if DJANGO_RQ_ENABLED:
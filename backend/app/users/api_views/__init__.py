@@ -1,4 +1,5 @@
 from .admin import (
+    CatalogImportStatusView,
     CrawlerLogsView,
     CrawlerStatusView,
     DocumentLogView,
@@ -11,18 +12,43 @@ from .admin import (
 )
 from .auth import HelloView, LoginView, RegisterView
 from .collaboration import BatchActionView, CreatePost, FeedbackListView, PostListView
-from .documents import CategoryListView, CreateDocument, DocumentListView, SubheadDocumentListView, SubheadListView
+from .documents import (
+    CategoryListView,
+    CreateDocument,
+    DocumentArchiveView,
+    DocumentIdentifierSearchView,
+    DocumentImageView,
+    DocumentListView,
+    DocumentPreviewView,
+    DocumentSearchView,
+    DocumentTileInfoView,
+    DocumentTileView,
+    SubheadDocumentListView,
+    SubheadListView,
+    WatermarkJobArchiveView,
+    WatermarkJobFileView,
+    WatermarkJobStatusView,
+    WatermarkJobView,
+)
 from .sync import DumpView
 
 __all__ = [
     'BatchActionView',
+    'CatalogImportStatusView',
     'CategoryListView',
     'CreateDocument',
     'CreatePost',
     'CrawlerLogsView',
     'CrawlerStatusView',
+    'DocumentArchiveView',
+    'DocumentIdentifierSearchView',
+    'DocumentImageView',
     'DocumentListView',
     'DocumentLogView',
+    'DocumentPreviewView',
+    'DocumentSearchView',
+    'DocumentTileInfoView',
+    'DocumentTileView',
     'DumpView',
     'FeedbackListView',
     'HealthCheckView',
@@ -37,4 +63,8 @@ __all__ = [
     'SubheadListView',
     'UpdateUserStatusView',
     'UserLogView',
+    'WatermarkJobArchiveView',
+    'WatermarkJobFileView',
+    'WatermarkJobStatusView',
+    'WatermarkJobView',
 ]
\ No newline at end of file
@@ -1,10 +1,3 @@
-import json
-import time
-from io import StringIO
-from pathlib import Path
-
-from django.conf import settings
-from django.core.management import call_command
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from drf_spectacular.utils import OpenApiParameter, extend_schema
@@ -13,12 +6,13 @@ from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ..crawler import get_crawler_logs, get_current_crawler_run, start_crawler_run
-from ..metrics import record_catalog_import, record_crawler_request, set_crawler_active
-from ..models import AuditLog, CrawlerRun, User
+from ..catalog_jobs import get_catalog_import_progress, get_current_catalog_import, start_catalog_import
+from ..crawler import get_crawler_logs, get_current_crawler_run, read_crawl_meta, start_crawler_run
+from ..metrics import record_crawler_request, set_crawler_active
+from ..models import AuditLog, CatalogImportRun, CrawlerRun, User
 from ..serializers import AuditLogSerializer, UserSerializer
 from ..utils import log_audit
-from .base import logger
+from .base import keyset_response, logger
 
 
 class RegistrationListView(APIView):
@@ -42,8 +36,7 @@ class RegistrationListView(APIView):
         if status_filter in ['pending', 'accepted', 'rejected']:
             users = users.filter(user_status=status_filter)
 
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return keyset_response(request, self, users, UserSerializer, ('HRMS_ID',))
 
 
 class UpdateUserStatusView(APIView):
@@ -84,18 +77,16 @@ class DocumentLogView(APIView):
     permission_classes = [IsAuthenticated, IsAdminUser]
 
     def get(self, request):
-        logs = AuditLog.objects.filter(target_type='document').order_by('-created_at')
-        serializer = AuditLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        logs = AuditLogSerializer.setup_eager_loading(AuditLog.objects.filter(target_type='document'))
+        return keyset_response(request, self, logs, AuditLogSerializer, ('-created_at', '-id'))
 
 
 class UserLogView(APIView):
     permission_classes = [IsAuthenticated, IsAdminUser]
 
     def get(self, request):
-        logs = AuditLog.objects.filter(target_type='user').order_by('-created_at')
-        serializer = AuditLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        logs = AuditLogSerializer.setup_eager_loading(AuditLog.objects.filter(target_type='user'))
+        return keyset_response(request, self, logs, AuditLogSerializer, ('-created_at', '-id'))
 
 
 class HealthCheckView(APIView):
@@ -145,12 +136,7 @@ class CrawlerStatusView(APIView):
         running = bool(run and run.status in (CrawlerRun.STATUS_QUEUED, CrawlerRun.STATUS_RUNNING))
         set_crawler_active(running)
 
-        meta_path = Path(settings.RDSO_STORAGE_ROOT) / '__meta__.json'
-        meta_info = {}
-        if meta_path.exists():
-            with open(meta_path, 'r', encoding='utf-8') as handle:
-                meta_info = json.load(handle)
-
+        meta_info = read_crawl_meta()
         totals = meta_info.get('totals', {})
         logger.info('CrawlerStatusView: running=%s', running)
         return Response({
@@ -208,16 +194,45 @@ class ImportCatalogView(APIView):
 
     def post(self, request):
         logger.info('ImportCatalogView: triggered by %s', request.user.HRMS_ID)
-        out = StringIO()
-        started_at = time.perf_counter()
-        outcome = 'success'
+        run, outcome = start_catalog_import(request.user)
+        payload = {'status': outcome, 'run_id': run.id, 'job_id': run.job_id}
+        if outcome == 'already_running':
+            return Response(payload, status=status.HTTP_409_CONFLICT)
+        logger.info('ImportCatalogView: started catalog import %s', run.id)
+        return Response(payload, status=status.HTTP_202_ACCEPTED)
+
+
+class CatalogImportStatusView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
         try:
-            call_command('import_rdso_catalog', stdout=out)
-        except Exception:
-            outcome = 'error'
-            raise
-        finally:
-            record_catalog_import(outcome, time.perf_counter() - started_at)
-        result = out.getvalue()
-        logger.info('ImportCatalogView: %s', result.strip())
-        return Response({'status': 'ok', 'output': result.strip()}, status=status.HTTP_200_OK)
\ No newline at end of file
+            since = max(int(request.query_params.get('since', 0)), 0)
+        except ValueError:
+            return Response({'error': 'since must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        run = get_current_catalog_import(run_id=request.query_params.get('run_id'))
+        if not run:
+            return Response({
+                'run_id': None, 'status': 'idle', 'running': False, 'offset': 0, 'lines': [], 'truncated': False,
+            }, status=status.HTTP_200_OK)
+
+        progress, lines, offset, truncated = get_catalog_import_progress(run, since)
+        return Response({
+            'run_id': run.id,
+            'job_id': run.job_id,
+            'status': run.status,
+            'running': run.status in (CatalogImportRun.STATUS_QUEUED, CatalogImportRun.STATUS_RUNNING),
+            'execution_mode': run.execution_mode,
+            'error': run.error_message,
+            'queued_at': run.queued_at.isoformat(),
+            'started_at': run.started_at.isoformat() if run.started_at else None,
+            'finished_at': run.finished_at.isoformat() if run.finished_at else None,
+            'phase': progress['phase'],
+            'records_processed': progress['records_processed'],
+            'records_total': progress['records_total'],
+            'phase_durations': progress['phase_durations'],
+            'stats': progress['stats'],
+            'offset': offset,
+            'lines': lines,
+            'truncated': truncated,
+        }, status=status.HTTP_200_OK)
@@ -1,6 +1,8 @@
 import logging
 
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 
 logger = logging.getLogger('users')
@@ -8,4 +10,35 @@ logger = logging.getLogger('users')
 
 class StandardPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
-    max_page_size = 200
\ No newline at end of file
+    max_page_size = 200
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination that seeks on an indexed ordering instead of counting an OFFSET.
+
+    The first ordering field positions the cursor, so it should be indexed and
+    close to unique; later fields only break ties inside a page.
+    """
+
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+        self.page_size = settings.API_PAGE_SIZE
+
+
+def wants_pagination(request):
+    if settings.API_PAGINATE_BY_DEFAULT:
+        return True
+    return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+
+def keyset_response(request, view, queryset, serializer_class, ordering):
+    """Serialize one keyset page when the client asks for it, otherwise the whole ordered list."""
+    if not wants_pagination(request):
+        return Response(serializer_class(queryset.order_by(*ordering), many=True).data)
+
+    paginator = KeysetPagination(ordering)
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
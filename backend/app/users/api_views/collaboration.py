@@ -7,7 +7,7 @@ from ..models import Document, Post
 from ..permissions import IsAcceptedUser
 from ..serializers import PostSerializer
 from ..utils import log_audit
-from .base import logger
+from .base import keyset_response, logger
 
 
 class CreatePost(APIView):
@@ -34,9 +34,8 @@ class PostListView(APIView):
         if not document_id:
             return Response({'error': 'document_id query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        posts = Post.objects.filter(document__document_id=document_id)
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        posts = PostSerializer.setup_eager_loading(Post.objects.filter(document__document_id=document_id))
+        return keyset_response(request, self, posts, PostSerializer, ('-created_at', '-id'))
 
 
 class FeedbackListView(APIView):
@@ -44,9 +43,10 @@ class FeedbackListView(APIView):
 
     def get(self, request, document_id):
         get_object_or_404(Document, document_id=document_id)
-        posts = Post.objects.filter(document__document_id=document_id, post_type='feedback')
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        posts = PostSerializer.setup_eager_loading(
+            Post.objects.filter(document__document_id=document_id, post_type='feedback')
+        )
+        return keyset_response(request, self, posts, PostSerializer, ('-created_at', '-id'))
 
 
 class BatchActionView(APIView):
@@ -1,15 +1,39 @@
+import os
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.db.models import Count
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework import status
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ..models import Category, Document, Subhead
+from ..archive import stream_zip, zip_entry_info
+from ..identifiers import search_identifiers
+from ..imaging import (
+    DISPLAY_FORMATS,
+    TILE_CONTENT_TYPE,
+    display_variant,
+    start_tile_pyramid,
+    tile_path,
+    tile_pyramid_error,
+    tile_pyramid_info,
+)
+from ..metrics import record_file_serve
+from ..models import Category, Document, Subhead, WatermarkJob, WatermarkJobItem
 from ..permissions import IsAcceptedUser
+from ..previews import SHA256_RE, preview_path, start_preview
+from ..search import search_documents, search_limit
 from ..serializers import CategoryDetailSerializer, DocumentSerializer, SubheadSerializer
-from ..utils import log_audit, serve_file
-from .base import logger
+from ..utils import checked_document_path, log_audit, log_audit_bulk, resolve_document_path, serve_file
+from ..watermark import iter_file_chunks, watermark_stream
+from ..watermark_jobs import RUNNING_STATUSES, job_output_path, recover_abandoned_watermark_job, start_watermark_job
+from .base import keyset_response, logger
 
 
 class CreateDocument(APIView):
@@ -36,15 +60,14 @@ class DocumentListView(APIView):
 
         if document_ids:
             ids_list = [item.strip() for item in document_ids.split(',') if item.strip()]
-            documents = Document.objects.filter(document_id__in=ids_list).prefetch_related('category')
+            documents = Document.objects.filter(document_id__in=ids_list)
         else:
-            documents = Document.objects.prefetch_related('category').all()
+            documents = Document.objects.all()
+        documents = DocumentSerializer.setup_eager_loading(documents)
 
         if category_name:
             documents = documents.filter(category__name=category_name).distinct()
 
-        documents = documents.order_by('name')
-
         if download_param is not None:
             as_download = download_param.lower() == 'true'
 
@@ -55,11 +78,13 @@ class DocumentListView(APIView):
                 )
 
             document = documents.first()
-            log_audit(request.user, 'document_view', 'document', document.document_id, {'download': as_download})
-            return serve_file(document, request.user.HRMS_ID, as_download=as_download)
+            # Seeking viewers issue many Range requests per open; audit only the first one.
+            range_header = request.headers.get('Range', '')
+            if as_download or not range_header or range_header.startswith('bytes=0-'):
+                log_audit(request.user, 'document_view', 'document', document.document_id, {'download': as_download})
+            return serve_file(document, request.user.HRMS_ID, as_download=as_download, request=request)
 
-        serializer = DocumentSerializer(documents, many=True)
-        return Response(serializer.data)
+        return keyset_response(request, self, documents, DocumentSerializer, ('name', 'id'))
 
 
 class CategoryListView(APIView):
@@ -81,7 +106,7 @@ class SubheadListView(APIView):
     def get(self, request, pk):
         logger.info('SubheadListView: listing subheads for category %s', pk)
         category = get_object_or_404(Category, pk=pk)
-        subheads = Subhead.objects.filter(category=category).order_by('name')
+        subheads = SubheadSerializer.setup_eager_loading(Subhead.objects.filter(category=category)).order_by('name')
         serializer = SubheadSerializer(subheads, many=True)
         return Response(serializer.data)
 
@@ -92,6 +117,412 @@ class SubheadDocumentListView(APIView):
     def get(self, request, pk):
         logger.info('SubheadDocumentListView: listing documents for subhead %s', pk)
         subhead = get_object_or_404(Subhead, pk=pk)
-        documents = Document.objects.filter(subhead=subhead).prefetch_related('category').order_by('name')
+        documents = DocumentSerializer.setup_eager_loading(Document.objects.filter(subhead=subhead)).order_by('name')
         serializer = DocumentSerializer(documents, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class DocumentSearchView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = search_limit(request.query_params.get('limit'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        document_ids, total = search_documents(query, limit)
+        documents = DocumentSerializer.setup_eager_loading(Document.objects.filter(pk__in=document_ids))
+        by_pk = {document.pk: document for document in documents}
+        ranked = [by_pk[pk] for pk in document_ids if pk in by_pk]
+        return Response({
+            'query': query,
+            'count': total,
+            'results': DocumentSerializer(ranked, many=True).data,
+        })
+
+
+class DocumentIdentifierSearchView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q query parameter is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = search_limit(request.query_params.get('limit'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches, (identifiers, alteration) = search_identifiers(query, limit)
+        documents = list(DocumentSerializer.setup_eager_loading(
+            Document.objects.filter(pk__in=[match[0] for match in matches])
+        ))
+        rows = DocumentSerializer(documents, many=True).data
+        serialized = {document.pk: row for document, row in zip(documents, rows)}
+        return Response({
+            'query': query,
+            'identifiers': identifiers,
+            'alteration': alteration,
+            'results': [
+                {
+                    'identifier': identifier,
+                    'alteration': match_alteration,
+                    'score': round(score, 3),
+                    'document': serialized[document_pk],
+                }
+                for document_pk, identifier, match_alteration, score in matches
+                if document_pk in serialized
+            ],
+        })
+
+
+class DocumentPreviewView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, sha256):
+        if not SHA256_RE.match(sha256):
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        target_path = preview_path(sha256)
+        if not target_path.is_file():
+            document = Document.objects.filter(sha256=sha256).first()
+            if document is None or not start_preview(document):
+                return Response({'detail': 'No preview available.'}, status=status.HTTP_404_NOT_FOUND)
+            response = Response(
+                {'status': 'building', 'detail': 'The preview is being rendered; retry shortly.'},
+                status=status.HTTP_202_ACCEPTED,
+            )
+            response['Retry-After'] = '2'
+            return response
+
+        # The URL is the content hash, so the image never changes under it.
+        return _immutable_file_response(request, target_path, 'image/jpeg', f'"{target_path.stem}"')
+
+
+def _immutable_file_response(request, path, content_type, etag):
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = f'private, max-age={settings.PREVIEW_CACHE_MAX_AGE}, immutable'
+    return response
+
+
+def _raster_source(sha256):
+    """Return (document, file_path) for the raster drawing with this hash, or None."""
+    if not SHA256_RE.match(sha256):
+        return None
+    document = Document.objects.filter(sha256=sha256, content_type__startswith='image/').first()
+    if document is None:
+        return None
+    file_path = checked_document_path(document)
+    if file_path is None:
+        return None
+    return document, file_path
+
+
+class DocumentImageView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, sha256):
+        # 'format' is taken by DRF's format suffix override.
+        image_format = request.query_params.get('output', 'jpeg').lower()
+        if image_format not in DISPLAY_FORMATS:
+            return Response(
+                {'detail': f"output must be one of {', '.join(DISPLAY_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        source = _raster_source(sha256)
+        if source is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        document, file_path = source
+        try:
+            path, content_type = display_variant(file_path, sha256, image_format)
+        except Exception as exc:
+            logger.warning('DocumentImageView: cannot transcode %s: %s', document.document_id, exc)
+            return Response({'detail': 'Image could not be converted.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        log_audit(request.user, 'document_view', 'document', document.document_id, {'download': False, 'variant': 'display'})
+        return _immutable_file_response(request, path, content_type, f'"{sha256}-{path.name}"')
+
+
+class DocumentTileInfoView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, sha256):
+        source = _raster_source(sha256)
+        if source is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        document, file_path = source
+        info = tile_pyramid_info(sha256)
+        if info is None:
+            error = tile_pyramid_error(sha256)
+            if error:
+                logger.warning('DocumentTileInfoView: cannot tile %s: %s', document.document_id, error)
+                return Response({'detail': 'Image could not be tiled.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            # A full-resolution scan can take minutes and gigabytes to tile, so it never happens in the request.
+            start_tile_pyramid(file_path, sha256)
+            response = Response(
+                {'status': 'building', 'detail': 'The tile pyramid is being built; retry shortly.'},
+                status=status.HTTP_202_ACCEPTED,
+            )
+            response['Retry-After'] = '2'
+            return response
+
+        log_audit(request.user, 'document_view', 'document', document.document_id, {'download': False, 'variant': 'tiles'})
+        tiles_url = reverse('document-tile-info', args=[sha256])
+        return Response({
+            **info,
+            'document_id': document.document_id,
+            'url_template': f'{tiles_url}{{level}}/{{col}}_{{row}}.jpg',
+        })
+
+
+class DocumentTileView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, sha256, level, col, row):
+        path = tile_path(sha256, level, col, row) if SHA256_RE.match(sha256) else None
+        if path is None or not path.is_file():
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return _immutable_file_response(request, path, TILE_CONTENT_TYPE, f'"{sha256}-{level}-{col}-{row}"')
+
+
+def _download_name(document):
+    return document.file_name_on_disk or f'{document.document_id}.pdf'
+
+
+def _unique_archive_name(seen, document):
+    name = _download_name(document)
+    if name in seen:
+        name = f'{document.document_id}_{name}'
+    seen.add(name)
+    return name
+
+
+def _parse_document_ids(raw_ids):
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.split(',')
+    return list(dict.fromkeys(str(item).strip() for item in raw_ids or [] if str(item).strip()))
+
+
+def _get_watermark_job(request, pk):
+    jobs = WatermarkJob.objects.all()
+    if not request.user.is_staff:
+        jobs = jobs.filter(requested_by=request.user)
+    return get_object_or_404(jobs, pk=pk)
+
+
+def _item_source_path(item):
+    if item.output_name:
+        return str(job_output_path(item))
+    file_path, _ = resolve_document_path(item.document)
+    return file_path
+
+
+class WatermarkJobView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def post(self, request):
+        ids_list = _parse_document_ids(request.data.get('document_ids'))
+
+        if not ids_list:
+            return Response({'detail': 'document_ids is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids_list) > settings.WATERMARK_JOB_MAX_DOCUMENTS:
+            return Response(
+                {'detail': f'At most {settings.WATERMARK_JOB_MAX_DOCUMENTS} documents per job.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        documents = {document.document_id: document for document in Document.objects.filter(document_id__in=ids_list)}
+        missing = [document_id for document_id in ids_list if document_id not in documents]
+        if missing:
+            return Response({'detail': 'Unknown document_ids.', 'missing': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+        job = start_watermark_job(request.user, [documents[document_id] for document_id in ids_list])
+        log_audit_bulk(request.user, 'document_view', 'document', ids_list, {'download': True, 'job_id': job.pk})
+        logger.info('WatermarkJobView: job %s with %d documents for %s', job.pk, len(ids_list), request.user.HRMS_ID)
+        return Response({
+            'status': job.status,
+            'job_id': job.pk,
+            'execution_mode': job.execution_mode,
+            'total': job.total_items,
+            'status_url': reverse('watermark-job-status', args=[job.pk]),
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class WatermarkJobStatusView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, pk):
+        job = _get_watermark_job(request, pk)
+        if recover_abandoned_watermark_job(job):
+            job.refresh_from_db()
+        items = []
+        counts = {WatermarkJobItem.STATUS_PENDING: 0, WatermarkJobItem.STATUS_SUCCEEDED: 0, WatermarkJobItem.STATUS_FAILED: 0}
+        for item in job.items.select_related('document'):
+            counts[item.status] += 1
+            ready = item.status == WatermarkJobItem.STATUS_SUCCEEDED
+            items.append({
+                'document_id': item.document.document_id,
+                'status': item.status,
+                'size': item.output_size,
+                'error': item.error_message,
+                'url': reverse('watermark-job-file', args=[job.pk, item.document.document_id]) if ready else None,
+            })
+
+        finished = job.status not in RUNNING_STATUSES
+        return Response({
+            'running': not finished,
+            'job_id': job.pk,
+            'status': job.status,
+            'execution_mode': job.execution_mode,
+            'error': job.error_message,
+            'queued_at': job.queued_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'total': job.total_items,
+            'completed': counts[WatermarkJobItem.STATUS_SUCCEEDED],
+            'failed': counts[WatermarkJobItem.STATUS_FAILED],
+            'pending': counts[WatermarkJobItem.STATUS_PENDING],
+            'archive_url': reverse('watermark-job-archive', args=[job.pk]) if finished and counts[WatermarkJobItem.STATUS_SUCCEEDED] else None,
+            'items': items,
+        }, status=status.HTTP_200_OK)
+
+
+class WatermarkJobFileView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, pk, document_id):
+        job = _get_watermark_job(request, pk)
+        item = get_object_or_404(
+            job.items.select_related('document'),
+            document__document_id=document_id,
+            status=WatermarkJobItem.STATUS_SUCCEEDED,
+        )
+        if not item.output_name:
+            return serve_file(item.document, job.requested_by.HRMS_ID, as_download=True)
+
+        output_path = job_output_path(item)
+        if not output_path.is_file():
+            return Response({'detail': 'File has expired.'}, status=status.HTTP_410_GONE)
+        response = FileResponse(open(output_path, 'rb'), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{_download_name(item.document)}"'
+        return response
+
+
+class WatermarkJobArchiveView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request, pk):
+        job = _get_watermark_job(request, pk)
+        if job.status in RUNNING_STATUSES:
+            return Response({'detail': 'Job is still running.', 'status': job.status}, status=status.HTTP_409_CONFLICT)
+
+        items = list(job.items.select_related('document').filter(status=WatermarkJobItem.STATUS_SUCCEEDED))
+        if not items:
+            return Response({'detail': 'No documents are ready.'}, status=status.HTTP_404_NOT_FOUND)
+
+        def entries():
+            seen = set()
+            for item in items:
+                name = _unique_archive_name(seen, item.document)
+                path = _item_source_path(item)
+                try:
+                    handle = open(path, 'rb')
+                except OSError:
+                    logger.warning('WatermarkJobArchiveView: %s is gone, skipping', path)
+                    continue
+                with handle:
+                    info = zip_entry_info(name, item.document.content_type, os.fstat(handle.fileno()).st_mtime)
+                    yield info, iter_file_chunks(handle)
+
+        response = StreamingHttpResponse(stream_zip(entries()), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="watermark-job-{job.pk}.zip"'
+        return response
+
+
+def _document_archive_entries(members, watermark_text):
+    seen = set()
+    for document, file_path in members:
+        name = _unique_archive_name(seen, document)
+        content_type = document.content_type or 'application/pdf'
+        modified = os.path.getmtime(file_path)
+        if content_type == 'application/pdf':
+            try:
+                chunks, _ = watermark_stream(file_path, watermark_text, sha256=document.sha256)
+            except Exception as exc:
+                # Headers are already sent, so a broken PDF is left out rather than failing the archive.
+                logger.warning('DocumentArchiveView: skipping %s: %s', document.document_id, exc)
+                continue
+            yield zip_entry_info(name, content_type, modified), chunks
+        else:
+            with open(file_path, 'rb') as handle:
+                yield zip_entry_info(name, content_type, modified), iter_file_chunks(handle)
+
+
+def _timed_archive(chunks, started_at):
+    outcome = 'error'
+    try:
+        yield from chunks
+        outcome = 'served'
+    finally:
+        record_file_serve(outcome, 'archive', 'application/zip', time.perf_counter() - started_at)
+
+
+class DocumentArchiveView(APIView):
+    permission_classes = [IsAcceptedUser]
+
+    def get(self, request):
+        started_at = time.perf_counter()
+        subhead_id = request.query_params.get('subhead')
+        ids_list = _parse_document_ids(request.query_params.get('document_ids'))
+
+        if subhead_id:
+            if not subhead_id.isdigit():
+                return Response({'detail': 'subhead must be an integer id.'}, status=status.HTTP_400_BAD_REQUEST)
+            subhead = get_object_or_404(Subhead, pk=subhead_id)
+            documents = Document.objects.filter(subhead=subhead)
+            archive_name = f'subhead-{subhead.pk}.zip'
+        elif ids_list:
+            documents = Document.objects.filter(document_id__in=ids_list)
+            archive_name = 'documents.zip'
+        else:
+            return Response({'detail': 'Specify subhead or document_ids.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        documents = list(documents.order_by('name', 'document_id'))
+        if len(documents) > settings.DOCUMENT_ARCHIVE_MAX_DOCUMENTS:
+            return Response(
+                {'detail': f'At most {settings.DOCUMENT_ARCHIVE_MAX_DOCUMENTS} documents per archive.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        members = []
+        for document in documents:
+            file_path = checked_document_path(document)
+            if file_path is None:
+                logger.warning('DocumentArchiveView: no file for %s, skipping', document.document_id)
+                continue
+            members.append((document, file_path))
+        if not members:
+            return Response({'detail': 'No files available.'}, status=status.HTTP_404_NOT_FOUND)
+
+        log_audit_bulk(
+            request.user, 'document_view', 'document',
+            [document.document_id for document, _ in members],
+            {'download': True, 'archive': archive_name},
+        )
+        logger.info('DocumentArchiveView: %d documents for %s', len(members), request.user.HRMS_ID)
+
+        now_str = timezone.now().strftime('%d-%m-%Y %H:%M:%S')
+        watermark_text = f"Downloaded by {request.user.HRMS_ID} at {now_str}"
+        chunks = stream_zip(_document_archive_entries(members, watermark_text))
+        response = StreamingHttpResponse(_timed_archive(chunks, started_at), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+        return response
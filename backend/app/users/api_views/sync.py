@@ -1,10 +1,51 @@
+import gzip
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ..metrics import record_dump
+from ..metrics import record_dump, record_dump_snapshot
 from ..permissions import IsAcceptedUser
-from ..sync import build_dump_payload
+from ..snapshots import current_dump_snapshot, snapshot_file_path
+from ..sync import (
+    CursorExpired,
+    build_delta_payload,
+    build_dump_payload,
+    is_full_dump_request,
+    prepare_dump_stream,
+)
+
+
+def _accepts_gzip(accept_encoding):
+    """True when an Accept-Encoding header allows gzip, honouring q-values such as ``gzip;q=0``."""
+    qualities = {}
+    for entry in accept_encoding.split(','):
+        coding, _, params = entry.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def _gunzip_chunks(path, chunk_size=64 * 1024):
+    with gzip.open(path, 'rb') as handle:
+        while chunk := handle.read(chunk_size):
+            yield chunk
 
 
 class DumpView(APIView):
@@ -13,6 +54,32 @@ class DumpView(APIView):
     def get(self, request):
         last_synced = request.query_params.get('last_synced')
         diff_value = request.query_params.get('diff')
+        cursor = request.query_params.get('cursor')
+
+        if cursor is not None:
+            try:
+                payload = build_delta_payload(cursor)
+            except CursorExpired as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_410_GONE)
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            record_dump(payload['mode'], payload['document_count'])
+            return Response(payload, status=status.HTTP_200_OK)
+
+        if request.query_params.get('stream', '').lower() in {'1', 'true', 'yes', 'ndjson'}:
+            try:
+                lines = prepare_dump_stream(last_synced=last_synced, diff_value=diff_value, on_complete=record_dump)
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+        if settings.DUMP_SNAPSHOT_ENABLED:
+            try:
+                snapshot = current_dump_snapshot() if is_full_dump_request(last_synced, diff_value) else None
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            if snapshot is not None:
+                return self._snapshot_response(request, snapshot)
 
         try:
             payload = build_dump_payload(last_synced=last_synced, diff_value=diff_value)
@@ -20,4 +87,26 @@ class DumpView(APIView):
             return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
         record_dump(payload['mode'], payload['document_count'])
-        return Response(payload, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(payload, status=status.HTTP_200_OK)
+
+    def _snapshot_response(self, request, snapshot):
+        """Serve the full dump from the current catalog version's gzip snapshot."""
+        etag = f'"{snapshot["sha256"]}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            record_dump_snapshot('not_modified')
+            response = HttpResponseNotModified()
+        else:
+            record_dump_snapshot('served')
+            record_dump('full', snapshot['document_count'])
+            path = snapshot_file_path(snapshot)
+            if _accepts_gzip(request.headers.get('Accept-Encoding', '')):
+                response = FileResponse(open(path, 'rb'), content_type='application/json', filename='dump.json')
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = StreamingHttpResponse(_gunzip_chunks(path), content_type='application/json')
+                response['Content-Length'] = str(snapshot['raw_size'])
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Accept-Encoding'
+        response['X-Catalog-Version'] = str(snapshot['version'])
+        return response
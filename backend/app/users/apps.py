@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Scanned drawings are far larger than Pillow's decompression bomb default; set once, not per call.
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
@@ -0,0 +1,64 @@
+import time
+import zipfile
+
+# Formats whose payload is already compressed; deflating them again only burns CPU.
+PRECOMPRESSED_CONTENT_TYPES = {
+    'application/pdf',
+    'application/zip',
+    'image/gif',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+}
+
+
+class _ChunkSink:
+    """Write-only file object that hands ZipFile output back to the generator."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_entry_info(arcname, content_type='', modified=None):
+    """Build the ZipInfo for one member, storing pre-compressed formats as-is."""
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime(modified or time.time())[:6])
+    if content_type in PRECOMPRESSED_CONTENT_TYPES:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive chunk by chunk from (ZipInfo, chunk iterable) pairs.
+
+    The sink is not seekable, so ZipFile writes sizes in data descriptors and
+    nothing is buffered beyond the chunk currently being compressed.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+        for info, chunks in entries:
+            with archive.open(info, mode='w', force_zip64=True) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
@@ -0,0 +1,234 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .metrics import record_audit_buffer_depth, record_audit_flush
+from .models import AuditLog
+
+logger = logging.getLogger('users.audit')
+
+AUDIT_BACKEND_SYNC = 'sync'
+AUDIT_BACKEND_MEMORY = 'memory'
+AUDIT_BACKEND_REDIS = 'redis'
+
+# Moves one batch from the pending list to the processing list atomically, so a
+# flusher that dies between reading and inserting leaves the batch recoverable.
+_CLAIM_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher = None
+_redis_client = None
+
+
+def _backend():
+    return settings.AUDIT_BUFFER_BACKEND
+
+
+def audit_event(user, action, target_type, target_id, metadata):
+    return {
+        'user_id': getattr(user, 'pk', None),
+        'action': action,
+        'target_type': target_type,
+        'target_id': str(target_id),
+        'metadata': metadata or {},
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+def _to_rows(events):
+    return [
+        AuditLog(
+            user_id=event['user_id'],
+            action=event['action'],
+            target_type=event['target_type'],
+            target_id=event['target_id'],
+            metadata=event['metadata'],
+            created_at=parse_datetime(event['created_at']),
+        )
+        for event in events
+    ]
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        import redis
+
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+def _processing_key():
+    return f'{settings.AUDIT_REDIS_KEY}:processing'
+
+
+def record_audit_events(events):
+    """Queue audit events for a batched insert, or write them now with the sync backend."""
+    if not events:
+        return
+
+    backend = _backend()
+    if backend == AUDIT_BACKEND_SYNC:
+        AuditLog.objects.bulk_create(_to_rows(events))
+        return
+
+    if backend == AUDIT_BACKEND_REDIS:
+        try:
+            depth = _get_redis().rpush(settings.AUDIT_REDIS_KEY, *(json.dumps(event) for event in events))
+        except Exception:
+            # Never lose an audit row because Redis is unavailable.
+            logger.exception('Could not queue audit events in Redis, writing directly')
+            AuditLog.objects.bulk_create(_to_rows(events))
+            return
+    else:
+        with _buffer_lock:
+            full = len(_buffer) + len(events) > settings.AUDIT_BUFFER_LIMIT
+            if not full:
+                _buffer.extend(events)
+            depth = len(_buffer)
+        if full:
+            # Flushes are failing; write through rather than grow the buffer or drop rows.
+            _write_through(events)
+            return
+
+    record_audit_buffer_depth(backend, depth)
+    _ensure_flusher()
+    if depth >= settings.AUDIT_BUFFER_MAX_EVENTS:
+        if backend == AUDIT_BACKEND_REDIS and settings.AUDIT_FLUSH_USE_QUEUE:
+            _enqueue_flush()
+        else:
+            flush_audit_buffer()
+
+
+def _enqueue_flush():
+    try:
+        import django_rq
+
+        django_rq.get_queue('default').enqueue(flush_audit_buffer)
+    except Exception:
+        logger.exception('Could not enqueue audit flush, flushing inline')
+        flush_audit_buffer()
+
+
+def _write_through(events):
+    started_at = time.perf_counter()
+    logger.warning('Audit buffer is at AUDIT_BUFFER_LIMIT; writing %d events directly', len(events))
+    AuditLog.objects.bulk_create(_to_rows(events))
+    record_audit_flush(AUDIT_BACKEND_MEMORY, 'write_through', len(events), time.perf_counter() - started_at)
+
+
+def _flush_memory():
+    with _buffer_lock:
+        events = list(_buffer)
+        _buffer.clear()
+    if not events:
+        return 0
+    try:
+        AuditLog.objects.bulk_create(_to_rows(events), batch_size=settings.AUDIT_BUFFER_MAX_EVENTS)
+    except Exception:
+        with _buffer_lock:
+            _buffer[:0] = events
+        raise
+    return len(events)
+
+
+def _flush_redis():
+    client = _get_redis()
+    lock = client.lock(f'{settings.AUDIT_REDIS_KEY}:lock', timeout=60, blocking=False)
+    if not lock.acquire():
+        return 0
+
+    flushed = 0
+    try:
+        # Finish a batch an earlier flusher claimed but never inserted.
+        leftover = client.lrange(_processing_key(), 0, -1)
+        if leftover:
+            AuditLog.objects.bulk_create(_to_rows(json.loads(item) for item in leftover))
+            client.delete(_processing_key())
+            flushed += len(leftover)
+
+        claim = client.register_script(_CLAIM_BATCH_SCRIPT)
+        while True:
+            items = claim(keys=[settings.AUDIT_REDIS_KEY, _processing_key()], args=[settings.AUDIT_BUFFER_MAX_EVENTS])
+            if not items:
+                break
+            AuditLog.objects.bulk_create(_to_rows(json.loads(item) for item in items))
+            client.delete(_processing_key())
+            flushed += len(items)
+    finally:
+        lock.release()
+    return flushed
+
+
+def audit_buffer_depth():
+    if _backend() == AUDIT_BACKEND_REDIS:
+        client = _get_redis()
+        return client.llen(settings.AUDIT_REDIS_KEY) + client.llen(_processing_key())
+    with _buffer_lock:
+        return len(_buffer)
+
+
+def flush_audit_buffer():
+    """Insert every buffered audit event with bulk_create. Safe to call from any thread or an rq job."""
+    backend = _backend()
+    if backend == AUDIT_BACKEND_SYNC:
+        return 0
+
+    started_at = time.perf_counter()
+    with _flush_lock:
+        try:
+            flushed = _flush_redis() if backend == AUDIT_BACKEND_REDIS else _flush_memory()
+        except Exception:
+            record_audit_flush(backend, 'error', 0, time.perf_counter() - started_at)
+            logger.exception('Audit flush failed; events stay buffered')
+            return 0
+    if flushed:
+        record_audit_flush(backend, 'success', flushed, time.perf_counter() - started_at)
+    try:
+        record_audit_buffer_depth(backend, audit_buffer_depth())
+    except Exception:
+        logger.debug('Could not read audit buffer depth', exc_info=True)
+    return flushed
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.AUDIT_FLUSH_INTERVAL)
+        try:
+            flush_audit_buffer()
+        finally:
+            close_old_connections()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None or settings.AUDIT_FLUSH_INTERVAL <= 0:
+        return
+    with _buffer_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='audit-flusher', daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def _flush_on_shutdown():
+    # Workers exit through sys.exit on SIGTERM/SIGINT, which runs atexit handlers.
+    if _backend() == AUDIT_BACKEND_MEMORY and _buffer:
+        flushed = flush_audit_buffer()
+        logger.info('Flushed %d buffered audit events on shutdown', flushed)
@@ -0,0 +1,105 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CatalogChange, CatalogVersion
+from .search import apply_catalog_changes
+
+CATALOG_VERSION_PK = 1
+# pg_advisory_xact_lock key serializing journal writers; the value is arbitrary but fixed.
+JOURNAL_LOCK_KEY = 0x5244534F
+
+_batch = threading.local()
+
+
+def get_catalog_version():
+    version = CatalogVersion.objects.filter(pk=CATALOG_VERSION_PK).values_list('version', flat=True).first()
+    return version or 0
+
+
+def bump_catalog_version():
+    """Advance the catalog version so snapshots built for the previous one are no longer served."""
+    if getattr(_batch, 'depth', 0):
+        _batch.dirty = True
+        return
+    updated = CatalogVersion.objects.filter(pk=CATALOG_VERSION_PK).update(
+        version=F('version') + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        CatalogVersion.objects.get_or_create(pk=CATALOG_VERSION_PK, defaults={'version': 1})
+
+
+def _write_journal(entries):
+    """Insert journal entries while holding the journal lock until the transaction commits.
+
+    Delta cursors are the highest journal id a client has seen, which is only safe if ids
+    become visible in order. On PostgreSQL concurrent transactions could commit a lower id
+    after a higher one, so writers take a transaction-scoped advisory lock first: the next
+    writer cannot allocate ids until the previous one has committed or rolled back. SQLite
+    already serializes writers, so it needs no lock. Every journal write must go through here.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [JOURNAL_LOCK_KEY])
+        CatalogChange.objects.bulk_create(entries, batch_size=500)
+
+
+def record_catalog_changes(model, changes):
+    """Journal (object_id, object_key, action) tuples for one model and refresh the search index.
+
+    Inside catalog_change_batch the entries are merged per object and written
+    with a single bulk_create, and the index updated once, when the batch ends.
+    """
+    entries = [
+        CatalogChange(model=model, object_id=object_id, object_key=object_key or '', action=action)
+        for object_id, object_key, action in changes
+    ]
+    if not entries:
+        return
+    if not getattr(_batch, 'depth', 0):
+        _write_journal(entries)
+        apply_catalog_changes(entries)
+        return
+    for entry in entries:
+        key = (entry.model, entry.object_id)
+        previous = _batch.changes.pop(key, None)
+        if previous is not None and previous.action == CatalogChange.ACTION_CREATE \
+                and entry.action == CatalogChange.ACTION_UPDATE:
+            entry.action = CatalogChange.ACTION_CREATE
+        _batch.changes[key] = entry
+
+
+@contextmanager
+def catalog_change_batch():
+    """Collapse the catalog changes made inside the block into one journal write and one version bump.
+
+    Run it inside the surrounding transaction so the journal commits with the rows it describes.
+    """
+    depth = getattr(_batch, 'depth', 0)
+    if not depth:
+        _batch.dirty = False
+        _batch.changes = {}
+    _batch.depth = depth + 1
+    try:
+        yield
+    except BaseException:
+        if not depth:
+            _batch.changes = {}
+            _batch.dirty = False
+        raise
+    finally:
+        _batch.depth = depth
+
+    if not depth:
+        changes, _batch.changes = list(_batch.changes.values()), {}
+        if changes:
+            _write_journal(changes)
+            apply_catalog_changes(changes)
+        if _batch.dirty:
+            _batch.dirty = False
+            bump_catalog_version()
@@ -0,0 +1,388 @@
+import hashlib
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .catalog import bump_catalog_version, catalog_change_batch, record_catalog_changes
+from .models import CatalogChange, Category, Document, Subhead
+from .previews import generate_previews
+from .snapshots import full_dump_snapshot
+
+logger = logging.getLogger('users.import_rdso')
+
+_CRAWLER_ID_RE = re.compile(r'__s(\d+)')
+# The parts of a __state__.json files_by_url entry that document_fields() reads.
+FILE_META_KEYS = ('stored_file', 'content_type', 'size', 'sha256', 'etag', 'downloaded_at', 'last_checked_at')
+# Crawl bookkeeping that moves on every run; it is written with real changes but never causes one.
+_UNFINGERPRINTED = ('crawled_at', 'last_checked_at', 'catalog_fingerprint')
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook that counts statements without keeping their SQL."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _timestamp(value):
+    parsed = parse_datetime(value) if value else None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _crawler_id(storage_path):
+    # storage_path carries the crawler's subhead id, e.g. "...__s179/..." -> "s179".
+    match = _CRAWLER_ID_RE.search(storage_path or '')
+    return f's{match.group(1)}' if match else ''
+
+
+def document_fields(record, file_meta, subhead_id):
+    """Document column values for one catalog_flat.json record."""
+    drawing_id = record['id']
+    files = record.get('files') or []
+    meta = next((file_meta[url] for url in files if url in file_meta), {})
+    fields = {
+        'document_id': str(drawing_id),
+        'name': record['file_name'],
+        'description': record.get('description') or '',
+        'version': 'Current',
+        'link': record.get('page_url') or '',
+        'internal_link': f'/api/documents/?document_ids={drawing_id}&download=false',
+        'storage_path': record.get('storage_path', ''),
+        'file_name_on_disk': meta.get('stored_file') or '',
+        'content_type': meta.get('content_type') or 'application/pdf',
+        'file_size': meta.get('size'),
+        'sha256': meta.get('sha256') or '',
+        'source_url': record.get('page_url') or '',
+        'source_file_url': files[0] if files else '',
+        'is_archived': False,
+        'subhead_id': subhead_id,
+    }
+    # Timestamps the state file does not know yet keep whatever the row already has.
+    crawled_at = _timestamp(meta.get('downloaded_at'))
+    if crawled_at is not None:
+        fields['crawled_at'] = crawled_at
+    checked_at = _timestamp(meta.get('last_checked_at'))
+    if checked_at is not None:
+        fields['last_checked_at'] = checked_at
+    fields['catalog_fingerprint'] = fingerprint(fields, meta.get('etag') or '')
+    return fields
+
+
+def fingerprint(fields, etag=''):
+    """sha256 over a record's catalog fields and its file's etag, which stands in for the content."""
+    payload = {name: value for name, value in fields.items() if name not in _UNFINGERPRINTED}
+    payload['etag'] = etag
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CatalogImporter:
+    """Set-based import of catalog_flat.json records.
+
+    Existing categories, subheads, documents and category links are preloaded
+    into dictionaries and diffed in memory, so the statement count grows with
+    the number of batches rather than the number of drawings. Documents are
+    compared by their stored catalog fingerprint, so unchanged drawings are not
+    written at all. Bulk writes send no model signals, so the importer journals
+    its own changes.
+
+    With `remove_missing`, crawler-imported documents whose drawing is no longer
+    in the catalog are archived, never deleted, so their posts survive and a
+    drawing that returns is restored. The catalog is `records` unless
+    `catalog_ids` gives every drawing id in it, for imports that arrive in
+    several batches. Such imports share one `documents` dict and run each batch
+    with run(finalize=False), which only upserts; the last run then removes,
+    links and recounts once for all of them.
+
+    `progress`, when given, is called as progress(phase, processed=, total=, stats=)
+    at the start of every phase and after every batch of documents.
+    """
+
+    def __init__(self, records, file_meta, batch_size=None, progress=None, remove_missing=False, catalog_ids=None,
+                 documents=None):
+        self.records = records
+        self.file_meta = file_meta
+        self.batch_size = batch_size or settings.CATALOG_IMPORT_BATCH_SIZE
+        self.progress = progress
+        self.remove_missing = remove_missing
+        self.catalog_ids = catalog_ids if catalog_ids is not None else {record['id'] for record in records}
+        # {document pk: (document_id, category pk)} of every document imported so far.
+        self.documents = documents if documents is not None else {}
+        self.stats = {
+            'cat_created': 0, 'sub_created': 0,
+            'doc_created': 0, 'doc_updated': 0, 'doc_unchanged': 0, 'doc_removed': 0,
+            'links_added': 0, 'links_removed': 0, 'subheads_recounted': 0,
+        }
+        self.phases = []
+        self.queries = 0
+        self.duration = 0.0
+
+    def run(self, clear=False, finalize=True):
+        counter = QueryCounter()
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(counter), transaction.atomic():
+            # The batch turns every change into one journal write, one search index
+            # update and one catalog version bump, committed with the rows.
+            with catalog_change_batch():
+                if clear:
+                    self._phase('clear', counter, self._clear)
+                category_ids = self._phase('categories', counter, self._upsert_categories)
+                subhead_ids = self._phase('subheads', counter, self._upsert_subheads, category_ids)
+                self.documents.update(
+                    self._phase('documents', counter, self._upsert_documents, category_ids, subhead_ids)
+                )
+                if finalize:
+                    # An empty catalog is a failed crawl, not a request to archive everything.
+                    if self.remove_missing and self.catalog_ids:
+                        self._phase('remove', counter, self._remove_missing)
+                    self._phase('links', counter, self._sync_links, self.documents)
+                    self._phase('drawing_counts', counter, self._refresh_drawing_counts)
+                self._report('journal')
+                flush_started = (time.perf_counter(), counter.count)
+            self.phases.append(('journal', time.perf_counter() - flush_started[0], counter.count - flush_started[1]))
+        self.duration = time.perf_counter() - started_at
+        self.queries = counter.count
+        return self.stats
+
+    def _report(self, phase, processed=None):
+        if self.progress is not None:
+            self.progress(phase, processed=processed, total=len(self.records), stats=self.stats)
+
+    def _phase(self, name, counter, step, *args):
+        self._report(name)
+        started_at, queries_before = time.perf_counter(), counter.count
+        result = step(*args)
+        self.phases.append((name, time.perf_counter() - started_at, counter.count - queries_before))
+        return result
+
+    def _clear(self):
+        # Kept on the ORM delete so signals journal each removal and update the search index.
+        _, deleted = Document.objects.filter(drawing_id__isnull=False).delete()
+        deleted = deleted.get(Document._meta.label, 0)
+        logger.warning('Cleared %d crawler-imported documents', deleted)
+        self.stats['cleared'] = deleted
+
+    def _upsert_categories(self):
+        category_ids = dict(Category.objects.values_list('name', 'pk'))
+        missing = sorted({record['category'] for record in self.records} - set(category_ids))
+        created = Category.objects.bulk_create([Category(name=name) for name in missing], batch_size=self.batch_size)
+        for category in created:
+            logger.info('Created category: %s', category.name)
+            category_ids[category.name] = category.pk
+        if created:
+            record_catalog_changes('category', [(c.pk, '', CatalogChange.ACTION_CREATE) for c in created])
+            bump_catalog_version()
+        self.stats['cat_created'] = len(created)
+        return category_ids
+
+    def _upsert_subheads(self, category_ids):
+        subhead_ids = {
+            (category_id, name): pk for pk, category_id, name in Subhead.objects.values_list('pk', 'category_id', 'name')
+        }
+        missing = {}
+        for record in self.records:
+            key = (category_ids[record['category']], record['subhead'])
+            if key not in subhead_ids and key not in missing:
+                missing[key] = Subhead(
+                    name=record['subhead'], category_id=key[0], crawler_id=_crawler_id(record.get('storage_path')),
+                )
+        created = Subhead.objects.bulk_create(list(missing.values()), batch_size=self.batch_size)
+        for subhead in created:
+            logger.debug('Created subhead: %s', subhead.name)
+            subhead_ids[(subhead.category_id, subhead.name)] = subhead.pk
+        if created:
+            record_catalog_changes('subhead', [(s.pk, '', CatalogChange.ACTION_CREATE) for s in created])
+            bump_catalog_version()
+        self.stats['sub_created'] = len(created)
+        return subhead_ids
+
+    def _upsert_documents(self, category_ids, subhead_ids):
+        """Create or update one document per drawing; return {document pk: (document_id, category pk)}."""
+        wanted = {}
+        for record in self.records:
+            category_id = category_ids[record['category']]
+            subhead_id = subhead_ids[(category_id, record['subhead'])]
+            # A drawing listed twice keeps its last entry, as sequential upserts did.
+            wanted[record['id']] = (document_fields(record, self.file_meta, subhead_id), category_id)
+
+        existing = {
+            drawing_id: (pk, stored, archived)
+            for pk, drawing_id, stored, archived in Document.objects.filter(drawing_id__isnull=False)
+            .values_list('pk', 'drawing_id', 'catalog_fingerprint', 'is_archived').iterator(chunk_size=2000)
+        }
+        self.existing_drawings = existing
+        legacy_rows = self._load_unfingerprinted(existing, wanted)
+
+        now = timezone.now()
+        to_create, to_update, backfill = [], {}, []
+        documents = {}
+        for drawing_id, (fields, category_id) in wanted.items():
+            if drawing_id not in existing:
+                to_create.append((Document(drawing_id=drawing_id, **fields), category_id))
+                continue
+            pk, stored, _ = existing[drawing_id]
+            documents[pk] = (fields['document_id'], category_id)
+            if stored == fields['catalog_fingerprint']:
+                self.stats['doc_unchanged'] += 1
+                continue
+            legacy = legacy_rows.get(pk)
+            if legacy is not None and all(legacy[name] == fields[name] for name in legacy if name != 'pk'):
+                # Imported before fingerprints existed and still current: store the fingerprint quietly.
+                backfill.append(Document(pk=pk, catalog_fingerprint=fields['catalog_fingerprint']))
+                self.stats['doc_unchanged'] += 1
+                continue
+            # bulk_update skips auto_now, and incremental dumps filter on last_updated. Rows are
+            # grouped by field set so a timestamp missing from the state file is not written as NULL.
+            document = Document(pk=pk, drawing_id=drawing_id, last_updated=now, **fields)
+            to_update.setdefault(tuple(sorted(fields)) + ('last_updated',), []).append(document)
+
+        processed = self.stats['doc_unchanged']
+        self._report('documents', processed)
+        created = []
+        for start in range(0, len(to_create), self.batch_size):
+            batch = to_create[start:start + self.batch_size]
+            created += Document.objects.bulk_create([document for document, _ in batch])
+            for document, (_, category_id) in zip(created[start:], batch):
+                documents[document.pk] = (document.document_id, category_id)
+            processed += len(batch)
+            self._report('documents', processed)
+        updated = []
+        for update_fields, group in to_update.items():
+            for start in range(0, len(group), self.batch_size):
+                batch = group[start:start + self.batch_size]
+                Document.objects.bulk_update(batch, list(update_fields))
+                updated += batch
+                processed += len(batch)
+                self._report('documents', processed)
+        Document.objects.bulk_update(backfill, ['catalog_fingerprint'], batch_size=self.batch_size)
+
+        changes = [(d.pk, d.document_id, CatalogChange.ACTION_CREATE) for d in created]
+        changes += [(d.pk, d.document_id, CatalogChange.ACTION_UPDATE) for d in updated]
+        if changes:
+            record_catalog_changes('document', changes)
+            bump_catalog_version()
+        self.stats['doc_created'] = len(created)
+        self.stats['doc_updated'] = len(updated)
+        return documents
+
+    def _load_unfingerprinted(self, existing, wanted):
+        """Full rows of documents imported before fingerprints were stored, keyed by pk."""
+        pks = [pk for pk, stored, _ in existing.values() if not stored]
+        if not pks:
+            return {}
+        compared = {name for fields, _ in wanted.values() for name in fields if name not in _UNFINGERPRINTED}
+        rows = {}
+        for start in range(0, len(pks), self.batch_size):
+            for row in Document.objects.filter(pk__in=pks[start:start + self.batch_size]).values('pk', *compared):
+                rows[row['pk']] = row
+        return rows
+
+    def _remove_missing(self):
+        missing = [
+            pk for drawing_id, (pk, _, archived) in self.existing_drawings.items()
+            if drawing_id not in self.catalog_ids and not archived
+        ]
+        now = timezone.now()
+        changes = []
+        for start in range(0, len(missing), self.batch_size):
+            batch = Document.objects.filter(pk__in=missing[start:start + self.batch_size])
+            changes += [
+                (pk, document_id, CatalogChange.ACTION_UPDATE) for pk, document_id in batch.values_list('pk', 'document_id')
+            ]
+            # Clearing the fingerprint makes a drawing that reappears compare as changed and be unarchived.
+            batch.update(is_archived=True, catalog_fingerprint='', last_updated=now)
+        if changes:
+            record_catalog_changes('document', changes)
+            bump_catalog_version()
+            logger.info('Archived %d documents no longer in the catalog', len(changes))
+        self.stats['doc_removed'] = len(changes)
+
+    def _sync_links(self, documents):
+        """Give every imported document exactly its record's category, as category.set([cat]) did."""
+        through = Document.category.through
+        current = {}
+        for pk, document_id, category_id in through.objects.filter(
+            document__drawing_id__isnull=False,
+        ).values_list('pk', 'document_id', 'category_id').iterator(chunk_size=2000):
+            current.setdefault(document_id, []).append((pk, category_id))
+
+        to_add, to_remove, touched = [], [], set()
+        for document_pk, (_, category_id) in documents.items():
+            links = current.get(document_pk, [])
+            if not any(linked == category_id for _, linked in links):
+                to_add.append(through(document_id=document_pk, category_id=category_id))
+                touched.add(document_pk)
+            stale = [pk for pk, linked in links if linked != category_id]
+            if stale:
+                to_remove.extend(stale)
+                touched.add(document_pk)
+
+        through.objects.bulk_create(to_add, batch_size=self.batch_size)
+        for start in range(0, len(to_remove), self.batch_size):
+            through.objects.filter(pk__in=to_remove[start:start + self.batch_size]).delete()
+
+        if touched:
+            record_catalog_changes(
+                'document', [(pk, documents[pk][0], CatalogChange.ACTION_UPDATE) for pk in sorted(touched)],
+            )
+            bump_catalog_version()
+        self.stats['links_added'] = len(to_add)
+        self.stats['links_removed'] = len(to_remove)
+
+    def _refresh_drawing_counts(self):
+        counts = (
+            Document.objects.filter(subhead=OuterRef('pk')).order_by().values('subhead')
+            .annotate(total=Count('pk')).values('total')
+        )
+        fresh = Coalesce(Subquery(counts), Value(0))
+        stale = list(
+            Subhead.objects.annotate(fresh=fresh).exclude(drawing_count=F('fresh')).values_list('pk', flat=True)
+        )
+        for start in range(0, len(stale), self.batch_size):
+            Subhead.objects.filter(pk__in=stale[start:start + self.batch_size]).update(drawing_count=fresh)
+        if stale:
+            record_catalog_changes('subhead', [(pk, '', CatalogChange.ACTION_UPDATE) for pk in stale])
+            bump_catalog_version()
+        self.stats['subheads_recounted'] = len(stale)
+
+    def summary(self):
+        phases = ', '.join(f'{name} {seconds:.2f}s/{queries}q' for name, seconds, queries in self.phases)
+        return f'Import took {self.duration:.2f}s and {self.queries} queries ({phases})'
+
+
+def finish_import(write, progress=None, previews=True):
+    """Render missing previews and build the dump snapshot after an import, as settings allow."""
+    progress = progress or (lambda phase, **counters: None)
+    if settings.PREVIEW_GENERATE_ON_IMPORT and previews:
+        progress('previews')
+        documents = Document.objects.exclude(sha256='').only(
+            'document_id', 'sha256', 'storage_path', 'file_name_on_disk', 'content_type',
+        )
+        preview_stats = generate_previews(documents.iterator())
+        msg = (
+            f"Previews: {preview_stats['created']} created, "
+            f"{preview_stats['unavailable']} unavailable, "
+            f"{preview_stats['failed']} failed, {preview_stats['skipped']} up to date or skipped"
+        )
+        logger.info(msg)
+        write(msg)
+
+    if settings.DUMP_SNAPSHOT_ENABLED:
+        progress('snapshot')
+        snapshot = full_dump_snapshot()
+        msg = f"Dump snapshot v{snapshot['version']}: {snapshot['document_count']} documents, {snapshot['size']} bytes"
+        logger.info(msg)
+        write(msg)
@@ -0,0 +1,324 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from .metrics import record_catalog_import, record_crawler_queue_depth
+from .models import CatalogImportRun
+
+logger = logging.getLogger('users.import_rdso')
+
+RUNNING_STATUSES = (CatalogImportRun.STATUS_QUEUED, CatalogImportRun.STATUS_RUNNING)
+CATALOG_FILES_LOCK_KEY = 'catalog-files:lock'
+_START_LOCK_KEY = 'catalog-import:start'
+_START_LOCK_SECONDS = 10
+# RQ job states in which the job will never run (or finish) the import.
+_DEAD_JOB_STATUSES = ('finished', 'failed', 'stopped', 'canceled')
+# The row's heartbeat is refreshed at most this often; the cache gets every progress update.
+_HEARTBEAT_SECONDS = 5
+
+
+def _cache_key(run_id):
+    return f'catalog-import:{run_id}:progress'
+
+
+@contextmanager
+def catalog_files_lock(owner):
+    """Hold the lock that keeps crawler runs and catalog imports from overlapping.
+
+    The crawler rewrites the JSON files an import reads, so both jobs take this lock for their
+    whole run, on any number of workers or the thread fallback. Expiry only frees the lock of a
+    killed worker; a job that finds it held fails instead of waiting.
+    """
+    timeout = max(settings.CRAWLER_JOB_TIMEOUT, settings.CATALOG_IMPORT_JOB_TIMEOUT)
+    if not cache.add(CATALOG_FILES_LOCK_KEY, owner, timeout=timeout):
+        holder = cache.get(CATALOG_FILES_LOCK_KEY) or 'another job'
+        raise RuntimeError(f'The catalog files are in use by {holder}; try again once it finishes')
+    try:
+        yield
+    finally:
+        cache.delete(CATALOG_FILES_LOCK_KEY)
+
+
+def _row_progress(run):
+    return {
+        'phase': run.phase,
+        'records_processed': run.records_processed,
+        'records_total': run.records_total,
+        'phase_durations': run.phase_durations,
+        'stats': run.stats,
+        'log_tail': list(run.log_tail or []),
+        'total_log_lines': run.total_log_lines,
+    }
+
+
+def _get_progress(run):
+    """Live progress of a run: the import commits in one transaction, so until then it lives in the cache."""
+    try:
+        cached = cache.get(_cache_key(run.id))
+    except Exception:
+        cached = None
+    if isinstance(cached, dict):
+        return cached
+    return _row_progress(run)
+
+
+def _set_progress(run_id, progress):
+    try:
+        cache.set(_cache_key(run_id), progress, timeout=settings.CRAWLER_LOG_CACHE_TTL)
+    except Exception:
+        logger.debug('Could not cache progress for catalog import %s', run_id, exc_info=True)
+
+
+def _update_queue_depth():
+    if not settings.CATALOG_IMPORT_USE_QUEUE:
+        return
+
+    try:
+        import django_rq
+
+        queue = django_rq.get_queue('crawler')
+        record_crawler_queue_depth('crawler', queue.count)
+    except Exception:
+        logger.debug('Could not inspect crawler queue depth', exc_info=True)
+
+
+def get_current_catalog_import(run_id=None):
+    queryset = CatalogImportRun.objects.all()
+    if run_id:
+        return queryset.filter(pk=run_id).first()
+
+    active = queryset.filter(status__in=RUNNING_STATUSES).order_by('-created_at').first()
+    if active:
+        return active
+    return queryset.order_by('-created_at').first()
+
+
+def get_catalog_import_progress(run, since=0):
+    """Return (progress dict, new log lines, total log lines, truncated) for a poll starting at line `since`."""
+    progress = _get_progress(run)
+    logs = progress['log_tail']
+    total_lines = progress['total_log_lines'] or len(logs)
+    first_available_index = max(total_lines - len(logs), 0)
+    start = max(max(since, first_available_index) - first_available_index, 0)
+    return progress, logs[start:], total_lines, since < first_available_index
+
+
+def rq_job_status(job_id, queue_name='crawler'):
+    """Status of an RQ job: None when it no longer exists, '' when it cannot be checked."""
+    try:
+        import django_rq
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job
+
+        try:
+            job = Job.fetch(job_id, connection=django_rq.get_connection(queue_name))
+        except NoSuchJobError:
+            return None
+        return str(getattr(job.get_status(), 'value', job.get_status()))
+    except Exception:
+        logger.debug('Could not look up RQ job %s', job_id, exc_info=True)
+        return ''
+
+
+def _is_abandoned(run):
+    """True for a queued or running run whose worker is gone: killed, timed out, OOM or redeployed."""
+    if run.execution_mode == CatalogImportRun.EXECUTION_QUEUE and run.job_id:
+        job_status = rq_job_status(run.job_id)
+        if job_status is None or job_status in _DEAD_JOB_STATUSES:
+            return True
+    last_seen = run.last_heartbeat or run.started_at or run.created_at
+    return timezone.now() - last_seen > timedelta(seconds=settings.CATALOG_IMPORT_STALE_SECONDS)
+
+
+def _fail_abandoned(run):
+    finished_at = timezone.now()
+    run.status = CatalogImportRun.STATUS_FAILED
+    run.error_message = f'Abandoned: the worker stopped without finishing (last seen {run.last_heartbeat or run.created_at})'
+    run.finished_at = finished_at
+    run.save(update_fields=['status', 'error_message', 'finished_at', 'updated_at'])
+    logger.warning('Catalog import %s was abandoned by its worker; marked failed', run.id)
+
+
+@contextmanager
+def _start_lock():
+    """Serialize the check-then-create in start_catalog_import between concurrent requests."""
+    deadline = time.monotonic() + _START_LOCK_SECONDS
+    # The timeout only frees the lock of a request that died holding it.
+    while not cache.add(_START_LOCK_KEY, True, timeout=_START_LOCK_SECONDS) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        cache.delete(_START_LOCK_KEY)
+
+
+def start_catalog_import(user):
+    with _start_lock():
+        active_run = CatalogImportRun.objects.filter(status__in=RUNNING_STATUSES).order_by('-created_at').first()
+        if active_run and not _is_abandoned(active_run):
+            return active_run, 'already_running'
+        if active_run:
+            _fail_abandoned(active_run)
+
+        execution_mode = (
+            CatalogImportRun.EXECUTION_QUEUE if settings.CATALOG_IMPORT_USE_QUEUE else CatalogImportRun.EXECUTION_THREAD
+        )
+        run = CatalogImportRun.objects.create(initiated_by=user, execution_mode=execution_mode)
+    _set_progress(run.id, _row_progress(run))
+
+    if settings.CATALOG_IMPORT_USE_QUEUE:
+        try:
+            import django_rq
+
+            # Shares the crawler queue so a single worker runs crawls and imports in turn;
+            # catalog_files_lock keeps them apart on more workers.
+            queue = django_rq.get_queue('crawler')
+            job = queue.enqueue(execute_catalog_import, run.id, job_timeout=settings.CATALOG_IMPORT_JOB_TIMEOUT)
+            run.job_id = job.id
+            run.save(update_fields=['job_id', 'updated_at'])
+            _update_queue_depth()
+            return run, 'started'
+        except Exception:
+            logger.exception('Failed to enqueue catalog import %s, falling back to a thread', run.id)
+            run.execution_mode = CatalogImportRun.EXECUTION_THREAD
+            run.save(update_fields=['execution_mode', 'updated_at'])
+
+    threading.Thread(target=_execute_in_thread, args=(run.id,), daemon=True).start()
+    return run, 'started'
+
+
+def _execute_in_thread(run_id):
+    try:
+        execute_catalog_import(run_id)
+    finally:
+        # The thread's connection is never reused; close it instead of leaving it to the GC.
+        connection.close()
+
+
+class _ProgressTracker:
+    """Collects the command's output lines and phase reports for one run."""
+
+    def __init__(self, run):
+        self.run = run
+        self.progress = _row_progress(run)
+        self.phase_started = None
+        self.saved_at = 0.0
+        self._partial = ''
+
+    # The command's stdout/stderr OutputWrapper only needs write(), flush() and isatty().
+    def write(self, text):
+        self._partial += text
+        *lines, self._partial = self._partial.split('\n')
+        for line in lines:
+            self._log(line.rstrip())
+        self._publish()
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def _log(self, line):
+        if not line:
+            return
+        progress = self.progress
+        progress['total_log_lines'] += 1
+        progress['log_tail'] = (progress['log_tail'] + [line])[-settings.CRAWLER_LOG_TAIL_LIMIT:]
+
+    def _close_phase(self):
+        if self.phase_started is not None:
+            durations = self.progress['phase_durations']
+            phase = self.progress['phase']
+            durations[phase] = round(durations.get(phase, 0) + time.perf_counter() - self.phase_started, 3)
+            self.phase_started = None
+
+    def update(self, phase, processed=None, total=None, stats=None):
+        progress = self.progress
+        if phase != progress['phase'] or self.phase_started is None:
+            self._close_phase()
+            progress['phase'] = phase
+            self.phase_started = time.perf_counter()
+            self._log(f'Phase: {phase}')
+        if processed is not None:
+            progress['records_processed'] = processed
+        if total is not None:
+            progress['records_total'] = total
+        if stats is not None:
+            progress['stats'] = dict(stats)
+        self._publish()
+
+    def _publish(self):
+        _set_progress(self.run.id, self.progress)
+        now = time.monotonic()
+        if now - self.saved_at >= _HEARTBEAT_SECONDS:
+            self.saved_at = now
+            # Inside the import transaction this update only becomes visible at commit; the cache covers the gap.
+            CatalogImportRun.objects.filter(pk=self.run.pk).update(last_heartbeat=timezone.now())
+
+    def finish(self):
+        if self._partial:
+            self._log(self._partial.rstrip())
+            self._partial = ''
+        self._close_phase()
+        run, progress = self.run, self.progress
+        run.phase = progress['phase']
+        run.records_processed = progress['records_processed']
+        run.records_total = progress['records_total']
+        run.phase_durations = progress['phase_durations']
+        run.stats = progress['stats']
+        run.log_tail = progress['log_tail']
+        run.total_log_lines = progress['total_log_lines']
+        _set_progress(run.id, progress)
+
+
+def execute_catalog_import(run_id):
+    run = CatalogImportRun.objects.get(pk=run_id)
+    started_perf = time.perf_counter()
+    run.status = CatalogImportRun.STATUS_RUNNING
+    run.started_at = timezone.now()
+    run.last_heartbeat = run.started_at
+    run.error_message = ''
+    run.save(update_fields=['status', 'started_at', 'last_heartbeat', 'error_message', 'updated_at'])
+    _update_queue_depth()
+
+    tracker = _ProgressTracker(run)
+    outcome = 'success'
+    try:
+        with catalog_files_lock(f'catalog import {run.id}'):
+            call_command('import_rdso_catalog', stdout=tracker, stderr=tracker, progress=tracker.update)
+        run.status = CatalogImportRun.STATUS_SUCCEEDED
+    except Exception as exc:
+        logger.exception('Catalog import %s failed', run.id)
+        outcome = 'error'
+        run.status = CatalogImportRun.STATUS_FAILED
+        run.error_message = str(exc)
+    finally:
+        tracker.finish()
+        finished_at = timezone.now()
+        run.finished_at = finished_at
+        run.last_heartbeat = finished_at
+        run.save(update_fields=[
+            'status',
+            'finished_at',
+            'last_heartbeat',
+            'error_message',
+            'phase',
+            'records_processed',
+            'records_total',
+            'phase_durations',
+            'stats',
+            'log_tail',
+            'total_log_lines',
+            'updated_at',
+        ])
+        record_catalog_import(outcome, time.perf_counter() - started_perf, run.phase_durations)
+        _update_queue_depth()
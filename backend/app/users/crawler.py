@@ -8,6 +8,9 @@ from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 
+from .catalog_jobs import catalog_files_lock
+from .crawler_import import IMPORT_MODE_OFF, CrawlerRecordImport
+from .jsonstream import read_keys
 from .metrics import (
     record_crawler_completion,
     record_crawler_log_line,
@@ -20,6 +23,9 @@ logger = logging.getLogger('users.crawler')
 
 RUNNING_STATUSES = (CrawlerRun.STATUS_QUEUED, CrawlerRun.STATUS_RUNNING)
 
+# ((path, mtime_ns, size), meta) of the last __meta__.json read.
+_crawl_meta = (None, {})
+
 
 def _cache_key(run_id):
     return f'crawler-run:{run_id}:logs'
@@ -56,6 +62,29 @@ def _update_queue_depth():
         logger.debug('Could not inspect crawler queue depth', exc_info=True)
 
 
+def read_crawl_meta():
+    """generated_at_utc and totals from the crawler's __meta__.json, re-read only when the file changes."""
+    global _crawl_meta
+    meta_path = Path(settings.RDSO_STORAGE_ROOT) / '__meta__.json'
+    try:
+        stat = meta_path.stat()
+    except OSError:
+        return {}
+    key = (str(meta_path), stat.st_mtime_ns, stat.st_size)
+    cached_key, cached_meta = _crawl_meta
+    if cached_key == key:
+        return cached_meta
+    try:
+        # The file also lists every removed drawing and file, which the status poll never needs.
+        meta = read_keys(meta_path, ('generated_at_utc', 'totals'))
+    except (OSError, ValueError):
+        # The crawler rewrites the file in place; keep serving the last complete read meanwhile.
+        logger.debug('Could not read %s', meta_path, exc_info=True)
+        return cached_meta if cached_key and cached_key[0] == key[0] else {}
+    _crawl_meta = (key, meta)
+    return meta
+
+
 def get_current_crawler_run(run_id=None):
     queryset = CrawlerRun.objects.all()
     if run_id:
@@ -125,6 +154,17 @@ def start_crawler_run(user):
     return run, 'started'
 
 
+def _supports_emit_records(crawler_script):
+    """True when the deployed crawler script knows --emit-records; older copies reject it in argparse.
+
+    An unreadable script is left for the crawl itself to report.
+    """
+    try:
+        return '--emit-records' in crawler_script.read_text(encoding='utf-8', errors='replace')
+    except OSError:
+        return True
+
+
 def execute_crawler_run(run_id):
     run = CrawlerRun.objects.get(pk=run_id)
     started_perf = time.perf_counter()
@@ -132,6 +172,7 @@ def execute_crawler_run(run_id):
     total_lines = run.total_log_lines or len(logs)
     exit_code = None
     error_message = ''
+    records = CrawlerRecordImport(settings.CRAWLER_IMPORT_MODE) if settings.CRAWLER_IMPORT_MODE != IMPORT_MODE_OFF else None
 
     run.status = CrawlerRun.STATUS_RUNNING
     run.started_at = timezone.now()
@@ -142,48 +183,71 @@ def execute_crawler_run(run_id):
     _update_queue_depth()
 
     try:
-        crawler_script = Path(settings.RDSO_STORAGE_ROOT) / 'rdso_site_crawler.py'
-        proc = subprocess.Popen(
-            [
+        with catalog_files_lock(f'crawler run {run.id}'):
+            crawler_script = Path(settings.RDSO_STORAGE_ROOT) / 'rdso_site_crawler.py'
+            if records is not None and not _supports_emit_records(crawler_script):
+                message = (
+                    f'Catalog import ({settings.CRAWLER_IMPORT_MODE}): skipped, {crawler_script} does not '
+                    'support --emit-records; deploy the current crawler or run import_rdso_catalog'
+                )
+                logger.warning('Crawler run %s: %s', run.id, message)
+                total_lines += 1
+                logs.append(message)
+                records = None
+            command = [
                 settings.PYTHON_EXECUTABLE if hasattr(settings, 'PYTHON_EXECUTABLE') else 'python',
                 str(crawler_script),
                 '--storage-root',
                 str(settings.RDSO_STORAGE_ROOT),
-            ],
-            cwd=str(settings.RDSO_STORAGE_ROOT),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
-            bufsize=1,
-        )
-        run.pid = proc.pid
-        run.save(update_fields=['pid', 'updated_at'])
-
-        if proc.stdout is not None:
-            for raw_line in proc.stdout:
-                line = raw_line.rstrip()
-                if not line:
-                    continue
-                total_lines += 1
-                logs.append(line)
+            ]
+            if records is not None:
+                command.append('--emit-records')
+            proc = subprocess.Popen(
+                command,
+                cwd=str(settings.RDSO_STORAGE_ROOT),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1,
+            )
+            run.pid = proc.pid
+            run.save(update_fields=['pid', 'updated_at'])
+
+            if proc.stdout is not None:
+                for raw_line in proc.stdout:
+                    line = raw_line.rstrip()
+                    if not line:
+                        continue
+                    # Record lines go to the importer, never into the log tail.
+                    if records is not None and records.feed(line):
+                        continue
+                    total_lines += 1
+                    logs.append(line)
+                    logs = logs[-settings.CRAWLER_LOG_TAIL_LIMIT:]
+                    _set_logs(run.id, logs)
+                    record_crawler_log_line()
+
+                    if total_lines % 25 == 0:
+                        run.log_tail = logs
+                        run.total_log_lines = total_lines
+                        run.last_heartbeat = timezone.now()
+                        run.save(update_fields=['log_tail', 'total_log_lines', 'last_heartbeat', 'updated_at'])
+
+            exit_code = proc.wait()
+            if exit_code == 0:
+                run.status = CrawlerRun.STATUS_SUCCEEDED
+            else:
+                run.status = CrawlerRun.STATUS_FAILED
+                error_message = f'Crawler exited with code {exit_code}'
+
+            if records is not None:
+                for line in records.finish(crawl_succeeded=exit_code == 0):
+                    total_lines += 1
+                    logs.append(line)
                 logs = logs[-settings.CRAWLER_LOG_TAIL_LIMIT:]
-                _set_logs(run.id, logs)
-                record_crawler_log_line()
-
-                if total_lines % 25 == 0:
-                    run.log_tail = logs
-                    run.total_log_lines = total_lines
-                    run.last_heartbeat = timezone.now()
-                    run.save(update_fields=['log_tail', 'total_log_lines', 'last_heartbeat', 'updated_at'])
-
-        exit_code = proc.wait()
-        if exit_code == 0:
-            run.status = CrawlerRun.STATUS_SUCCEEDED
-        else:
-            run.status = CrawlerRun.STATUS_FAILED
-            error_message = f'Crawler exited with code {exit_code}'
+                run.metadata = {**run.metadata, 'catalog_import': records.as_metadata()}
     except Exception as exc:
         logger.exception('Crawler run %s failed', run.id)
         run.status = CrawlerRun.STATUS_FAILED
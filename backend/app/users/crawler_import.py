@@ -0,0 +1,119 @@
+import json
+import logging
+
+from django.conf import settings
+
+from .catalog_import import CatalogImporter, finish_import
+from .metrics import record_catalog_import
+
+logger = logging.getLogger('users.crawler')
+
+# Must match RECORD_PREFIX in backend/crawler/rdso_site_crawler.py.
+RECORD_PREFIX = '@@catalog-record '
+
+IMPORT_MODE_OFF = 'off'
+IMPORT_MODE_STREAM = 'stream'
+IMPORT_MODE_COMPLETE = 'complete'
+IMPORT_MODES = (IMPORT_MODE_OFF, IMPORT_MODE_STREAM, IMPORT_MODE_COMPLETE)
+
+_REPORTED_STATS = ('cat_created', 'sub_created', 'doc_created', 'doc_updated', 'doc_unchanged', 'doc_removed')
+
+
+class CrawlerRecordImport:
+    """Imports the drawing records a crawler run prints with --emit-records.
+
+    In stream mode records are applied in batches of CATALOG_IMPORT_BATCH_SIZE as
+    they arrive, while the crawler is still writing its JSON files; in complete
+    mode they are applied together once the crawler exits successfully. The
+    importer's fingerprints skip unchanged drawings either way. Stream batches
+    only upsert; category links and drawing counts are synced once at the end.
+    With CRAWLER_IMPORT_REMOVE_MISSING, drawings the crawl no longer lists are
+    archived after a successful exit, when the full set is known.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.pending = []
+        self.file_meta = {}
+        self.drawing_ids = set()
+        self.documents = {}
+        self.received = 0
+        self.batches = 0
+        self.duration = 0.0
+        self.phase_durations = {}
+        self.stats = dict.fromkeys(_REPORTED_STATS, 0)
+        self.error = ''
+
+    def feed(self, line):
+        """Take one line of crawler output; return False if it is not a record line."""
+        if not line.startswith(RECORD_PREFIX):
+            return False
+        try:
+            record = json.loads(line[len(RECORD_PREFIX):])
+        except ValueError:
+            logger.warning('Ignoring malformed crawler record line: %.200s', line)
+            return True
+        self.received += 1
+        self.file_meta.update(record.pop('file_meta', None) or {})
+        self.pending.append(record)
+        self.drawing_ids.add(record['id'])
+        if self.mode == IMPORT_MODE_STREAM and len(self.pending) >= settings.CATALOG_IMPORT_BATCH_SIZE:
+            self._apply(finalize=False)
+        return True
+
+    def finish(self, crawl_succeeded):
+        """Apply what is left and return the summary lines for the crawler log."""
+        if crawl_succeeded:
+            self._apply(finalize=True, remove_missing=settings.CRAWLER_IMPORT_REMOVE_MISSING)
+        elif self.mode == IMPORT_MODE_STREAM:
+            # Emitted records are final, but without a complete crawl nothing may be archived.
+            self._apply(finalize=True)
+        self.pending, self.file_meta = [], {}
+
+        if not self.batches and not self.error:
+            return [f'Catalog import ({self.mode}): skipped, the crawl did not complete']
+        stats = self.stats
+        lines = [
+            f'Catalog import ({self.mode}): {self.received} records in {self.batches} batches, '
+            f"{stats['doc_created']} documents created, {stats['doc_updated']} documents updated, "
+            f"{stats['doc_unchanged']} unchanged, {stats['doc_removed']} removed in {self.duration:.2f}s"
+        ]
+        if self.error:
+            lines.append(f'Catalog import failed: {self.error}')
+        record_catalog_import('error' if self.error else 'success', self.duration, self.phase_durations)
+        if self.batches and not self.error:
+            finish_import(lines.append)
+        return lines
+
+    def as_metadata(self):
+        return {
+            'mode': self.mode,
+            'records': self.received,
+            'batches': self.batches,
+            'stats': self.stats,
+            'duration_seconds': round(self.duration, 3),
+            'error': self.error,
+        }
+
+    def _apply(self, finalize, remove_missing=False):
+        if self.error or not (self.pending or finalize):
+            return
+        importer = CatalogImporter(
+            self.pending, self.file_meta, remove_missing=remove_missing, catalog_ids=self.drawing_ids,
+            documents=self.documents,
+        )
+        self.pending, self.file_meta = [], {}
+        try:
+            stats = importer.run(finalize=finalize)
+        except Exception as exc:
+            logger.exception('Importing crawler records failed')
+            self.error = str(exc)
+            return
+        finally:
+            self.duration += importer.duration
+        self.batches += 1
+        for key in _REPORTED_STATS:
+            self.stats[key] += stats[key]
+        for name, seconds, _ in importer.phases:
+            self.phase_durations[name] = self.phase_durations.get(name, 0) + seconds
+        logger.info('Applied crawler record batch %d: %s', self.batches, importer.summary())
@@ -0,0 +1,126 @@
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+
+from .catalog import get_catalog_version
+from .metrics import record_search
+from .models import Document
+
+# "Alt-3", "ALT3", "Alteration No. 3", "alt.A" -> alteration "3" / "A". The keyword must end at a
+# word boundary or a digit, and the value is a number or a single letter, so "ALTERNATOR" never matches.
+_ALTERATION_RE = re.compile(r'\bALT(?:ERATION)?(?:\b|(?=\d))(?:\s*NO\b\.?)?[\s.\-_:]*(\d+[A-Z]?|[A-Z]\b)')
+# Letter prefix plus a number of three or more digits, with optional trailing groups: "SK-12345", "WD 89030-S-01", "RDSO/SK/1234".
+_DRAWING_NUMBER_RE = re.compile(r'\b[A-Z]{1,8}(?:/[A-Z]{1,8})*[\s\-_/.]{0,2}\d{3}[\dA-Z]*(?:[\-/.][\dA-Z]+)*')
+_NOT_ALNUM_RE = re.compile(r'[^A-Z0-9]')
+
+_lock = threading.Lock()
+_index = None
+
+
+def _split_alteration(text):
+    text = (text or '').upper()
+    match = _ALTERATION_RE.search(text)
+    if not match:
+        return text, ''
+    return text[:match.start()] + ' ' + text[match.end():], match.group(1)
+
+
+def parse_identifier(text):
+    """Split free text into (canonical drawing numbers, alteration or '').
+
+    Canonical numbers drop case and separators, so "sk-12345" and "SK 12345" agree.
+    """
+    text, alteration = _split_alteration(text)
+    numbers = [_NOT_ALNUM_RE.sub('', found) for found in _DRAWING_NUMBER_RE.findall(text)]
+    return [number for number in numbers if number], alteration
+
+
+def _trigrams(canonical):
+    padded = f'  {canonical} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IdentifierIndex:
+    """Trigram postings over the canonical drawing numbers of every document."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.entries = []
+        postings = {}
+        for document_pk, text in rows:
+            numbers, alteration = parse_identifier(text)
+            for canonical in numbers:
+                entry_id = len(self.entries)
+                grams = _trigrams(canonical)
+                self.entries.append((document_pk, canonical, alteration, len(grams)))
+                for gram in grams:
+                    postings.setdefault(gram, array('I')).append(entry_id)
+        self.postings = postings
+        # Trigrams shared by most entries (e.g. the leading "  S" of every SK drawing) say little
+        # and dominate the counting cost, so lookups skip them when rarer ones are available.
+        self.common_cutoff = max(len(self.entries) // 20, 1)
+
+    def lookup(self, query, limit, min_similarity):
+        """Return [(document_pk, canonical, alteration, score)], best first, one row per document."""
+        numbers, alteration = parse_identifier(query)
+        # The whole query, separators dropped, also counts: users type "RDSO SK K 4521"
+        # where the catalog has "RDSO/SK/K-4521", or just the digits.
+        collapsed = _NOT_ALNUM_RE.sub('', _split_alteration(query)[0])
+        if collapsed and collapsed not in numbers:
+            numbers.append(collapsed)
+
+        best = {}
+        for number in numbers:
+            grams = _trigrams(number)
+            lists = [self.postings[gram] for gram in grams if gram in self.postings]
+            rare = [posting for posting in lists if len(posting) <= self.common_cutoff]
+            shared = Counter()
+            for posting in rare or lists:
+                shared.update(posting)
+            # Rare-trigram hits only shortlist candidates; the score uses the full trigram sets.
+            for entry_id, _ in shared.most_common(max(limit * 5, 50)):
+                document_pk, canonical, entry_alteration, gram_count = self.entries[entry_id]
+                hits = len(grams & _trigrams(canonical))
+                score = hits / (len(grams) + gram_count - hits)
+                if canonical == number:
+                    score = 1.0
+                if score < min_similarity:
+                    continue
+                if alteration:
+                    score += 0.1 if entry_alteration == alteration else -0.05
+                if score > best.get(document_pk, (None, None, None, -1))[3]:
+                    best[document_pk] = (document_pk, canonical, entry_alteration, score)
+
+        return sorted(best.values(), key=lambda row: (-row[3], row[1]))[:limit]
+
+
+def _load_rows():
+    for document_pk, document_id, name in Document.objects.values_list('pk', 'document_id', 'name').iterator():
+        yield document_pk, f'{name} {document_id}' if document_id != name else name
+
+
+def get_identifier_index():
+    """Return the in-memory index, rebuilding it when the catalog version has moved on."""
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or _index.version != version:
+            started_at = time.perf_counter()
+            _index = IdentifierIndex(version, _load_rows())
+            record_search('identifier_build', time.perf_counter() - started_at)
+        return _index
+
+
+def search_identifiers(query, limit):
+    index = get_identifier_index()
+    started_at = time.perf_counter()
+    matches = index.lookup(query, limit, settings.IDENTIFIER_MIN_SIMILARITY)
+    record_search('identifier', time.perf_counter() - started_at)
+    return matches, parse_identifier(query)
@@ -0,0 +1,195 @@
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image
+
+from .metrics import record_image_transcode
+
+logger = logging.getLogger('users.imaging')
+
+# Web formats offered for the display variant: query value -> (Pillow format, extension, content type).
+DISPLAY_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+    'webp': ('WEBP', 'webp', 'image/webp'),
+}
+TILE_CONTENT_TYPE = 'image/jpeg'
+
+
+def _transcode_root():
+    if settings.IMAGE_TRANSCODE_ROOT:
+        return Path(settings.IMAGE_TRANSCODE_ROOT)
+    return Path(settings.RDSO_STORAGE_ROOT) / '_transcodes'
+
+
+def _entry_dir(sha256):
+    return _transcode_root() / sha256[:2] / sha256
+
+
+def _pyramid_dir(sha256):
+    return _entry_dir(sha256) / f'tiles-{settings.IMAGE_TILE_SIZE}'
+
+
+def tile_path(sha256, level, col, row):
+    return _pyramid_dir(sha256) / str(level) / f'{col}_{row}.jpg'
+
+
+def _pyramid_cache_key(sha256, name):
+    return f'tile-pyramid:{sha256}:{name}'
+
+
+def open_source_image(source_path):
+    """Open the first frame of a raster drawing (UsersConfig.ready raises Pillow's limit to IMAGE_MAX_PIXELS)."""
+    image = Image.open(source_path)
+    image.seek(0)
+    return image
+
+
+def web_mode(image):
+    """Return image in a mode JPEG can store: L for bilevel and greyscale scans, RGB otherwise."""
+    if image.mode in ('RGB', 'L'):
+        return image
+    return image.convert('L' if image.mode in ('1', 'I', 'I;16', 'F') else 'RGB')
+
+
+def display_variant(source_path, sha256, image_format='jpeg'):
+    """Return (path, content_type) of a downscaled web copy, creating it on first use."""
+    pil_format, extension, content_type = DISPLAY_FORMATS[image_format]
+    max_size = settings.IMAGE_DISPLAY_MAX_SIZE
+    target_path = _entry_dir(sha256) / f'display-{max_size}.{extension}'
+    if target_path.is_file():
+        record_image_transcode('display', 'hit')
+        return target_path, content_type
+
+    started_at = time.perf_counter()
+    with open_source_image(source_path) as image:
+        web_image = web_mode(image)
+        web_image.thumbnail((max_size, max_size))
+        if pil_format == 'PNG' and image.mode == '1':
+            # Line-art scans stay bilevel, which PNG packs far tighter than grey.
+            web_image = web_image.convert('1')
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target_path.with_name(f'{target_path.name}.{os.getpid()}.tmp')
+        web_image.save(tmp_path, pil_format, quality=settings.IMAGE_QUALITY, optimize=True)
+    os.replace(tmp_path, target_path)
+    record_image_transcode('display', 'created', time.perf_counter() - started_at)
+    return target_path, content_type
+
+
+def _pyramid_info(width, height):
+    tile_size = settings.IMAGE_TILE_SIZE
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'max_level': max(math.ceil(math.log2(max(width, height, 1))), 0),
+        'format': 'jpg',
+    }
+
+
+def tile_pyramid_info(sha256):
+    """Return the descriptor of an already built pyramid, or None."""
+    info_path = _pyramid_dir(sha256) / 'info.json'
+    if not info_path.is_file():
+        return None
+    record_image_transcode('pyramid', 'hit')
+    with open(info_path, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def tile_pyramid_error(sha256):
+    """Why the last background build for this hash failed, or None."""
+    return cache.get(_pyramid_cache_key(sha256, 'error'))
+
+
+def start_tile_pyramid(source_path, sha256):
+    """Build the pyramid off the request path, unless a build for this hash is already under way."""
+    if not cache.add(_pyramid_cache_key(sha256, 'building'), True, timeout=settings.IMAGE_TILE_JOB_TIMEOUT):
+        return
+    cache.delete(_pyramid_cache_key(sha256, 'error'))
+    if settings.IMAGE_TILE_USE_QUEUE:
+        try:
+            import django_rq
+
+            # Tiling is CPU and memory heavy document work, like watermarking.
+            queue = django_rq.get_queue('watermark')
+            queue.enqueue(build_tile_pyramid, str(source_path), sha256, job_timeout=settings.IMAGE_TILE_JOB_TIMEOUT)
+            return
+        except Exception:
+            logger.exception('Failed to enqueue tile pyramid for %s, falling back to a thread', sha256)
+    threading.Thread(target=build_tile_pyramid, args=(str(source_path), sha256), daemon=True).start()
+
+
+def build_tile_pyramid(source_path, sha256):
+    """Background entry point; a failure is remembered so viewers stop waiting for it."""
+    try:
+        ensure_tile_pyramid(source_path, sha256)
+    except Exception as exc:
+        logger.warning('Cannot build tile pyramid for %s: %s', sha256, exc)
+        cache.set(
+            _pyramid_cache_key(sha256, 'error'), str(exc) or type(exc).__name__, timeout=settings.IMAGE_TILE_JOB_TIMEOUT,
+        )
+    finally:
+        cache.delete(_pyramid_cache_key(sha256, 'building'))
+
+
+def ensure_tile_pyramid(source_path, sha256):
+    """Build the Deep Zoom style pyramid once per sha256 and return its descriptor.
+
+    Level ``max_level`` is full resolution and each level below halves it, down
+    to a single pixel at level 0. Tiles are ``tile_size`` squares without overlap.
+    This decodes the whole scan, so requests go through start_tile_pyramid.
+    """
+    info = tile_pyramid_info(sha256)
+    if info is not None:
+        return info
+    pyramid_dir = _pyramid_dir(sha256)
+    info_path = pyramid_dir / 'info.json'
+
+    started_at = time.perf_counter()
+    pyramid_dir.parent.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix='.tiles-', dir=pyramid_dir.parent))
+    try:
+        with open_source_image(source_path) as image:
+            info = _pyramid_info(image.width, image.height)
+            level_image = web_mode(image)
+            tile_size = info['tile_size']
+            for level in range(info['max_level'], -1, -1):
+                level_dir = build_dir / str(level)
+                level_dir.mkdir()
+                for row in range(math.ceil(level_image.height / tile_size)):
+                    for col in range(math.ceil(level_image.width / tile_size)):
+                        box = (
+                            col * tile_size,
+                            row * tile_size,
+                            min((col + 1) * tile_size, level_image.width),
+                            min((row + 1) * tile_size, level_image.height),
+                        )
+                        level_image.crop(box).save(
+                            level_dir / f'{col}_{row}.jpg', 'JPEG', quality=settings.IMAGE_QUALITY,
+                        )
+                if level:
+                    level_image = level_image.reduce(2)
+
+        with open(build_dir / 'info.json', 'w', encoding='utf-8') as handle:
+            json.dump(info, handle)
+        try:
+            os.replace(build_dir, pyramid_dir)
+        except OSError:
+            # Another request finished the same pyramid first; keep theirs.
+            logger.debug('Tile pyramid for %s already built', sha256)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    record_image_transcode('pyramid', 'created', time.perf_counter() - started_at)
+    with open(info_path, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
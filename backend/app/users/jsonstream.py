@@ -0,0 +1,152 @@
+"""Incremental readers for the crawler's JSON artifacts.
+
+__state__.json carries every file twice (under drawings_by_page_url and files_by_url)
+and grows with the catalog, so loading it whole dominates the importer's memory.
+These readers decode one value at a time with JSONDecoder.raw_decode from a buffer
+refilled in chunks, so only the record being read is ever held in memory.
+"""
+import json
+import re
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+_WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# What may still follow a number that was cut off at the end of the buffer ("-1.5" of "-1.5e10").
+_NUMBER_TAIL_RE = re.compile(r'[0-9.eE+\-]*')
+
+
+class _Reader:
+    def __init__(self, handle, chunk_size):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = '' if self.eof else self.handle.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at the end of the file."""
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} at offset {self.pos}, found {found or "end of file"!r}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number that runs to the end of the buffer may continue in the next chunk.
+            if _NUMBER_TAIL_RE.fullmatch(self.buffer, end) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self):
+        """Move past the next value, decoding its children one at a time and dropping them.
+
+        The crawler's top-level maps hold one small record per drawing or file, so this keeps
+        memory bounded by the largest record while leaving the scanning to the C decoder.
+        """
+        char = self.peek()
+        if char == '{':
+            for _ in _members(self):
+                self.value()
+        elif char == '[':
+            for _ in _elements(self):
+                self.value()
+        else:
+            self.value()
+
+
+def _members(reader):
+    """Yield each key of the object at the reader; the caller consumes its value with value() or skip()."""
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        if reader.peek() != '"':
+            raise ValueError(f'Expected an object key at offset {reader.pos}')
+        key = reader.value()
+        reader.expect(':')
+        yield key
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f'Expected "," or "}}" at offset {reader.pos - 1}')
+
+
+def _elements(reader):
+    """Yield once per element of the array at the reader; the caller consumes each element."""
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'Expected "," or "]" at offset {reader.pos - 1}')
+
+
+def iter_array(path, chunk_size=CHUNK_SIZE):
+    """Yield the elements of the top-level array in `path` one at a time."""
+    with open(path, 'r', encoding='utf-8') as handle:
+        reader = _Reader(handle, chunk_size)
+        for _ in _elements(reader):
+            yield reader.value()
+
+
+def iter_object(path, key, chunk_size=CHUNK_SIZE):
+    """Yield (name, value) for each member of the object under top-level `key`; other keys are skipped."""
+    with open(path, 'r', encoding='utf-8') as handle:
+        reader = _Reader(handle, chunk_size)
+        for name in _members(reader):
+            if name != key:
+                reader.skip()
+                continue
+            for member in _members(reader):
+                yield member, reader.value()
+            return
+
+
+def read_keys(path, keys, chunk_size=CHUNK_SIZE):
+    """Return the requested top-level keys of the object in `path`, reading no further than needed."""
+    wanted, found = set(keys), {}
+    with open(path, 'r', encoding='utf-8') as handle:
+        reader = _Reader(handle, chunk_size)
+        for name in _members(reader):
+            if name not in wanted:
+                reader.skip()
+                continue
+            found[name] = reader.value()
+            if len(found) == len(wanted):
+                break
+    return found
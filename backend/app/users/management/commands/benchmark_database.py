@@ -0,0 +1,133 @@
+import math
+import secrets
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from rest_framework.views import APIView
+
+from users.models import User
+
+ENDPOINTS = ('login', 'documents', 'dump')
+BENCHMARK_HRMS_PREFIX = 'bench-'
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+class Command(BaseCommand):
+    help = 'Measure p50/p95 latency of login, document listing and dump under concurrent in-process requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8, help='Worker threads issuing requests')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of login,documents,dump')
+        parser.add_argument('--hrms-id', help='Existing accepted account to log in with; a temporary one is created otherwise')
+        parser.add_argument('--password', default='')
+        parser.add_argument('--keep-throttling', action='store_true', help='Leave DRF rate limits on (they cap a benchmark at a few requests)')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = sorted(set(endpoints) - set(ENDPOINTS))
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(unknown)}")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive')
+
+        database = settings.DATABASES['default']
+        pool = (database.get('OPTIONS') or {}).get('pool')
+        self.stdout.write(
+            f"Database: {connection.vendor} ({database['ENGINE']}), "
+            f"pool={pool or 'off'}, CONN_MAX_AGE={database.get('CONN_MAX_AGE', 0)}, "
+            f"concurrency={options['concurrency']}"
+        )
+
+        throttle_classes = APIView.throttle_classes
+        if not options['keep_throttling']:
+            APIView.throttle_classes = []
+        temporary_user = None
+        hrms_id, password = options['hrms_id'], options['password']
+        if not hrms_id:
+            hrms_id, password = f'{BENCHMARK_HRMS_PREFIX}{secrets.token_hex(4)}', secrets.token_urlsafe(16)
+            temporary_user = User.objects.create_user(HRMS_ID=hrms_id, password=password, user_status='accepted')
+        try:
+            host = next((name for name in settings.ALLOWED_HOSTS if name not in ('*', '') and not name.startswith('.')), 'localhost')
+            self.credentials = {'HRMS_ID': hrms_id, 'password': password}
+            self.host = host
+            self.token = self._login(Client(HTTP_HOST=host, raise_request_exception=False))
+            for name in endpoints:
+                self._run(name, options['requests'], options['concurrency'])
+        finally:
+            APIView.throttle_classes = throttle_classes
+            if temporary_user is not None:
+                temporary_user.delete()
+
+    def _login(self, client):
+        response = client.post(reverse('login'), self.credentials, content_type='application/json')
+        if response.status_code != 200:
+            raise CommandError(f'Login failed with HTTP {response.status_code}; check --hrms-id/--password')
+        return response.json()['access']
+
+    def _request(self, client, name):
+        if name == 'login':
+            return client.post(reverse('login'), self.credentials, content_type='application/json')
+        url = reverse('document-list') if name == 'documents' else reverse('dump')
+        response = client.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}', HTTP_ACCEPT_ENCODING='gzip')
+        if response.streaming:
+            for _chunk in response.streaming_content:
+                pass
+        return response
+
+    def _run(self, name, total, concurrency):
+        results = []
+        issued = iter(range(total))
+        lock = threading.Lock()
+
+        def worker():
+            client = Client(HTTP_HOST=self.host, raise_request_exception=False)
+            try:
+                while True:
+                    with lock:
+                        if next(issued, None) is None:
+                            return
+                    started_at = time.perf_counter()
+                    try:
+                        outcome = self._request(client, name).status_code
+                    except Exception as exc:
+                        outcome = type(exc).__name__
+                    with lock:
+                        results.append((time.perf_counter() - started_at, outcome))
+            finally:
+                # Hand the thread's connection back (to the pool, when there is one) before it exits.
+                connections.close_all()
+
+        started_at = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        durations = sorted(duration for duration, _ in results)
+        errors = Counter(outcome for _, outcome in results if not isinstance(outcome, int) or outcome >= 400)
+        self.stdout.write(
+            f'{name:<10} n={total:<5} errors={sum(errors.values()):<4} '
+            f'p50={_percentile(durations, 50) * 1000:8.1f}ms '
+            f'p95={_percentile(durations, 95) * 1000:8.1f}ms '
+            f'max={durations[-1] * 1000:8.1f}ms '
+            f'mean={statistics.mean(durations) * 1000:8.1f}ms '
+            f'rps={total / elapsed:7.1f}'
+            + (f" ({', '.join(f'{outcome}x{count}' for outcome, count in errors.most_common())})" if errors else '')
+        )
@@ -0,0 +1,71 @@
+import hashlib
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import Document
+from users.utils import resolve_document_path
+from users.watermark import (
+    WATERMARK_MODE_INCREMENTAL,
+    WATERMARK_MODE_REWRITE,
+    get_prepared_pdf,
+    watermark_stream,
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare watermark engines (direct merge, cached rewrite, incremental update) on one PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pdf_path', nargs='?', help='PDF file to benchmark')
+        parser.add_argument('--document-id', help='Benchmark the stored file of this Document instead')
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['document_id']:
+            document = Document.objects.filter(document_id=options['document_id']).first()
+            if document is None:
+                raise CommandError(f"Document {options['document_id']} not found")
+            pdf_path, _ = resolve_document_path(document)
+            sha256 = document.sha256
+        elif options['pdf_path']:
+            pdf_path, sha256 = options['pdf_path'], ''
+        else:
+            raise CommandError('Provide a pdf_path or --document-id')
+
+        if not sha256:
+            digest = hashlib.sha256()
+            with open(pdf_path, 'rb') as handle:
+                for block in iter(lambda: handle.read(1024 * 1024), b''):
+                    digest.update(block)
+            sha256 = digest.hexdigest()
+
+        started_at = time.perf_counter()
+        get_prepared_pdf(pdf_path, sha256)
+        self.stdout.write(f'Prepared source ready in {time.perf_counter() - started_at:.3f}s')
+
+        engines = [
+            ('merge', '', WATERMARK_MODE_REWRITE),
+            ('rewrite', sha256, WATERMARK_MODE_REWRITE),
+            ('incremental', sha256, WATERMARK_MODE_INCREMENTAL),
+        ]
+        for label, engine_sha256, mode in engines:
+            durations, peaks = [], []
+            size = 0
+            for _ in range(options['iterations']):
+                tracemalloc.start()
+                started_at = time.perf_counter()
+                chunks, size = watermark_stream(pdf_path, 'Downloaded by BENCHMARK', sha256=engine_sha256, mode=mode)
+                for _chunk in chunks:
+                    pass
+                durations.append(time.perf_counter() - started_at)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+
+            self.stdout.write(
+                f'{label:<12} mean={statistics.mean(durations) * 1000:8.1f}ms '
+                f'max={max(durations) * 1000:8.1f}ms '
+                f'peak_mem={max(peaks) / 2**20:7.1f}MiB size={size}'
+            )
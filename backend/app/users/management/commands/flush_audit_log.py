@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from users.audit import audit_buffer_depth, flush_audit_buffer
+
+
+class Command(BaseCommand):
+    help = 'Write audit events queued in Redis to the database (e.g. from cron or an rq worker host)'
+
+    def handle(self, *args, **options):
+        flushed = flush_audit_buffer()
+        self.stdout.write(self.style.SUCCESS(
+            f'Flushed {flushed} audit events, {audit_buffer_depth()} still buffered'
+        ))
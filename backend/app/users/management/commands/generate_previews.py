@@ -0,0 +1,31 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.models import Document
+from users.previews import generate_previews
+
+logger = logging.getLogger('users.previews')
+
+
+class Command(BaseCommand):
+    help = 'Render missing first-page previews for documents, keyed by sha256'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.PREVIEW_WORKERS, help='Rendering processes')
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        documents = Document.objects.exclude(sha256='').only(
+            'document_id', 'sha256', 'storage_path', 'file_name_on_disk', 'content_type',
+        )
+        stats = generate_previews(documents.iterator(), workers=options['workers'])
+        msg = (
+            f"Preview generation complete in {time.perf_counter() - started_at:.1f}s: "
+            f"{stats['created']} created, {stats['unavailable']} unavailable, "
+            f"{stats['failed']} failed, {stats['skipped']} up to date or skipped"
+        )
+        logger.info(msg)
+        self.stdout.write(self.style.SUCCESS(msg))
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = 'Delete catalog journal entries older than the retention window; older sync cursors then need a full dump'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Retention in days (defaults to CHANGE_JOURNAL_RETENTION_DAYS)',
+        )
+
+    def handle(self, *args, **options):
+        days = settings.CHANGE_JOURNAL_RETENTION_DAYS if options['days'] is None else options['days']
+        cutoff = timezone.now() - timedelta(days=days)
+        # Always keep the newest entry so current cursors stay valid on a quiet catalog.
+        newest = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+        deleted, _ = CatalogChange.objects.filter(created_at__lt=cutoff).exclude(id=newest).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} journal entries older than {days} days'))
@@ -0,0 +1,145 @@
+import math
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
+from app.db.sqlite3.base import is_lock_error
+
+SYNCHRONOUS_MODES = {0: 'OFF', 1: 'NORMAL', 2: 'FULL', 3: 'EXTRA'}
+PRAGMAS = (
+    'journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size',
+    'page_size', 'page_count', 'freelist_count', 'wal_autocheckpoint',
+)
+
+
+def _percentile(sorted_values, pct):
+    return sorted_values[max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)]
+
+
+def _bucket_percentile(buckets, count, pct):
+    """Upper bound of the histogram bucket holding the pct-th percentile."""
+    for bound, cumulative in buckets:
+        if cumulative >= pct / 100 * count:
+            return bound
+    return math.inf
+
+
+def _collected_samples():
+    """Samples of the lock metrics recorded by app.db.sqlite3, merged across workers when possible."""
+    registry = REGISTRY
+    if settings.PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    samples = []
+    for metric in registry.collect():
+        if metric.name in ('railway_sqlite_lock_wait_seconds', 'railway_sqlite_lock_errors'):
+            samples.extend(metric.samples)
+    return samples
+
+
+class Command(BaseCommand):
+    help = 'Report SQLite pragmas, WAL state, recorded lock contention and how long the write lock currently takes to acquire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=20, help='Write-lock acquisitions to time')
+        parser.add_argument('--interval', type=float, default=0.25, help='Seconds between samples')
+        parser.add_argument(
+            '--checkpoint', action='store_true',
+            help='Run a PASSIVE WAL checkpoint and report how many frames it could copy back',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'The default database is {connection.vendor}, not SQLite')
+
+        with connection.cursor() as cursor:
+            values = {}
+            for pragma in PRAGMAS:
+                cursor.execute(f'PRAGMA {pragma}')
+                row = cursor.fetchone()
+                # In-memory databases return no row for file-only pragmas such as mmap_size.
+                values[pragma] = row[0] if row else 'n/a'
+        values['synchronous'] = SYNCHRONOUS_MODES.get(values['synchronous'], values['synchronous'])
+        for pragma in PRAGMAS:
+            self.stdout.write(f'{pragma:<20} {values[pragma]}')
+        self.stdout.write(f"{'transaction_mode':<20} {connection.transaction_mode or 'DEFERRED'}")
+
+        database_path = str(connection.settings_dict['NAME'])
+        wal_path = Path(f'{database_path}-wal')
+        if wal_path.is_file():
+            self.stdout.write(f"{'wal_file_bytes':<20} {wal_path.stat().st_size}")
+        if options['checkpoint']:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+                busy, log_frames, checkpointed = cursor.fetchone()
+            self.stdout.write(f"{'wal_checkpoint':<20} busy={busy} log_frames={log_frames} checkpointed={checkpointed}")
+
+        self._report_collected()
+        self._probe(options['samples'], options['interval'])
+
+    def _report_collected(self):
+        """Print the lock waits and errors the database backend has recorded so far."""
+        samples = _collected_samples()
+        if settings.PROMETHEUS_MULTIPROC_DIR:
+            self.stdout.write('recorded (all workers):')
+        else:
+            self.stdout.write('recorded (this process only; set PROMETHEUS_MULTIPROC_DIR to include the workers):')
+
+        count = sum(s.value for s in samples if s.name == 'railway_sqlite_lock_wait_seconds_count')
+        total = sum(s.value for s in samples if s.name == 'railway_sqlite_lock_wait_seconds_sum')
+        buckets = {}
+        for s in samples:
+            if s.name == 'railway_sqlite_lock_wait_seconds_bucket':
+                bound = float(s.labels['le'])
+                buckets[bound] = buckets.get(bound, 0) + s.value
+        if count:
+            buckets = sorted(buckets.items())
+            self.stdout.write(
+                f'  lock waits: count={int(count)} mean={total / count * 1000:.2f}ms '
+                f'p50<={_bucket_percentile(buckets, count, 50) * 1000:g}ms '
+                f'p95<={_bucket_percentile(buckets, count, 95) * 1000:g}ms'
+            )
+        else:
+            self.stdout.write('  lock waits: count=0')
+
+        errors = {}
+        for s in samples:
+            if s.name == 'railway_sqlite_lock_errors_total':
+                errors[s.labels['operation']] = errors.get(s.labels['operation'], 0) + s.value
+        self.stdout.write(
+            '  lock errors: '
+            + (' '.join(f'{operation}={int(value)}' for operation, value in sorted(errors.items())) or 'none')
+        )
+
+    def _probe(self, samples, interval):
+        """Take and release the write lock repeatedly, timing each wait (busy_timeout bounds it)."""
+        waits, timeouts = [], 0
+        for sample in range(samples):
+            if sample:
+                time.sleep(interval)
+            started_at = time.perf_counter()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    waits.append(time.perf_counter() - started_at)
+                    cursor.execute('ROLLBACK')
+            except OperationalError as exc:
+                if not is_lock_error(exc):
+                    raise
+                timeouts += 1
+
+        if not waits:
+            self.stdout.write(f'write lock: all {samples} attempts timed out')
+            return
+        waits.sort()
+        self.stdout.write(
+            f'write lock: samples={samples} timeouts={timeouts} '
+            f'p50={_percentile(waits, 50) * 1000:.2f}ms '
+            f'p95={_percentile(waits, 95) * 1000:.2f}ms '
+            f'max={waits[-1] * 1000:.2f}ms mean={statistics.mean(waits) * 1000:.2f}ms'
+        )
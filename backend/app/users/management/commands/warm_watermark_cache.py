@@ -0,0 +1,56 @@
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from users.models import AuditLog, Document
+from users.utils import resolve_document_path
+from users.watermark import evict_watermark_cache, get_prepared_pdf
+
+logger = logging.getLogger('users.watermark')
+
+
+class Command(BaseCommand):
+    help = 'Pre-build watermark-ready copies of the most downloaded PDFs, keyed by sha256'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100, help='Number of most downloaded documents to prepare')
+        parser.add_argument('--all', action='store_true', help='Prepare every PDF document with a known sha256')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(content_type='application/pdf').exclude(sha256='')
+        if not options['all']:
+            popular_ids = list(
+                AuditLog.objects.filter(action='document_view', metadata__download=True)
+                .values('target_id')
+                .annotate(downloads=Count('id'))
+                .order_by('-downloads')
+                .values_list('target_id', flat=True)[:options['top']]
+            )
+            documents = documents.filter(document_id__in=popular_ids)
+
+        started_at = time.perf_counter()
+        stats = {'prepared': 0, 'missing': 0, 'failed': 0}
+        for document in documents.iterator():
+            file_path, _ = resolve_document_path(document)
+            if not os.path.isfile(file_path):
+                stats['missing'] += 1
+                continue
+            try:
+                get_prepared_pdf(file_path, document.sha256)
+            except Exception as exc:
+                logger.warning('Could not prepare %s: %s', document.document_id, exc)
+                stats['failed'] += 1
+                continue
+            stats['prepared'] += 1
+
+        evicted = evict_watermark_cache()
+        msg = (
+            f"Watermark cache warm complete in {time.perf_counter() - started_at:.1f}s: "
+            f"{stats['prepared']} prepared, {stats['missing']} missing, "
+            f"{stats['failed']} failed, {evicted} evicted"
+        )
+        logger.info(msg)
+        self.stdout.write(self.style.SUCCESS(msg))
@@ -50,6 +50,13 @@ catalog_import_duration_seconds = Histogram(
     buckets=_BUCKETS,
 )
 
+catalog_import_phase_duration_seconds = Histogram(
+    'railway_catalog_import_phase_duration_seconds',
+    'Catalog import duration per phase in seconds.',
+    ['phase'],
+    buckets=_BUCKETS,
+)
+
 document_dump_requests_total = Counter(
     'railway_document_dump_requests_total',
     'Document dump requests grouped by mode.',
@@ -75,6 +82,119 @@ file_serve_duration_seconds = Histogram(
     buckets=_BUCKETS,
 )
 
+file_serve_peak_memory_bytes = Histogram(
+    'railway_file_serve_peak_memory_bytes',
+    'Peak traced Python memory while preparing and sending a file response.',
+    ['mode'],
+    buckets=(2**20, 4 * 2**20, 16 * 2**20, 32 * 2**20, 64 * 2**20, 128 * 2**20, 256 * 2**20, 512 * 2**20, 2**30),
+)
+
+watermark_cache_lookups_total = Counter(
+    'railway_watermark_cache_lookups_total',
+    'Prepared watermark source cache lookups grouped by outcome.',
+    ['outcome'],
+)
+
+watermark_cache_bytes = Gauge(
+    'railway_watermark_cache_bytes',
+    'Bytes currently held by the prepared watermark source cache.',
+)
+
+watermark_job_completions_total = Counter(
+    'railway_watermark_job_completions_total',
+    'Background watermark job completions grouped by status and execution mode.',
+    ['status', 'execution_mode'],
+)
+
+watermark_job_duration_seconds = Histogram(
+    'railway_watermark_job_duration_seconds',
+    'Background watermark job duration in seconds.',
+    ['status', 'execution_mode'],
+    buckets=_BUCKETS + (60.0, 120.0, 300.0, 600.0),
+)
+
+watermark_job_item_duration_seconds = Histogram(
+    'railway_watermark_job_item_duration_seconds',
+    'Time spent watermarking one document of a background job.',
+    ['status'],
+    buckets=_BUCKETS,
+)
+
+watermark_queue_depth = Gauge(
+    'railway_watermark_queue_depth',
+    'Current depth of the watermark RQ queue.',
+)
+
+preview_generations_total = Counter(
+    'railway_preview_generations_total',
+    'Document preview renders grouped by outcome.',
+    ['outcome'],
+)
+
+image_transcodes_total = Counter(
+    'railway_image_transcodes_total',
+    'Raster drawing transcode lookups grouped by kind and outcome.',
+    ['kind', 'outcome'],
+)
+
+image_transcode_duration_seconds = Histogram(
+    'railway_image_transcode_duration_seconds',
+    'Time spent building a display copy or tile pyramid.',
+    ['kind'],
+    buckets=_BUCKETS + (60.0, 120.0),
+)
+
+audit_buffer_depth = Gauge(
+    'railway_audit_buffer_depth',
+    'Audit events waiting to be written, by buffer backend.',
+    ['backend'],
+)
+
+audit_events_flushed_total = Counter(
+    'railway_audit_events_flushed_total',
+    'Audit events written by buffered flushes.',
+    ['backend'],
+)
+
+audit_flush_duration_seconds = Histogram(
+    'railway_audit_flush_duration_seconds',
+    'Audit buffer flush latency grouped by outcome.',
+    ['backend', 'outcome'],
+    buckets=_BUCKETS,
+)
+
+dump_snapshot_requests_total = Counter(
+    'railway_dump_snapshot_requests_total',
+    'Full dump requests answered from a snapshot, grouped by outcome.',
+    ['outcome'],
+)
+
+dump_snapshot_build_seconds = Histogram(
+    'railway_dump_snapshot_build_seconds',
+    'Time spent materializing a full dump snapshot.',
+    buckets=_BUCKETS + (60.0, 120.0),
+)
+
+search_duration_seconds = Histogram(
+    'railway_search_duration_seconds',
+    'Search latency grouped by index.',
+    ['kind'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+sqlite_lock_wait_seconds = Histogram(
+    'railway_sqlite_lock_wait_seconds',
+    'Time spent acquiring the SQLite write lock when a transaction begins.',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+sqlite_lock_errors_total = Counter(
+    'railway_sqlite_lock_errors_total',
+    '"database is locked" errors raised to the application, grouped by statement.',
+    ['operation'],
+)
+
 
 def record_crawler_request(outcome):
     crawler_run_requests_total.labels(outcome=outcome).inc()
@@ -97,9 +217,11 @@ def record_crawler_completion(status, execution_mode, duration_seconds):
     crawler_run_duration_seconds.labels(status=status, execution_mode=execution_mode).observe(duration_seconds)
 
 
-def record_catalog_import(outcome, duration_seconds):
+def record_catalog_import(outcome, duration_seconds, phase_durations=None):
     catalog_import_requests_total.labels(outcome=outcome).inc()
     catalog_import_duration_seconds.observe(duration_seconds)
+    for phase, seconds in (phase_durations or {}).items():
+        catalog_import_phase_duration_seconds.labels(phase=phase).observe(seconds)
 
 
 def record_dump(mode, document_count):
@@ -107,11 +229,75 @@ def record_dump(mode, document_count):
     document_dump_document_count.observe(document_count)
 
 
-def record_file_serve(outcome, mode, content_type, duration_seconds):
+def record_file_serve(outcome, mode, content_type, duration_seconds, peak_memory_bytes=None):
     normalized_type = (content_type or 'unknown').replace('/', '_')
     file_serve_requests_total.labels(
         outcome=outcome,
         mode=mode,
         content_type=normalized_type,
     ).inc()
-    file_serve_duration_seconds.labels(mode=mode).observe(duration_seconds)
\ No newline at end of file
+    file_serve_duration_seconds.labels(mode=mode).observe(duration_seconds)
+    if peak_memory_bytes is not None:
+        record_file_serve_peak_memory(mode, peak_memory_bytes)
+
+
+def record_file_serve_peak_memory(mode, peak_memory_bytes):
+    file_serve_peak_memory_bytes.labels(mode=mode).observe(peak_memory_bytes)
+
+
+def record_watermark_cache_lookup(outcome):
+    watermark_cache_lookups_total.labels(outcome=outcome).inc()
+
+
+def set_watermark_cache_size(size_bytes):
+    watermark_cache_bytes.set(size_bytes)
+
+
+def record_watermark_job_completion(status, execution_mode, duration_seconds):
+    watermark_job_completions_total.labels(status=status, execution_mode=execution_mode).inc()
+    watermark_job_duration_seconds.labels(status=status, execution_mode=execution_mode).observe(duration_seconds)
+
+
+def record_watermark_job_item(status, duration_seconds):
+    watermark_job_item_duration_seconds.labels(status=status).observe(duration_seconds)
+
+
+def record_watermark_queue_depth(depth):
+    watermark_queue_depth.set(depth)
+
+
+def record_preview_generation(outcome):
+    preview_generations_total.labels(outcome=outcome).inc()
+
+
+def record_image_transcode(kind, outcome, duration_seconds=None):
+    image_transcodes_total.labels(kind=kind, outcome=outcome).inc()
+    if duration_seconds is not None:
+        image_transcode_duration_seconds.labels(kind=kind).observe(duration_seconds)
+
+
+def record_audit_buffer_depth(backend, depth):
+    audit_buffer_depth.labels(backend=backend).set(depth)
+
+
+def record_audit_flush(backend, outcome, event_count, duration_seconds):
+    audit_events_flushed_total.labels(backend=backend).inc(event_count)
+    audit_flush_duration_seconds.labels(backend=backend, outcome=outcome).observe(duration_seconds)
+
+
+def record_dump_snapshot(outcome, duration_seconds=None):
+    dump_snapshot_requests_total.labels(outcome=outcome).inc()
+    if duration_seconds is not None:
+        dump_snapshot_build_seconds.observe(duration_seconds)
+
+
+def record_search(kind, duration_seconds):
+    search_duration_seconds.labels(kind=kind).observe(duration_seconds)
+
+
+def record_sqlite_lock_wait(duration_seconds):
+    sqlite_lock_wait_seconds.observe(duration_seconds)
+
+
+def record_sqlite_lock_error(operation):
+    sqlite_lock_errors_total.labels(operation=operation).inc()
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.10 on 2026-10-18 12:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_crawlerrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatermarkJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('execution_mode', models.CharField(choices=[('queue', 'Queue'), ('thread', 'Thread')], default='queue', max_length=20)),
+                ('watermark_text', models.CharField(max_length=500)),
+                ('total_items', models.IntegerField(default=0)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('requested_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watermark_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WatermarkJobItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('rq_job_id', models.CharField(blank=True, default='', max_length=255)),
+                ('output_name', models.CharField(blank=True, default='', max_length=500)),
+                ('output_size', models.BigIntegerField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watermark_job_items', to='users.document')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='users.watermarkjob')),
+            ],
+            options={
+                'ordering': ['id'],
+                'unique_together': {('job', 'document')},
+            },
+        ),
+    ]
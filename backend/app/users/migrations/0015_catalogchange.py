@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 13:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('document', 'Document'), ('category', 'Category'), ('subhead', 'Subhead'), ('post', 'Post')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('object_key', models.CharField(blank=True, default='', max_length=255)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from users.search import FTS_TABLE, create_index_sql
+
+    Document = apps.get_model('users', 'Document')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(create_index_sql())
+        for document in Document.objects.select_related('subhead').prefetch_related('category'):
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, subhead, category, description) VALUES (%s, %s, %s, %s, %s)',
+                [
+                    document.pk,
+                    document.name,
+                    document.subhead.name if document.subhead else '',
+                    ' '.join(category.name for category in document.category.all()),
+                    document.description,
+                ],
+            )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from users.search import FTS_TABLE
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_keyset_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+# icontains compiles to UPPER(column) LIKE UPPER(%s) on PostgreSQL, so the trigram
+# indexes are built over UPPER(column) for the planner to use them.
+TRIGRAM_INDEXES = [
+    ('users_document_name_trgm', 'users_document', 'name'),
+    ('users_document_description_trgm', 'users_document', 'description'),
+    ('users_subhead_name_trgm', 'users_subhead', 'name'),
+    ('users_category_name_trgm', 'users_category', 'name'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin (UPPER("{column}") gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_document_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
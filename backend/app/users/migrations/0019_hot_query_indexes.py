@@ -0,0 +1,53 @@
+# Generated by Django 5.2.10 on 2026-10-18 14:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_postgres_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['target_type', '-created_at', '-id'], name='auditlog_target_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crawlerrun',
+            index=models.Index(fields=['status', '-created_at'], name='crawlerrun_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['name', 'id'], name='document_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['last_updated'], name='document_last_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['document', '-created_at', '-id'], name='post_document_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['document', 'post_type', '-created_at', '-id'], name='post_doc_type_created_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogImportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('execution_mode', models.CharField(choices=[('queue', 'Queue'), ('thread', 'Thread')], default='queue', max_length=20)),
+                ('job_id', models.CharField(blank=True, default='', max_length=255)),
+                ('phase', models.CharField(blank=True, default='', max_length=40)),
+                ('records_total', models.IntegerField(default=0)),
+                ('records_processed', models.IntegerField(default=0)),
+                ('phase_durations', models.JSONField(blank=True, default=dict)),
+                ('stats', models.JSONField(blank=True, default=dict)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('last_heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('total_log_lines', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('log_tail', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('initiated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='catalog_import_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', '-created_at'], name='catalogimport_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_catalog_import_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='catalog_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
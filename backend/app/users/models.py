@@ -88,7 +88,9 @@ class Document(models.Model):
     file_name_on_disk = models.CharField(max_length=500, blank=True, default='')
     content_type = models.CharField(max_length=100, blank=True, default='application/pdf')
     file_size = models.BigIntegerField(null=True, blank=True)
-    sha256 = models.CharField(max_length=64, blank=True, default='')
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Set by import_rdso_catalog: sha256 of the catalog record and file etag the row was last written from.
+    catalog_fingerprint = models.CharField(max_length=64, blank=True, default='')
     source_url = models.URLField(blank=True, default='', max_length=1000)
     source_file_url = models.URLField(blank=True, default='', max_length=1000)
     is_archived = models.BooleanField(default=False)
@@ -100,6 +102,11 @@ class Document(models.Model):
 
     class Meta:
         ordering = ['document_id']
+        indexes = [
+            # Keyset listing orders by (name, id); incremental dumps filter on last_updated.
+            models.Index(fields=['name', 'id'], name='document_name_id_idx'),
+            models.Index(fields=['last_updated'], name='document_last_updated_idx'),
+        ]
 
 class Post(models.Model):
     POST_TYPES = [
@@ -117,6 +124,11 @@ class Post(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Posts and feedback of one document, newest first (see PostListView / FeedbackListView).
+            models.Index(fields=['document', '-created_at', '-id'], name='post_document_created_idx'),
+            models.Index(fields=['document', 'post_type', '-created_at', '-id'], name='post_doc_type_created_idx'),
+        ]
 
 
 class CrawlerRun(models.Model):
@@ -163,6 +175,111 @@ class CrawlerRun(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='crawlerrun_status_created_idx'),
+        ]
+
+
+class CatalogImportRun(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    EXECUTION_QUEUE = 'queue'
+    EXECUTION_THREAD = 'thread'
+
+    STATUS_CHOICES = CrawlerRun.STATUS_CHOICES
+    EXECUTION_MODE_CHOICES = CrawlerRun.EXECUTION_MODE_CHOICES
+
+    initiated_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='catalog_import_runs',
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    execution_mode = models.CharField(max_length=20, choices=EXECUTION_MODE_CHOICES, default=EXECUTION_QUEUE)
+    job_id = models.CharField(max_length=255, blank=True, default='')
+    # Last phase reported by import_rdso_catalog, e.g. "read", "documents", "snapshot".
+    phase = models.CharField(max_length=40, blank=True, default='')
+    records_total = models.IntegerField(default=0)
+    records_processed = models.IntegerField(default=0)
+    phase_durations = models.JSONField(default=dict, blank=True)
+    stats = models.JSONField(default=dict, blank=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_heartbeat = models.DateTimeField(null=True, blank=True)
+    total_log_lines = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True, default='')
+    log_tail = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CatalogImportRun#{self.pk} {self.status}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='catalogimport_status_idx'),
+        ]
+
+class WatermarkJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    EXECUTION_QUEUE = 'queue'
+    EXECUTION_THREAD = 'thread'
+
+    STATUS_CHOICES = CrawlerRun.STATUS_CHOICES
+    EXECUTION_MODE_CHOICES = CrawlerRun.EXECUTION_MODE_CHOICES
+
+    requested_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='watermark_jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    execution_mode = models.CharField(max_length=20, choices=EXECUTION_MODE_CHOICES, default=EXECUTION_QUEUE)
+    watermark_text = models.CharField(max_length=500)
+    total_items = models.IntegerField(default=0)
+    queued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"WatermarkJob#{self.pk} {self.status}"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class WatermarkJobItem(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    job = models.ForeignKey(WatermarkJob, on_delete=models.CASCADE, related_name='items')
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='watermark_job_items')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rq_job_id = models.CharField(max_length=255, blank=True, default='')
+    output_name = models.CharField(max_length=500, blank=True, default='')
+    output_size = models.BigIntegerField(null=True, blank=True)
+    error_message = models.TextField(blank=True, default='')
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"WatermarkJobItem#{self.pk} {self.document_id} {self.status}"
+
+    class Meta:
+        ordering = ['id']
+        unique_together = [('job', 'document')]
 
 class AuditLog(models.Model):
     ACTION_CHOICES = [
@@ -189,3 +306,51 @@ class AuditLog(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['target_type', '-created_at', '-id'], name='auditlog_target_created_idx'),
+        ]
+
+
+class CatalogVersion(models.Model):
+    """Single row counting catalog changes; bumped whenever documents, categories or subheads change."""
+
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"CatalogVersion {self.version}"
+
+
+class CatalogChange(models.Model):
+    """Append-only journal of catalog writes; the id is the sync cursor handed to clients.
+
+    Only write it through users.catalog so ids commit in order, see catalog._write_journal.
+    """
+
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+
+    ACTION_CHOICES = [
+        (ACTION_CREATE, 'Create'),
+        (ACTION_UPDATE, 'Update'),
+        (ACTION_DELETE, 'Delete'),
+    ]
+    MODEL_CHOICES = [
+        ('document', 'Document'),
+        ('category', 'Category'),
+        ('subhead', 'Subhead'),
+        ('post', 'Post'),
+    ]
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    object_key = models.CharField(max_length=255, blank=True, default='')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"CatalogChange#{self.pk} {self.action} {self.model}:{self.object_id}"
+
+    class Meta:
+        ordering = ['id']
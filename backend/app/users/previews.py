@@ -0,0 +1,181 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from pypdf import PdfReader
+
+from .imaging import open_source_image, web_mode
+from .metrics import record_preview_generation
+
+logger = logging.getLogger('users.previews')
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+PREVIEW_CREATED = 'created'
+PREVIEW_UNAVAILABLE = 'unavailable'
+PREVIEW_FAILED = 'failed'
+
+
+def _preview_root():
+    if settings.PREVIEW_ROOT:
+        return Path(settings.PREVIEW_ROOT)
+    return Path(settings.RDSO_STORAGE_ROOT) / '_previews'
+
+
+def preview_path(sha256, max_size=None):
+    """Content-addressed location of the first-page thumbnail for a file hash."""
+    max_size = max_size or settings.PREVIEW_MAX_SIZE
+    return _preview_root() / sha256[:2] / f'{sha256}-{max_size}.jpg'
+
+
+def _unavailable_marker(target_path):
+    return target_path.with_suffix('.none')
+
+
+def _failed_marker(target_path):
+    return target_path.with_suffix('.failed')
+
+
+def _building_cache_key(target_path):
+    return f'preview:{Path(target_path).name}:building'
+
+
+def _first_page_image(source_path, content_type):
+    if content_type == 'application/pdf':
+        # No rasterizer is bundled, so PDFs preview through their largest
+        # embedded image; scanned drawings are a single full-page image.
+        reader = PdfReader(source_path)
+        if not reader.pages:
+            return None
+        best, best_area = None, 0
+        for image_file in reader.pages[0].images:
+            try:
+                image = image_file.image
+            except Exception:
+                continue
+            area = image.width * image.height
+            if area > best_area:
+                best, best_area = image, area
+        return best
+    if content_type.startswith('image/'):
+        return open_source_image(source_path)
+    return None
+
+
+def render_preview(source_path, content_type, target_path, max_size, quality):
+    """Write a JPEG thumbnail of the first page. Runs in worker processes, so no ORM access."""
+    target_path = Path(target_path)
+    try:
+        image = _first_page_image(source_path, content_type)
+        if image is None:
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            _unavailable_marker(target_path).touch()
+            return PREVIEW_UNAVAILABLE
+
+        with image:
+            image.draft('RGB', (max_size, max_size))
+            thumbnail = web_mode(image)
+            thumbnail.thumbnail((max_size, max_size))
+
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target_path.with_name(f'{target_path.name}.{os.getpid()}.tmp')
+            thumbnail.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+        os.replace(tmp_path, target_path)
+        return PREVIEW_CREATED
+    except Exception as exc:
+        logger.warning('Preview rendering failed for %s: %s', source_path, exc)
+        try:
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            # Keyed by content hash, so the same bytes are never decoded again.
+            _failed_marker(target_path).touch()
+        except OSError:
+            logger.debug('Could not mark preview %s as failed', target_path, exc_info=True)
+        return PREVIEW_FAILED
+
+
+def _render_task(job):
+    return render_preview(*job)
+
+
+def _preview_jobs(documents):
+    from .utils import checked_document_path
+
+    jobs, skipped, seen = [], 0, set()
+    for document in documents:
+        sha256 = document.sha256
+        if not sha256 or sha256 in seen:
+            skipped += 1
+            continue
+        seen.add(sha256)
+        target_path = preview_path(sha256)
+        if target_path.is_file() or _unavailable_marker(target_path).exists() or _failed_marker(target_path).exists():
+            skipped += 1
+            continue
+        file_path = checked_document_path(document)
+        if file_path is None:
+            skipped += 1
+            continue
+        jobs.append((
+            file_path,
+            document.content_type or 'application/pdf',
+            str(target_path),
+            settings.PREVIEW_MAX_SIZE,
+            settings.PREVIEW_QUALITY,
+        ))
+    return jobs, skipped
+
+
+def generate_previews(documents, workers=None):
+    """Render missing previews for documents; a preview is only redone when the sha256 changes."""
+    jobs, skipped = _preview_jobs(documents)
+    stats = {PREVIEW_CREATED: 0, PREVIEW_UNAVAILABLE: 0, PREVIEW_FAILED: 0, 'skipped': skipped}
+
+    workers = settings.PREVIEW_WORKERS if workers is None else workers
+    if workers <= 1 or len(jobs) <= 1:
+        outcomes = [_render_task(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(_render_task, jobs, chunksize=8))
+
+    for outcome in outcomes:
+        stats[outcome] += 1
+        record_preview_generation(outcome)
+    return stats
+
+
+def start_preview(document):
+    """Render a missing preview off the request path; False when there is nothing to render.
+
+    Decoding a PDF's first-page images can take as long as tiling a scan, so like
+    start_tile_pyramid this only queues the work, once per file hash.
+    """
+    jobs, _ = _preview_jobs([document])
+    if not jobs:
+        return False
+    job = jobs[0]
+    if not cache.add(_building_cache_key(job[2]), True, timeout=settings.PREVIEW_JOB_TIMEOUT):
+        return True
+    if settings.PREVIEW_USE_QUEUE:
+        try:
+            import django_rq
+
+            queue = django_rq.get_queue('watermark')
+            queue.enqueue(build_preview, *job, job_timeout=settings.PREVIEW_JOB_TIMEOUT)
+            return True
+        except Exception:
+            logger.exception('Failed to enqueue preview for %s, falling back to a thread', document.sha256)
+    threading.Thread(target=build_preview, args=job, daemon=True).start()
+    return True
+
+
+def build_preview(source_path, content_type, target_path, max_size, quality):
+    """Background entry point for one on-demand preview."""
+    try:
+        record_preview_generation(render_preview(source_path, content_type, target_path, max_size, quality))
+    finally:
+        cache.delete(_building_cache_key(target_path))
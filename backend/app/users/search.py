@@ -0,0 +1,142 @@
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .metrics import record_search
+from .models import Document
+
+FTS_TABLE = 'users_document_fts'
+
+# bm25 column weights, in table column order: name, subhead, category, description.
+_BM25_WEIGHTS = (10.0, 4.0, 3.0, 1.0)
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_BATCH_SIZE = 500
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def create_index_sql():
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, subhead, category, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def _index_rows(document_ids):
+    """(rowid, name, subhead, category, description) for each document, categories space-joined."""
+    through = Document.category.through
+    categories = {}
+    links = through.objects.filter(document_id__in=document_ids).values_list('document_id', 'category__name')
+    for document_pk, category_name in links:
+        categories.setdefault(document_pk, []).append(category_name)
+
+    rows = Document.objects.filter(pk__in=document_ids).values_list('pk', 'name', 'subhead__name', 'description')
+    for pk, name, subhead_name, description in rows:
+        yield pk, name, subhead_name or '', ' '.join(categories.get(pk, [])), description
+
+
+def index_documents(document_ids):
+    """Replace the index rows of the given documents; ids that no longer exist are just removed."""
+    if not fts_available():
+        return
+    document_ids = list(document_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(document_ids), _BATCH_SIZE):
+            batch = document_ids[start:start + _BATCH_SIZE]
+            placeholders = ','.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', batch)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, subhead, category, description) VALUES (%s, %s, %s, %s, %s)',
+                list(_index_rows(batch)),
+            )
+
+
+def rebuild_index():
+    if not fts_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    document_ids = list(Document.objects.values_list('pk', flat=True))
+    index_documents(document_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return len(document_ids)
+
+
+def apply_catalog_changes(entries):
+    """Keep the index in step with journaled catalog changes (see catalog.record_catalog_changes)."""
+    if not fts_available():
+        return
+    document_ids, subhead_ids, category_ids = set(), set(), set()
+    for entry in entries:
+        if entry.model == 'document':
+            document_ids.add(entry.object_id)
+        elif entry.model == 'subhead' and entry.action == entry.ACTION_UPDATE:
+            subhead_ids.add(entry.object_id)
+        elif entry.model == 'category' and entry.action == entry.ACTION_UPDATE:
+            category_ids.add(entry.object_id)
+    # Renamed subheads and categories change the indexed text of every document under them.
+    if subhead_ids:
+        document_ids.update(Document.objects.filter(subhead_id__in=subhead_ids).values_list('pk', flat=True))
+    if category_ids:
+        document_ids.update(Document.objects.filter(category__in=category_ids).values_list('pk', flat=True))
+    if document_ids:
+        index_documents(sorted(document_ids))
+
+
+def build_match_query(text):
+    """Turn user input into an FTS5 query: every word must match, each one as a prefix."""
+    tokens = _TOKEN_RE.findall(text or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_documents(text, limit):
+    """Return (document pks in relevance order, total matches)."""
+    started_at = time.perf_counter()
+    if fts_available():
+        match = build_match_query(text)
+        if not match:
+            return [], 0
+        weights = ', '.join(str(weight) for weight in _BM25_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+                [match, limit],
+            )
+            document_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            total = cursor.fetchone()[0]
+    else:
+        # Other databases get a plain substring filter until they have an index of their own.
+        condition = Q()
+        for token in _TOKEN_RE.findall(text or ''):
+            condition &= (
+                Q(name__icontains=token) | Q(description__icontains=token)
+                | Q(subhead__name__icontains=token) | Q(category__name__icontains=token)
+            )
+        if not condition:
+            return [], 0
+        matches = Document.objects.filter(condition).distinct().order_by('name')
+        total = matches.count()
+        document_ids = list(matches.values_list('pk', flat=True)[:limit])
+    record_search('fulltext', time.perf_counter() - started_at)
+    return document_ids, total
+
+
+def search_limit(value):
+    if value in (None, ''):
+        return settings.SEARCH_DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        raise ValueError('limit must be a positive integer.')
+    return min(limit, settings.SEARCH_MAX_LIMIT)
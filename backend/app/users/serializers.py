@@ -1,10 +1,31 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from django.core.validators import RegexValidator
+from django.urls import reverse
 from .models import User, Post, Document, Category, Subhead, AuditLog
 
 _phone_regex = RegexValidator(r'^\d{10}$', 'Phone number must be exactly 10 digits.')
 
+
+class EagerLoadingMixin:
+    """Declares the relations a serializer reads so list querysets can load them in one go.
+
+    Call ``setup_eager_loading(queryset)`` before serializing with ``many=True``;
+    otherwise every nested field costs one query per row.
+    """
+
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
     email = serializers.EmailField(
@@ -62,7 +83,9 @@ class CategoryDetailSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'subhead_count', 'drawing_count']
 
 
-class SubheadSerializer(serializers.ModelSerializer):
+class SubheadSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('category',)
+
     category_name = serializers.ReadOnlyField(source='category.name')
 
     class Meta:
@@ -70,14 +93,27 @@ class SubheadSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'category', 'category_name', 'crawler_id', 'drawing_count']
 
 
-class DocumentSerializer(serializers.ModelSerializer):
-    
+def document_preview_url(sha256):
+    return reverse('document-preview', args=[sha256]) if sha256 else None
+
+
+def document_tiles_url(sha256, content_type):
+    if not sha256 or not (content_type or '').startswith('image/'):
+        return None
+    return reverse('document-tile-info', args=[sha256])
+
+
+class DocumentSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ('category',)
+
     # Get the names from the request, which might contain new categories that need to be created, or existing categories that need to be linked
     category_names = serializers.ListField(
         child = serializers.CharField(), write_only=True, required=False
     )
 
     category = CategorySerializer(many=True, read_only=True)
+    preview_url = serializers.SerializerMethodField()
+    tiles_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Document
@@ -96,7 +132,15 @@ class DocumentSerializer(serializers.ModelSerializer):
             'file_size',
             'is_archived',
             'subhead',
+            'preview_url',
+            'tiles_url',
         ]
+
+    def get_preview_url(self, obj):
+        return document_preview_url(obj.sha256)
+
+    def get_tiles_url(self, obj):
+        return document_tiles_url(obj.sha256, obj.content_type)
     
     def create(self, validated_data):
         category_names = validated_data.pop('category_names', [])
@@ -108,7 +152,9 @@ class DocumentSerializer(serializers.ModelSerializer):
         
         return document
     
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('user', 'document')
+
     user_hrms_id = serializers.ReadOnlyField(source='user.HRMS_ID')
     document_id = serializers.SlugRelatedField(
         slug_field='document_id',
@@ -130,7 +176,9 @@ class PostSerializer(serializers.ModelSerializer):
             )
         return attrs
 
-class AuditLogSerializer(serializers.ModelSerializer):
+class AuditLogSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ('user',)
+
     user_hrms_id = serializers.ReadOnlyField(source='user.HRMS_ID')
 
     class Meta:
@@ -0,0 +1,73 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version, record_catalog_changes
+from .models import CatalogChange, Category, Document, Post, Subhead
+
+JOURNAL_MODELS = {
+    Document: 'document',
+    Category: 'category',
+    Subhead: 'subhead',
+    Post: 'post',
+}
+
+
+def _object_key(instance):
+    # Clients key documents by document_id, which a tombstone must still carry after the row is gone.
+    return instance.document_id if isinstance(instance, Document) else ''
+
+
+def _touch_documents(document_ids):
+    """Journal an update for documents whose relations change without a save of their own."""
+    rows = Document.objects.filter(pk__in=list(document_ids)).values_list('pk', 'document_id')
+    record_catalog_changes('document', [(pk, key, CatalogChange.ACTION_UPDATE) for pk, key in rows])
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subhead)
+@receiver(post_save, sender=Post)
+def catalog_row_saved(sender, instance, created, **kwargs):
+    action = CatalogChange.ACTION_CREATE if created else CatalogChange.ACTION_UPDATE
+    record_catalog_changes(JOURNAL_MODELS[sender], [(instance.pk, _object_key(instance), action)])
+    if sender is not Post:
+        bump_catalog_version()
+
+
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Subhead)
+@receiver(post_delete, sender=Post)
+def catalog_row_deleted(sender, instance, **kwargs):
+    # Journaled after the delete so the documents are recorded without the removed relation.
+    _touch_documents(getattr(instance, '_affected_document_ids', []))
+    record_catalog_changes(
+        JOURNAL_MODELS[sender], [(instance.pk, _object_key(instance), CatalogChange.ACTION_DELETE)],
+    )
+    if sender is not Post:
+        bump_catalog_version()
+
+
+@receiver(pre_delete, sender=Subhead)
+@receiver(pre_delete, sender=Category)
+def catalog_parent_deleting(sender, instance, **kwargs):
+    # Documents lose a subhead through SET_NULL and a category through the m2m cascade,
+    # neither of which saves the document or sends m2m_changed.
+    instance._affected_document_ids = list(instance.documents.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Document.category.through)
+def catalog_links_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._cleared_document_ids = list(instance.documents.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        record_catalog_changes('document', [(instance.pk, instance.document_id, CatalogChange.ACTION_UPDATE)])
+    elif action == 'post_clear':
+        _touch_documents(getattr(instance, '_cleared_document_ids', []))
+    else:
+        _touch_documents(pk_set or [])
+    bump_catalog_version()
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .catalog import get_catalog_version
+from .metrics import record_dump_snapshot
+from .sync import iter_full_dump_json
+
+logger = logging.getLogger('users.snapshots')
+
+_build_lock = threading.Lock()
+_SNAPSHOT_VERSION_RE = re.compile(r'^dump-v(\d+)[.-]')
+
+
+def snapshot_root():
+    if settings.DUMP_SNAPSHOT_ROOT:
+        return Path(settings.DUMP_SNAPSHOT_ROOT)
+    return Path(settings.RDSO_STORAGE_ROOT) / '_snapshots'
+
+
+def _meta_path(version):
+    return snapshot_root() / f'dump-v{version}.meta.json'
+
+
+def _read_meta(version):
+    try:
+        with open(_meta_path(version), 'r', encoding='utf-8') as handle:
+            meta = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if not (snapshot_root() / meta['file_name']).is_file():
+        return None
+    return meta
+
+
+def snapshot_file_path(meta):
+    return snapshot_root() / meta['file_name']
+
+
+def _building_cache_key(version):
+    return f'dump-snapshot:{version}:building'
+
+
+def build_full_dump_snapshot(version, timestamp):
+    """Write the full dump for a catalog version as gzip and return its metadata.
+
+    ``timestamp`` is the dump's ``timestamp`` field. Take it before reading the version, not
+    when the build starts, so clients never get a timestamp later than the data. The file is named after the sha256 of the uncompressed JSON, which doubles as
+    the ETag; the ``.meta.json`` sidecar is written last, so readers never see a
+    half-written snapshot.
+    """
+    root = snapshot_root()
+    root.mkdir(parents=True, exist_ok=True)
+    started_at = time.perf_counter()
+    digest = hashlib.sha256()
+    raw_size = 0
+    counts = {}
+
+    tmp_path = root / f'.dump-v{version}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as raw_handle:
+            # mtime=0 keeps the compressed bytes a pure function of the content.
+            with gzip.GzipFile(fileobj=raw_handle, mode='wb', compresslevel=6, mtime=0) as handle:
+                chunks = iter_full_dump_json(
+                    timestamp.isoformat(),
+                    on_complete=lambda document_count: counts.update(document_count=document_count),
+                )
+                for chunk in chunks:
+                    digest.update(chunk)
+                    raw_size += len(chunk)
+                    handle.write(chunk)
+        sha256 = digest.hexdigest()
+        file_name = f'dump-v{version}-{sha256[:16]}.json.gz'
+        os.replace(tmp_path, root / file_name)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    meta = {
+        'version': version,
+        'sha256': sha256,
+        'file_name': file_name,
+        'size': (root / file_name).stat().st_size,
+        'raw_size': raw_size,
+        'document_count': counts.get('document_count', 0),
+        'built_at': timezone.now().isoformat(),
+    }
+    meta_tmp = _meta_path(version).with_name(f'{_meta_path(version).name}.{os.getpid()}.tmp')
+    with open(meta_tmp, 'w', encoding='utf-8') as handle:
+        json.dump(meta, handle)
+    os.replace(meta_tmp, _meta_path(version))
+
+    duration = time.perf_counter() - started_at
+    record_dump_snapshot('built', duration)
+    logger.info(
+        'Built dump snapshot v%s: %d documents, %d bytes (%d raw) in %.2fs',
+        version, meta['document_count'], meta['size'], raw_size, duration,
+    )
+    purge_stale_snapshots(version)
+    return meta
+
+
+def purge_stale_snapshots(current_version):
+    """Remove snapshot files of catalog versions older than current_version.
+
+    Newer versions are left alone, so a build that finishes late never deletes a snapshot
+    written for a later catalog change.
+    """
+    removed = 0
+    for path in snapshot_root().glob('dump-v*'):
+        match = _SNAPSHOT_VERSION_RE.match(path.name)
+        if not match or int(match[1]) >= current_version:
+            continue
+        try:
+            path.unlink()
+            removed += 1
+        except OSError:
+            logger.debug('Could not remove stale snapshot %s', path, exc_info=True)
+    return removed
+
+
+def current_dump_snapshot():
+    """Return metadata for the current catalog version's snapshot, or None while it is built.
+
+    A missing snapshot is built off the request path; callers serve the live dump meanwhile.
+    """
+    version = get_catalog_version()
+    meta = _read_meta(version)
+    if meta is None:
+        start_dump_snapshot(version)
+    return meta
+
+
+def start_dump_snapshot(version):
+    """Build the snapshot in the background, unless a build for this version is already under way."""
+    if not cache.add(_building_cache_key(version), True, timeout=settings.DUMP_SNAPSHOT_JOB_TIMEOUT):
+        return
+    if settings.DUMP_SNAPSHOT_USE_QUEUE:
+        try:
+            import django_rq
+
+            queue = django_rq.get_queue('default')
+            queue.enqueue(build_dump_snapshot, version, job_timeout=settings.DUMP_SNAPSHOT_JOB_TIMEOUT)
+            return
+        except Exception:
+            logger.exception('Failed to enqueue dump snapshot v%s, falling back to a thread', version)
+    threading.Thread(target=build_dump_snapshot, args=(version,), daemon=True).start()
+
+
+def build_dump_snapshot(version):
+    """Background entry point; a build for a version the catalog has already left is skipped."""
+    try:
+        if get_catalog_version() == version:
+            full_dump_snapshot()
+    except Exception:
+        logger.exception('Building dump snapshot v%s failed', version)
+    finally:
+        cache.delete(_building_cache_key(version))
+
+
+def full_dump_snapshot():
+    """Return metadata for the current catalog version's snapshot, building it here if missing."""
+    read_at = timezone.now()
+    version = get_catalog_version()
+    meta = _read_meta(version)
+    if meta is not None:
+        return meta
+    with _build_lock:
+        meta = _read_meta(version)
+        if meta is None:
+            meta = build_full_dump_snapshot(version, read_at)
+    return meta
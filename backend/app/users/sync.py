@@ -1,8 +1,36 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from .serializers import (
+    CategorySerializer,
+    DocumentSerializer,
+    PostSerializer,
+    SubheadSerializer,
+    document_preview_url,
+    document_tiles_url,
+)
+from .models import CatalogChange, Category, Document, Post, Subhead
+
+STREAM_CHUNK_SIZE = 500
+
+_DELTA_SECTIONS = {
+    'document': 'documents',
+    'category': 'categories',
+    'subhead': 'subheads',
+    'post': 'posts',
+}
 
-from .serializers import CategorySerializer, DocumentSerializer, SubheadSerializer
-from .models import Category, Document, Subhead
+_DOCUMENT_VALUE_FIELDS = (
+    'id', 'document_id', 'name', 'version', 'link', 'internal_link', 'last_updated', 'drawing_id',
+    'description', 'content_type', 'file_size', 'is_archived', 'subhead', 'sha256',
+)
 
 
 def _parse_diff_flag(diff_value):
@@ -17,7 +45,35 @@ def _parse_diff_flag(diff_value):
     raise ValueError('diff must be one of true/false, 1/0, or yes/no.')
 
 
-def build_dump_payload(last_synced=None, diff_value=None):
+class CursorExpired(ValueError):
+    """The cursor points at journal entries that have already been pruned."""
+
+
+def encode_cursor(change_id):
+    return base64.urlsafe_b64encode(f'c{change_id}'.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('ascii')
+        if not raw.startswith('c'):
+            raise ValueError
+        change_id = int(raw[1:])
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('cursor is not a valid sync cursor.')
+    if change_id < 0:
+        raise ValueError('cursor is not a valid sync cursor.')
+    return change_id
+
+
+def current_cursor():
+    """Cursor for the newest journal entry; read it before the data so nothing is skipped."""
+    latest = CatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+    return encode_cursor(latest or 0)
+
+
+def _dump_documents(last_synced, diff_value):
+    """Validate the dump filters and return (documents queryset, mode, use_diff)."""
     use_diff = _parse_diff_flag(diff_value)
     parsed_last_synced = parse_datetime(last_synced) if last_synced else None
 
@@ -27,14 +83,30 @@ def build_dump_payload(last_synced=None, diff_value=None):
     documents = Document.objects.all()
     mode = 'full'
     if use_diff and parsed_last_synced is not None:
-        documents = documents.filter(last_updated__gt=parsed_last_synced)
+        # Filtering through a subquery lets SQLite drive the lookup from document_last_updated_idx;
+        # a plain range filter loses to the ordering index and scans the whole table.
+        changed = Document.objects.filter(last_updated__gt=parsed_last_synced).order_by().values('pk')
+        documents = documents.filter(pk__in=changed)
         mode = 'incremental'
+    return documents, mode, use_diff
+
+
+def is_full_dump_request(last_synced, diff_value):
+    """True when the filters select the unfiltered dump that snapshots are built for."""
+    return not last_synced and _parse_diff_flag(diff_value)
+
+
+def build_dump_payload(last_synced=None, diff_value=None):
+    documents, mode, use_diff = _dump_documents(last_synced, diff_value)
+    cursor = current_cursor()
 
     categories = Category.objects.all()
-    subheads = Subhead.objects.all()
+    subheads = SubheadSerializer.setup_eager_loading(Subhead.objects.all())
+
+    document_data = DocumentSerializer(DocumentSerializer.setup_eager_loading(documents), many=True).data
 
     return {
-        'documents': DocumentSerializer(documents, many=True).data,
+        'documents': document_data,
         'categories': CategorySerializer(categories, many=True).data,
         'subheads': SubheadSerializer(subheads, many=True).data,
         'timestamp': timezone.now().isoformat(),
@@ -43,5 +115,186 @@ def build_dump_payload(last_synced=None, diff_value=None):
             'last_synced': last_synced,
             'diff': use_diff,
         },
-        'document_count': documents.count(),
-    }
\ No newline at end of file
+        'document_count': len(document_data),
+        'cursor': cursor,
+    }
+
+
+def _document_rows(documents):
+    """Yield DocumentSerializer-shaped dicts from .values() rows, one category query per chunk."""
+    datetime_field = serializers.DateTimeField()
+    through = Document.category.through
+    rows = documents.order_by('pk').values(*_DOCUMENT_VALUE_FIELDS).iterator(chunk_size=STREAM_CHUNK_SIZE)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) < STREAM_CHUNK_SIZE:
+            continue
+        yield from _attach_categories(chunk, through, datetime_field)
+        chunk = []
+    if chunk:
+        yield from _attach_categories(chunk, through, datetime_field)
+
+
+def _attach_categories(chunk, through, datetime_field):
+    categories = {}
+    links = through.objects.filter(document_id__in=[row['id'] for row in chunk]).values_list(
+        'document_id', 'category_id', 'category__name',
+    )
+    for document_pk, category_id, category_name in links:
+        categories.setdefault(document_pk, []).append({'id': category_id, 'name': category_name})
+
+    for row in chunk:
+        document_pk = row.pop('id')
+        sha256 = row.pop('sha256')
+        row['category'] = categories.get(document_pk, [])
+        row['last_updated'] = datetime_field.to_representation(row['last_updated'])
+        row['preview_url'] = document_preview_url(sha256)
+        row['tiles_url'] = document_tiles_url(sha256, row['content_type'])
+        yield row
+
+
+def prepare_dump_stream(last_synced=None, diff_value=None, on_complete=None):
+    """Validate filters up front so errors surface before any bytes are sent, then return the NDJSON lines.
+
+    ``on_complete(mode, document_count)`` runs once the last line has been produced.
+    """
+    documents, mode, use_diff = _dump_documents(last_synced, diff_value)
+    header = {
+        'type': 'meta',
+        'timestamp': timezone.now().isoformat(),
+        'mode': mode,
+        'filters': {'last_synced': last_synced, 'diff': use_diff},
+        'cursor': current_cursor(),
+    }
+    return _iter_dump_lines(header, documents, on_complete)
+
+
+def _ndjson(record):
+    return json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _category_rows(categories=None):
+    categories = Category.objects.all() if categories is None else categories
+    return categories.order_by('pk').values('id', 'name').iterator(chunk_size=STREAM_CHUNK_SIZE)
+
+
+def _subhead_rows(subheads=None):
+    subheads = (Subhead.objects.all() if subheads is None else subheads).order_by('pk').values(
+        'id', 'name', 'category', 'category__name', 'crawler_id', 'drawing_count',
+    ).iterator(chunk_size=STREAM_CHUNK_SIZE)
+    for subhead in subheads:
+        subhead['category_name'] = subhead.pop('category__name')
+        yield subhead
+
+
+def _iter_dump_lines(header, documents, on_complete=None):
+    yield _ndjson(header)
+    for category in _category_rows():
+        yield _ndjson({'type': 'category', 'data': category})
+    for subhead in _subhead_rows():
+        yield _ndjson({'type': 'subhead', 'data': subhead})
+
+    document_count = 0
+    for document in _document_rows(documents):
+        document_count += 1
+        yield _ndjson({'type': 'document', 'data': document})
+    yield _ndjson({'type': 'end', 'document_count': document_count})
+    if on_complete is not None:
+        on_complete(header['mode'], document_count)
+
+
+def _json_array(rows, on_row=None):
+    yield b'['
+    for index, row in enumerate(rows):
+        if on_row is not None:
+            on_row()
+        yield (b',' if index else b'') + json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+    yield b']'
+
+
+def iter_full_dump_json(timestamp, on_complete=None):
+    """Yield the unfiltered build_dump_payload document as JSON bytes without holding it in memory.
+
+    ``on_complete(document_count)`` runs once the closing brace has been produced.
+    """
+    documents, mode, use_diff = _dump_documents(None, None)
+    cursor = current_cursor()
+    document_count = 0
+
+    def count_document():
+        nonlocal document_count
+        document_count += 1
+
+    yield b'{"documents":'
+    yield from _json_array(_document_rows(documents), on_row=count_document)
+    yield b',"categories":'
+    yield from _json_array(_category_rows())
+    yield b',"subheads":'
+    yield from _json_array(_subhead_rows())
+    tail = {
+        'timestamp': timestamp,
+        'mode': mode,
+        'filters': {'last_synced': None, 'diff': use_diff},
+        'document_count': document_count,
+        'cursor': cursor,
+    }
+    yield b',' + json.dumps(tail, separators=(',', ':')).encode('utf-8')[1:]
+    if on_complete is not None:
+        on_complete(document_count)
+
+
+def _latest_changes(after, limit):
+    changes = list(
+        CatalogChange.objects.filter(id__gt=after).order_by('id')
+        .values('id', 'model', 'object_id', 'object_key', 'action')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    latest = {}
+    for change in changes:
+        latest[(change['model'], change['object_id'])] = change
+    last_id = changes[-1]['id'] if changes else after
+    return latest.values(), last_id, has_more
+
+
+def build_delta_payload(cursor):
+    """Return everything journaled after ``cursor``: current rows for upserts and tombstones for deletes.
+
+    At most DUMP_DELTA_PAGE_SIZE journal entries are read per call; ``has_more``
+    tells the client to call again with the returned cursor.
+    """
+    after = decode_cursor(cursor)
+    oldest = CatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+    if oldest is not None and after < oldest - 1:
+        raise CursorExpired('cursor has expired; run a full dump and continue from its cursor.')
+
+    changes, last_id, has_more = _latest_changes(after, settings.DUMP_DELTA_PAGE_SIZE)
+    upserts = {model: [] for model in _DELTA_SECTIONS}
+    deleted = {section: [] for section in _DELTA_SECTIONS.values()}
+    for change in changes:
+        if change['action'] != CatalogChange.ACTION_DELETE:
+            upserts[change['model']].append(change['object_id'])
+        elif change['model'] == 'document':
+            # Documents are keyed by document_id on the client.
+            deleted['documents'].append(change['object_key'])
+        else:
+            deleted[_DELTA_SECTIONS[change['model']]].append(change['object_id'])
+
+    # Rows deleted after this page are simply absent; their tombstones come with a later page.
+    documents = list(_document_rows(Document.objects.filter(pk__in=upserts['document'])))
+    posts = PostSerializer.setup_eager_loading(Post.objects.filter(pk__in=upserts['post']))
+    return {
+        'documents': documents,
+        'categories': list(_category_rows(Category.objects.filter(pk__in=upserts['category']))),
+        'subheads': list(_subhead_rows(Subhead.objects.filter(pk__in=upserts['subhead']))),
+        'posts': PostSerializer(posts, many=True).data,
+        'deleted': deleted,
+        'timestamp': timezone.now().isoformat(),
+        'mode': 'delta',
+        'filters': {'cursor': cursor},
+        'document_count': len(documents),
+        'cursor': encode_cursor(last_id),
+        'has_more': has_more,
+    }
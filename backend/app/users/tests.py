@@ -8,19 +8,54 @@ Run with:
     python manage.py test users -v2
 """
 
+import gzip
+import hashlib
+import io
+import json
 import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+from datetime import datetime, timedelta
 from pathlib import Path
 from unittest.mock import patch
 
 from dotenv import load_dotenv
 
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status as http_status
-
-from users.models import AuditLog, Category, CrawlerRun, Document, Post, User
+from PIL import Image
+from prometheus_client import REGISTRY
+from pypdf import PdfReader
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas as rl_canvas
+
+from users.models import AuditLog, CatalogChange, CatalogImportRun, Category, CrawlerRun, Document, Post, Subhead, User, WatermarkJob
+from users import audit, identifiers, jsonstream
+from users.catalog import catalog_change_batch, get_catalog_version
+from users.catalog_jobs import CATALOG_FILES_LOCK_KEY, catalog_files_lock, execute_catalog_import
+from users.crawler import execute_crawler_run
+from users.crawler_import import RECORD_PREFIX, CrawlerRecordImport
+from users.sync import encode_cursor
+from users.imaging import open_source_image
+from users.previews import generate_previews, preview_path
+from users.snapshots import purge_stale_snapshots
+from users.utils import accel_redirect_uri, log_audit, log_audit_bulk
+from users.watermark import (
+    _overlay_template, evict_watermark_cache, get_prepared_pdf, watermark_pdf, watermark_stream,
+)
+from users.watermark_jobs import execute_watermark_item, execute_watermark_job
 
 # ---------------------------------------------------------------------------
 # Admin credentials loaded from .env
@@ -107,6 +142,19 @@ class APITestMixin:
         return APIClient()
 
 
+class TempStorageMixin:
+    """Points RDSO_STORAGE_ROOT at a fresh temporary directory for one test."""
+
+    def _use_temp_storage(self, **overrides):
+        """Create the directory, apply it and any extra setting overrides, and return its path."""
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(RDSO_STORAGE_ROOT=root, **overrides)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return root
+
+
 # ===================================================================
 # A.  REGISTRATION TESTS
 # ===================================================================
@@ -614,6 +662,40 @@ class DumpTests(APITestMixin, TestCase):
         resp = c.get(reverse("dump"), {"last_synced": "not-a-date"})
         self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
 
+    def _stream(self, **params):
+        resp = self._user_client().get(reverse("dump"), {"stream": "ndjson", **params})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in b"".join(resp.streaming_content).splitlines()]
+
+    def test_dump_stream_matches_serializer_rows(self):
+        records = self._stream()
+        self.assertEqual(records[0]["type"], "meta")
+        self.assertEqual(records[0]["mode"], "full")
+        self.assertEqual(records[-1], {"type": "end", "document_count": 1})
+
+        documents = [record["data"] for record in records if record["type"] == "document"]
+        self.assertEqual(documents, self._user_client().get(reverse("document-list")).data)
+        self.assertEqual(
+            [record["data"]["name"] for record in records if record["type"] == "category"], ["CatA"],
+        )
+
+    def test_dump_stream_incremental(self):
+        records = self._stream(last_synced="2099-01-01T00:00:00Z")
+        self.assertEqual(records[0]["mode"], "incremental")
+        self.assertEqual(records[-1]["document_count"], 0)
+
+    def test_dump_stream_queries_do_not_grow_with_documents(self):
+        for idx in range(5):
+            self._create_document(f"DOC-EXTRA-{idx}", categories=["CatA", f"Cat{idx}"])
+        c = self._user_client()
+        with self.assertNumQueries(6):
+            b"".join(c.get(reverse("dump"), {"stream": "true"}).streaming_content)
+
+    def test_dump_stream_rejects_invalid_filters(self):
+        resp = self._user_client().get(reverse("dump"), {"stream": "ndjson", "diff": "maybe"})
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+
     def test_dump_unauthenticated(self):
         resp = self._anon_client().get(reverse("dump"))
         self.assertEqual(resp.status_code, http_status.HTTP_401_UNAUTHORIZED)
@@ -1077,4 +1159,1736 @@ class SecurityTests(APITestMixin, TestCase):
         }, format="json")
         self.assertEqual(resp.status_code, http_status.HTTP_201_CREATED)
         user = User.objects.get(HRMS_ID="HACK-STATUS")
-        self.assertEqual(user.user_status, "pending")
\ No newline at end of file
+        self.assertEqual(user.user_status, "pending")
+
+
+# ===================================================================
+# Q.  FILE SERVING TESTS
+# ===================================================================
+class FileServeTests(TempStorageMixin, APITestMixin, TestCase):
+    PAGE_SIZES = [(612, 792), (612, 792), (1684, 1190)]
+
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.storage_root = self._use_temp_storage(WATERMARK_CACHE_ROOT="")
+
+        os.makedirs(os.path.join(self.storage_root, "cat", "sub"))
+        self.pdf_path = os.path.join(self.storage_root, "cat", "sub", "drawing.pdf")
+        self._write_pdf(self.pdf_path, self.PAGE_SIZES)
+        self.doc = Document.objects.create(
+            document_id="DOC-FILE", name="Drawing", storage_path="cat/sub",
+            file_name_on_disk="drawing.pdf", content_type="application/pdf",
+            sha256="ab" * 32,
+        )
+
+    @staticmethod
+    def _write_pdf(path, page_sizes):
+        c = rl_canvas.Canvas(path)
+        for idx, size in enumerate(page_sizes):
+            c.setPageSize(size)
+            c.drawString(72, 72, f"Page {idx + 1}")
+            c.showPage()
+        c.save()
+
+    def test_download_streams_watermarked_pdf(self):
+        c = self._user_client()
+        resp = c.get(reverse("document-list"), {"document_ids": "DOC-FILE", "download": "true"})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertTrue(resp.streaming)
+        body = b"".join(resp.streaming_content)
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+        self.assertIn("attachment", resp["Content-Disposition"])
+
+        reader = PdfReader(io.BytesIO(body))
+        self.assertEqual(len(reader.pages), len(self.PAGE_SIZES))
+        self.assertIn("Downloaded by 100", reader.pages[2].extract_text())
+
+    @override_settings(WATERMARK_MODE="rewrite")
+    def test_download_uses_prepared_source_cache(self):
+        c = self._user_client()
+        params = {"document_ids": "DOC-FILE", "download": "true"}
+        b"".join(c.get(reverse("document-list"), params).streaming_content)
+
+        prepared = get_prepared_pdf(self.pdf_path, self.doc.sha256)
+        self.assertTrue(prepared.pdf_path.is_file())
+        self.assertEqual(prepared.manifest["page_count"], len(self.PAGE_SIZES))
+        self.assertEqual(prepared.manifest["pages"][2]["box"], [0, 0, 1684, 1190])
+
+        resp = c.get(reverse("document-list"), params)
+        reader = PdfReader(io.BytesIO(b"".join(resp.streaming_content)))
+        self.assertEqual(len(reader.pages), len(self.PAGE_SIZES))
+        self.assertIn("Downloaded by 100", reader.pages[0].extract_text())
+        self.assertIn("Page 1", reader.pages[0].extract_text())
+
+    @override_settings(FILE_SERVE_TRACK_MEMORY=True)
+    def test_memory_is_traced_until_download_body_is_sent(self):
+        labels = {"mode": "download"}
+        before = REGISTRY.get_sample_value("railway_file_serve_peak_memory_bytes_count", labels) or 0
+        c = self._user_client()
+        resp = c.get(reverse("document-list"), {"document_ids": "DOC-FILE", "download": "true"})
+        self.assertTrue(tracemalloc.is_tracing())
+        b"".join(resp.streaming_content)
+        resp.close()
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(REGISTRY.get_sample_value("railway_file_serve_peak_memory_bytes_count", labels), before + 1)
+
+    @override_settings(WATERMARK_MODE="incremental")
+    def test_incremental_mode_appends_revision_to_prepared_source(self):
+        c = self._user_client()
+        resp = c.get(reverse("document-list"), {"document_ids": "DOC-FILE", "download": "true"})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        body = b"".join(resp.streaming_content)
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+
+        prepared = get_prepared_pdf(self.pdf_path, self.doc.sha256)
+        original = prepared.pdf_path.read_bytes()
+        self.assertTrue(body.startswith(original))
+        self.assertLess(len(body) - len(original), 16 * 1024)
+
+        reader = PdfReader(io.BytesIO(body), strict=True)
+        self.assertEqual(len(reader.pages), len(self.PAGE_SIZES))
+        for page in reader.pages:
+            self.assertIn("Downloaded by 100", page.extract_text())
+
+    def test_incremental_stream_closes_source_when_abandoned(self):
+        chunks, _ = watermark_stream(self.pdf_path, "Downloaded by 100 at now", self.doc.sha256, "incremental")
+        response = StreamingHttpResponse(chunks)
+        next(iter(response))
+        response.close()
+        self.assertTrue(chunks._handle.closed)
+
+    def test_incremental_mode_falls_back_when_prepared_copy_evicted(self):
+        prepared = get_prepared_pdf(self.pdf_path, self.doc.sha256)
+        # Evicted between reading the manifest and opening the prepared copy.
+        with patch("users.watermark._prepare_for_watermark", side_effect=[prepared, None]):
+            prepared.pdf_path.unlink()
+            chunks, size = watermark_stream(self.pdf_path, "Downloaded by 100 at now", self.doc.sha256, "incremental")
+            body = b"".join(chunks)
+
+        self.assertEqual(size, len(body))
+        reader = PdfReader(io.BytesIO(body))
+        self.assertEqual(len(reader.pages), len(self.PAGE_SIZES))
+        self.assertIn("Downloaded by 100", reader.pages[0].extract_text())
+
+    def test_prepared_source_rebuilt_when_file_changes(self):
+        first = get_prepared_pdf(self.pdf_path, self.doc.sha256)
+        self._write_pdf(self.pdf_path, [(612, 792)])
+        second = get_prepared_pdf(self.pdf_path, self.doc.sha256)
+        self.assertEqual(first.manifest["page_count"], 3)
+        self.assertEqual(second.manifest["page_count"], 1)
+
+    def test_cache_evicts_least_recently_used(self):
+        old = get_prepared_pdf(self.pdf_path, "11" * 32)
+        os.utime(old.pdf_path, (0, 0))
+        recent = get_prepared_pdf(self.pdf_path, "22" * 32)
+        entry_size = recent.pdf_path.stat().st_size + recent.pdf_path.with_suffix(".json").stat().st_size
+
+        self.assertEqual(evict_watermark_cache(max_bytes=entry_size), 1)
+        self.assertFalse(old.pdf_path.exists())
+        self.assertTrue(recent.pdf_path.exists())
+
+    def test_overlay_template_reused_across_texts(self):
+        _overlay_template.cache_clear()
+        watermark_pdf(self.pdf_path, "Downloaded by 100 at 10:00:00").close()
+        self.assertEqual(_overlay_template.cache_info().misses, 2)
+
+        out = watermark_pdf(self.pdf_path, "Downloaded by 200 at 10:00:01")
+        self.assertEqual(_overlay_template.cache_info().misses, 2)
+        reader = PdfReader(out)
+        self.assertIn("Downloaded by 200 at 10:00:01", reader.pages[2].extract_text())
+        self.assertNotIn("Downloaded by 100", reader.pages[2].extract_text())
+
+    def _inline(self, client, **headers):
+        return client.get(
+            reverse("document-list"),
+            {"document_ids": "DOC-FILE", "download": "false"},
+            headers=headers,
+        )
+
+    def test_inline_view_sets_validators(self):
+        resp = self._inline(self._user_client())
+        self.assertEqual(resp["ETag"], f'"{self.doc.sha256}-{os.path.getsize(self.pdf_path)}"')
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+        self.assertIn("Last-Modified", resp)
+
+    def test_inline_view_not_modified_for_matching_etag(self):
+        c = self._user_client()
+        etag = self._inline(c)["ETag"]
+        resp = self._inline(c, **{"If-None-Match": etag})
+        self.assertEqual(resp.status_code, http_status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp["ETag"], etag)
+
+    def test_inline_view_serves_byte_range(self):
+        with open(self.pdf_path, "rb") as handle:
+            original = handle.read()
+        c = self._user_client()
+        resp = self._inline(c, Range="bytes=10-19")
+        self.assertEqual(resp.status_code, http_status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(resp["Content-Range"], f"bytes 10-19/{len(original)}")
+        self.assertEqual(b"".join(resp.streaming_content), original[10:20])
+
+        resp = self._inline(c, Range="bytes=-5")
+        self.assertEqual(b"".join(resp.streaming_content), original[-5:])
+
+    def test_inline_view_rejects_unsatisfiable_range(self):
+        size = os.path.getsize(self.pdf_path)
+        resp = self._inline(self._user_client(), Range=f"bytes={size + 10}-")
+        self.assertEqual(resp.status_code, http_status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(resp["Content-Range"], f"bytes */{size}")
+
+    def test_inline_view_ignores_range_when_if_range_is_stale(self):
+        resp = self._inline(self._user_client(), Range="bytes=0-9", **{"If-Range": '"stale"'})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(len(b"".join(resp.streaming_content)), os.path.getsize(self.pdf_path))
+
+    @override_settings(FILE_SERVE_ACCEL_REDIRECT=True)
+    def test_inline_view_offloads_to_nginx(self):
+        c = self._user_client()
+        resp = self._inline(c)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["X-Accel-Redirect"], "/protected/rdso/cat/sub/drawing.pdf")
+        self.assertEqual(resp.content, b"")
+        self.assertIn("inline", resp["Content-Disposition"])
+        self.assertEqual(AuditLog.objects.filter(action="document_view", target_id="DOC-FILE").count(), 1)
+
+        resp = self._inline(c, **{"If-None-Match": resp["ETag"]})
+        self.assertEqual(resp.status_code, http_status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn("X-Accel-Redirect", resp)
+
+    @override_settings(FILE_SERVE_ACCEL_REDIRECT=True)
+    def test_watermarked_download_is_not_offloaded(self):
+        resp = self._user_client().get(reverse("document-list"), {"document_ids": "DOC-FILE", "download": "true"})
+        self.assertNotIn("X-Accel-Redirect", resp)
+        self.assertTrue(resp.streaming)
+
+    def test_accel_redirect_uri_quotes_path(self):
+        path = os.path.join(os.path.realpath(self.storage_root), "cat", "a b#.pdf")
+        self.assertEqual(accel_redirect_uri(path), "/protected/rdso/cat/a%20b%23.pdf")
+        self.assertIsNone(accel_redirect_uri("/etc/passwd"))
+
+    def test_inline_view_serves_original_bytes(self):
+        c = self._user_client()
+        resp = c.get(reverse("document-list"), {"document_ids": "DOC-FILE", "download": "false"})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertIn("inline", resp["Content-Disposition"])
+        with open(self.pdf_path, "rb") as handle:
+            self.assertEqual(b"".join(resp.streaming_content), handle.read())
+
+
+# ===================================================================
+# R.  WATERMARK JOB TESTS
+# ===================================================================
+@override_settings(WATERMARK_USE_QUEUE=False, WATERMARK_JOB_WORKERS=1)
+class WatermarkJobTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.storage_root = self._use_temp_storage(WATERMARK_CACHE_ROOT="", WATERMARK_JOB_ROOT="")
+
+        os.makedirs(os.path.join(self.storage_root, "cat", "sub"))
+        for doc_id, file_name in (("DOC-A", "a.pdf"), ("DOC-B", "b.pdf")):
+            FileServeTests._write_pdf(os.path.join(self.storage_root, "cat", "sub", file_name), [(612, 792)])
+            Document.objects.create(
+                document_id=doc_id, name=doc_id, storage_path="cat/sub",
+                file_name_on_disk=file_name, content_type="application/pdf",
+            )
+
+    def _submit(self, client=None, document_ids="DOC-A,DOC-B"):
+        with patch("users.watermark_jobs.execute_watermark_job") as mocked_execute:
+            resp = (client or self._user_client()).post(
+                reverse("watermark-job-create"), {"document_ids": document_ids}, format="json",
+            )
+        if resp.status_code == http_status.HTTP_202_ACCEPTED:
+            mocked_execute.assert_called_once_with(resp.data["job_id"])
+        return resp
+
+    def test_submit_creates_job_and_audits_each_document(self):
+        resp = self._submit()
+        self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+        job = WatermarkJob.objects.get(pk=resp.data["job_id"])
+        self.assertEqual(job.execution_mode, WatermarkJob.EXECUTION_THREAD)
+        self.assertEqual(job.items.count(), 2)
+        self.assertEqual(
+            AuditLog.objects.filter(action="document_view", metadata__job_id=job.pk).count(), 2,
+        )
+
+    def test_submit_rejects_unknown_documents(self):
+        resp = self._submit(document_ids=["DOC-A", "NOPE"])
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.data["missing"], ["NOPE"])
+        self.assertFalse(WatermarkJob.objects.exists())
+
+    def test_finished_job_reports_ready_urls(self):
+        job_id = self._submit().data["job_id"]
+        execute_watermark_job(job_id)
+
+        c = self._user_client()
+        resp = c.get(reverse("watermark-job-status", args=[job_id]))
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp.data["status"], WatermarkJob.STATUS_SUCCEEDED)
+        self.assertFalse(resp.data["running"])
+        self.assertEqual(resp.data["completed"], 2)
+
+        resp = c.get(resp.data["items"][0]["url"])
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertIn('filename="a.pdf"', resp["Content-Disposition"])
+        reader = PdfReader(io.BytesIO(b"".join(resp.streaming_content)))
+        self.assertIn("Downloaded by 100", reader.pages[0].extract_text())
+
+    def test_archive_streams_all_watermarked_documents(self):
+        job_id = self._submit().data["job_id"]
+        c = self._user_client()
+        self.assertEqual(
+            c.get(reverse("watermark-job-archive", args=[job_id])).status_code, http_status.HTTP_409_CONFLICT,
+        )
+
+        execute_watermark_job(job_id)
+        resp = c.get(reverse("watermark-job-archive", args=[job_id]))
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["Content-Type"], "application/zip")
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(resp.streaming_content)))
+        self.assertEqual(archive.namelist(), ["a.pdf", "b.pdf"])
+        reader = PdfReader(io.BytesIO(archive.read("b.pdf")))
+        self.assertIn("Downloaded by 100", reader.pages[0].extract_text())
+
+    def test_missing_file_marks_item_failed(self):
+        os.remove(os.path.join(self.storage_root, "cat", "sub", "b.pdf"))
+        job_id = self._submit().data["job_id"]
+        execute_watermark_job(job_id)
+
+        resp = self._user_client().get(reverse("watermark-job-status", args=[job_id]))
+        self.assertEqual(resp.data["status"], WatermarkJob.STATUS_SUCCEEDED)
+        self.assertEqual(resp.data["failed"], 1)
+        self.assertIsNone(resp.data["items"][1]["url"])
+
+    def test_failed_write_removes_temporary_file(self):
+        def broken_stream(*args, **kwargs):
+            yield b"%PDF-1.7\n"
+            raise OSError("disk full")
+
+        job_id = self._submit(document_ids="DOC-A").data["job_id"]
+        with patch("users.watermark_jobs.watermark_stream", return_value=(broken_stream(), 0)):
+            execute_watermark_job(job_id)
+
+        item = WatermarkJob.objects.get(pk=job_id).items.get()
+        self.assertEqual(item.status, "failed")
+        self.assertEqual(list((self.storage_root / "_watermark_jobs" / str(job_id)).iterdir()), [])
+
+    def test_abandoned_job_fails_pending_documents(self):
+        job_id = self._submit().data["job_id"]
+        job = WatermarkJob.objects.get(pk=job_id)
+        first, second = job.items.all()
+        execute_watermark_item(first.pk)
+        # The worker died before the second document; nothing has happened since.
+        long_ago = timezone.now() - timedelta(seconds=settings.WATERMARK_JOB_STALE_SECONDS + 60)
+        WatermarkJob.objects.filter(pk=job_id).update(queued_at=long_ago, started_at=long_ago)
+        job.items.update(finished_at=long_ago)
+        tmp_path = self.storage_root / "_watermark_jobs" / str(job_id) / f"{second.pk}.pdf.tmp"
+        tmp_path.write_bytes(b"partial")
+
+        resp = self._user_client().get(reverse("watermark-job-status", args=[job_id]))
+        self.assertEqual(resp.data["status"], WatermarkJob.STATUS_SUCCEEDED)
+        self.assertFalse(resp.data["running"])
+        self.assertEqual((resp.data["completed"], resp.data["failed"]), (1, 1))
+        self.assertTrue(resp.data["items"][1]["error"].startswith("Abandoned"))
+        self.assertFalse(tmp_path.exists())
+
+    def test_running_job_is_not_abandoned(self):
+        job_id = self._submit().data["job_id"]
+        resp = self._user_client().get(reverse("watermark-job-status", args=[job_id]))
+        self.assertTrue(resp.data["running"])
+        self.assertEqual(resp.data["pending"], 2)
+
+    @override_settings(WATERMARK_USE_QUEUE=True)
+    @patch("django_rq.get_queue")
+    def test_queue_mode_enqueues_one_job_per_document(self, mocked_get_queue):
+        mocked_get_queue.return_value.enqueue.return_value.id = "rq-1"
+        mocked_get_queue.return_value.count = 2
+        resp = self._user_client().post(
+            reverse("watermark-job-create"), {"document_ids": "DOC-A,DOC-B"}, format="json",
+        )
+        self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+        self.assertEqual(resp.data["execution_mode"], WatermarkJob.EXECUTION_QUEUE)
+        self.assertEqual(mocked_get_queue.return_value.enqueue.call_count, 2)
+
+    def test_other_users_cannot_see_job(self):
+        job_id = self._submit().data["job_id"]
+        other = User.objects.create_user(HRMS_ID="101", password="other12345")
+        other.user_status = "accepted"
+        other.save()
+        c = self._user_client("101", "other12345")
+        self.assertEqual(
+            c.get(reverse("watermark-job-status", args=[job_id])).status_code, http_status.HTTP_404_NOT_FOUND,
+        )
+        resp = self._admin_client().get(reverse("watermark-job-status", args=[job_id]))
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+
+
+# ===================================================================
+# S.  DOCUMENT ARCHIVE TESTS
+# ===================================================================
+class DocumentArchiveTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.storage_root = self._use_temp_storage(WATERMARK_CACHE_ROOT="")
+
+        folder = os.path.join(self.storage_root, "cat", "sub")
+        os.makedirs(folder)
+        FileServeTests._write_pdf(os.path.join(folder, "a.pdf"), [(612, 792)])
+        with open(os.path.join(folder, "b.bmp"), "wb") as handle:
+            handle.write(b"BM" + b"\x00" * 4096)
+
+        category = Category.objects.create(name="Cat")
+        self.subhead = Subhead.objects.create(name="Sub", category=category)
+        for doc_id, file_name, content_type in (
+            ("DOC-A", "a.pdf", "application/pdf"),
+            ("DOC-B", "b.bmp", "image/bmp"),
+            ("DOC-GONE", "gone.pdf", "application/pdf"),
+        ):
+            Document.objects.create(
+                document_id=doc_id, name=doc_id, storage_path="cat/sub", subhead=self.subhead,
+                file_name_on_disk=file_name, content_type=content_type,
+            )
+
+    def _archive(self, **params):
+        resp = self._user_client().get(reverse("document-archive"), params)
+        if resp.status_code != http_status.HTTP_200_OK:
+            return resp, None
+        return resp, zipfile.ZipFile(io.BytesIO(b"".join(resp.streaming_content)))
+
+    def test_subhead_archive_streams_watermarked_files(self):
+        resp, archive = self._archive(subhead=self.subhead.pk)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertIn(f"subhead-{self.subhead.pk}.zip", resp["Content-Disposition"])
+        self.assertEqual(archive.namelist(), ["a.pdf", "b.bmp"])
+        self.assertEqual(archive.getinfo("a.pdf").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo("b.bmp").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.read("b.bmp"), b"BM" + b"\x00" * 4096)
+        reader = PdfReader(io.BytesIO(archive.read("a.pdf")))
+        self.assertIn("Downloaded by 100", reader.pages[0].extract_text())
+
+    def test_archive_audits_included_documents(self):
+        self._archive(document_ids="DOC-A,DOC-B,DOC-GONE")
+        logged = AuditLog.objects.filter(action="document_view", metadata__download=True)
+        self.assertEqual(sorted(logged.values_list("target_id", flat=True)), ["DOC-A", "DOC-B"])
+
+    def test_archive_requires_selection(self):
+        resp, _ = self._archive()
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+        resp, _ = self._archive(subhead="abc")
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+        resp, _ = self._archive(document_ids="DOC-GONE")
+        self.assertEqual(resp.status_code, http_status.HTTP_404_NOT_FOUND)
+
+    @override_settings(DOCUMENT_ARCHIVE_MAX_DOCUMENTS=1)
+    def test_archive_rejects_too_many_documents(self):
+        resp, _ = self._archive(subhead=self.subhead.pk)
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+
+
+# ===================================================================
+# T.  PREVIEW TESTS
+# ===================================================================
+@override_settings(PREVIEW_MAX_SIZE=64, PREVIEW_ROOT="")
+class PreviewTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.storage_root = self._use_temp_storage()
+
+        folder = os.path.join(self.storage_root, "cat", "sub")
+        os.makedirs(folder)
+        scan = Image.new("1", (800, 400), color=1)
+        scan.save(os.path.join(folder, "scan.bmp"))
+        c = rl_canvas.Canvas(os.path.join(folder, "scan.pdf"), pagesize=(800, 400))
+        c.drawImage(ImageReader(scan.convert("L")), 0, 0, 800, 400)
+        c.showPage()
+        c.save()
+        FileServeTests._write_pdf(os.path.join(folder, "vector.pdf"), [(612, 792)])
+
+        self.docs = {}
+        for doc_id, file_name, content_type in (
+            ("DOC-BMP", "scan.bmp", "image/bmp"),
+            ("DOC-SCAN", "scan.pdf", "application/pdf"),
+            ("DOC-VECTOR", "vector.pdf", "application/pdf"),
+        ):
+            self.docs[doc_id] = Document.objects.create(
+                document_id=doc_id, name=doc_id, storage_path="cat/sub",
+                file_name_on_disk=file_name, content_type=content_type,
+                sha256=hashlib.sha256(doc_id.encode()).hexdigest(),
+            )
+
+    def test_generate_previews_renders_once_per_sha(self):
+        stats = generate_previews(Document.objects.all(), workers=1)
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(stats["unavailable"], 1)
+
+        with Image.open(preview_path(self.docs["DOC-SCAN"].sha256)) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertLessEqual(max(image.size), 64)
+
+        stats = generate_previews(Document.objects.all(), workers=1)
+        self.assertEqual(stats["created"], 0)
+        self.assertEqual(stats["skipped"], 3)
+
+    def test_raster_source_is_closed_after_render(self):
+        opened = []
+
+        def tracking_open(source_path):
+            image = open_source_image(source_path)
+            opened.append(image)
+            return image
+
+        with patch("users.previews.open_source_image", side_effect=tracking_open):
+            generate_previews([self.docs["DOC-BMP"]], workers=1)
+        self.assertEqual(len(opened), 1)
+        self.assertIsNone(opened[0].fp)
+
+    def test_generate_previews_with_process_pool(self):
+        stats = generate_previews(Document.objects.all(), workers=2)
+        self.assertEqual(stats["created"], 2)
+        self.assertTrue(preview_path(self.docs["DOC-BMP"].sha256).is_file())
+
+    def test_preview_endpoint_renders_on_demand_with_long_cache(self):
+        c = self._user_client()
+        url = c.get(reverse("document-list"), {"document_ids": "DOC-BMP"}).data[0]["preview_url"]
+        # A missing preview is rendered in the background, once, never inside the request.
+        with patch("users.previews.threading.Thread") as thread:
+            for _ in range(2):
+                resp = c.get(url)
+                self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+                self.assertEqual(resp["Retry-After"], "2")
+        thread.assert_called_once()
+        thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+
+        resp = c.get(url)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", resp["Cache-Control"])
+
+        resp = c.get(url, headers={"If-None-Match": resp["ETag"]})
+        self.assertEqual(resp.status_code, http_status.HTTP_304_NOT_MODIFIED)
+
+    def test_failed_render_is_not_retried(self):
+        Path(self.storage_root, "cat", "sub", "scan.bmp").write_bytes(b"not an image")
+        url = reverse("document-preview", args=[self.docs["DOC-BMP"].sha256])
+        c = self._user_client()
+        with patch("users.previews.threading.Thread") as thread:
+            self.assertEqual(c.get(url).status_code, http_status.HTTP_202_ACCEPTED)
+        with self.assertLogs("users.previews", "WARNING"):
+            thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+
+        with patch("users.previews.threading.Thread") as thread:
+            self.assertEqual(c.get(url).status_code, http_status.HTTP_404_NOT_FOUND)
+        thread.assert_not_called()
+        self.assertEqual(generate_previews([self.docs["DOC-BMP"]], workers=1)["skipped"], 1)
+
+    def test_preview_endpoint_404_without_preview(self):
+        c = self._user_client()
+        url = reverse("document-preview", args=[self.docs["DOC-VECTOR"].sha256])
+        with patch("users.previews.threading.Thread") as thread:
+            self.assertEqual(c.get(url).status_code, http_status.HTTP_202_ACCEPTED)
+        thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+        resp = c.get(url)
+        self.assertEqual(resp.status_code, http_status.HTTP_404_NOT_FOUND)
+        resp = c.get(reverse("document-preview", args=["not-a-hash"]))
+        self.assertEqual(resp.status_code, http_status.HTTP_404_NOT_FOUND)
+
+
+# ===================================================================
+# U.  RASTER TRANSCODING TESTS
+# ===================================================================
+@override_settings(IMAGE_TILE_SIZE=256, IMAGE_DISPLAY_MAX_SIZE=300, IMAGE_TRANSCODE_ROOT="")
+class RasterTranscodeTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.storage_root = self._use_temp_storage()
+
+        os.makedirs(os.path.join(self.storage_root, "cat", "sub"))
+        Image.new("1", (600, 300), color=1).save(os.path.join(self.storage_root, "cat", "sub", "scan.tif"))
+        self.doc = Document.objects.create(
+            document_id="DOC-TIF", name="Scan", storage_path="cat/sub",
+            file_name_on_disk="scan.tif", content_type="image/tiff",
+            sha256=hashlib.sha256(b"DOC-TIF").hexdigest(),
+        )
+
+    def test_display_variant_is_downscaled_and_cached(self):
+        c = self._user_client()
+        url = reverse("document-image", args=[self.doc.sha256])
+        resp = c.get(url, {"output": "png"})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertIn("immutable", resp["Cache-Control"])
+        with Image.open(io.BytesIO(b"".join(resp.streaming_content))) as image:
+            self.assertEqual(image.size, (300, 150))
+
+        with patch("users.imaging.open_source_image") as mocked_open:
+            resp = c.get(url, {"output": "png"})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        mocked_open.assert_not_called()
+
+        self.assertEqual(c.get(url, {"output": "gif"}).status_code, http_status.HTTP_400_BAD_REQUEST)
+
+    def test_tile_pyramid_descriptor_and_tiles(self):
+        c = self._user_client()
+        tiles_url = c.get(reverse("document-list"), {"document_ids": "DOC-TIF"}).data[0]["tiles_url"]
+        # The first views only start one background build; the pyramid is never built in the request.
+        with patch("users.imaging.threading.Thread") as thread:
+            for _ in range(2):
+                resp = c.get(tiles_url)
+                self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+                self.assertEqual(resp["Retry-After"], "2")
+        thread.assert_called_once()
+        thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+
+        info = c.get(tiles_url).data
+        self.assertEqual((info["width"], info["height"], info["max_level"]), (600, 300, 10))
+
+        top = info["url_template"].format(level=10, col=2, row=1)
+        resp = c.get(top)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        with Image.open(io.BytesIO(b"".join(resp.streaming_content))) as tile:
+            self.assertEqual(tile.size, (88, 44))
+
+        with Image.open(io.BytesIO(b"".join(c.get(info["url_template"].format(level=0, col=0, row=0)).streaming_content))) as tile:
+            self.assertEqual(tile.size, (1, 1))
+        self.assertEqual(
+            c.get(info["url_template"].format(level=10, col=3, row=0)).status_code, http_status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_failed_tile_build_is_reported(self):
+        Path(self.storage_root, "cat", "sub", "scan.tif").write_bytes(b"not an image")
+        self.addCleanup(cache.delete, f"tile-pyramid:{self.doc.sha256}:error")
+        c = self._user_client()
+        url = reverse("document-tile-info", args=[self.doc.sha256])
+        with patch("users.imaging.threading.Thread") as thread:
+            self.assertEqual(c.get(url).status_code, http_status.HTTP_202_ACCEPTED)
+        with self.assertLogs("users.imaging", "WARNING"):
+            thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+        with self.assertLogs("users", "WARNING"):
+            self.assertEqual(c.get(url).status_code, http_status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_pdf_documents_are_not_transcoded(self):
+        self.doc.content_type = "application/pdf"
+        self.doc.save(update_fields=["content_type"])
+        resp = self._user_client().get(reverse("document-tile-info", args=[self.doc.sha256]))
+        self.assertEqual(resp.status_code, http_status.HTTP_404_NOT_FOUND)
+
+
+# ===================================================================
+# V.  BUFFERED AUDIT TESTS
+# ===================================================================
+@override_settings(AUDIT_BUFFER_BACKEND="memory", AUDIT_FLUSH_INTERVAL=0, AUDIT_BUFFER_MAX_EVENTS=3)
+class AuditBufferTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        audit._buffer.clear()
+        self.addCleanup(audit._buffer.clear)
+
+    def test_events_are_written_on_flush(self):
+        log_audit(self.accepted_user, "document_view", "document", "DOC-1", {"download": False})
+        log_audit(None, "user_login", "user", "999")
+        self.assertFalse(AuditLog.objects.exists())
+        self.assertEqual(audit.audit_buffer_depth(), 2)
+
+        self.assertEqual(audit.flush_audit_buffer(), 2)
+        row = AuditLog.objects.get(target_id="DOC-1")
+        self.assertEqual(row.user, self.accepted_user)
+        self.assertEqual(row.metadata, {"download": False})
+        self.assertEqual(audit.audit_buffer_depth(), 0)
+
+    def test_size_threshold_triggers_flush(self):
+        log_audit_bulk(self.accepted_user, "document_view", "document", ["A", "B"])
+        self.assertEqual(AuditLog.objects.count(), 0)
+        log_audit(self.accepted_user, "document_view", "document", "C")
+        self.assertEqual(AuditLog.objects.count(), 3)
+
+    def test_failed_flush_keeps_events(self):
+        log_audit(self.accepted_user, "document_view", "document", "DOC-1")
+        with patch.object(AuditLog.objects, "bulk_create", side_effect=RuntimeError("db down")), \
+                self.assertLogs("users.audit", "ERROR"):
+            self.assertEqual(audit.flush_audit_buffer(), 0)
+        self.assertEqual(audit.audit_buffer_depth(), 1)
+        self.assertEqual(audit.flush_audit_buffer(), 1)
+
+    @override_settings(AUDIT_BUFFER_LIMIT=2)
+    def test_full_buffer_writes_through(self):
+        log_audit(self.accepted_user, "document_view", "document", "A")
+        log_audit(self.accepted_user, "document_view", "document", "B")
+        with self.assertLogs("users.audit", "WARNING"):
+            log_audit(self.accepted_user, "document_view", "document", "C")
+        self.assertEqual(list(AuditLog.objects.values_list("target_id", flat=True)), ["C"])
+        self.assertEqual(audit.audit_buffer_depth(), 2)
+
+        audit.flush_audit_buffer()
+        self.assertEqual(sorted(AuditLog.objects.values_list("target_id", flat=True)), ["A", "B", "C"])
+
+    def test_login_audit_is_buffered(self):
+        self._login("100", "accepted1234")
+        self.assertFalse(AuditLog.objects.filter(action="user_login").exists())
+        audit.flush_audit_buffer()
+        self.assertTrue(AuditLog.objects.filter(action="user_login", target_id="100").exists())
+
+
+# ===================================================================
+# W.  DUMP SNAPSHOT TESTS
+# ===================================================================
+class DumpSnapshotTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self._create_document("DOC-SNAP", categories=["CatA"])
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        self.root = Path(tmp)
+        overrides = override_settings(DUMP_SNAPSHOT_ENABLED=True, DUMP_SNAPSHOT_ROOT=tmp)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def _get(self, client=None, **headers):
+        return (client or self._user_client()).get(reverse("dump"), headers=headers)
+
+    def _build(self, client):
+        """The first request of a version gets the live dump and starts one background build, run here."""
+        with patch("users.snapshots.threading.Thread") as thread:
+            resp = self._get(client)
+            self.assertEqual(self._get(client).data["mode"], "full")
+        self.assertNotIn("X-Catalog-Version", resp)
+        thread.assert_called_once()
+        thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+        return resp
+
+    def test_snapshot_matches_full_dump(self):
+        c = self._user_client()
+        live = self._build(c)
+        resp = self._get(c, accept_encoding="gzip")
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertTrue(resp["ETag"].startswith('"'))
+        payload = json.loads(gzip.decompress(b"".join(resp.streaming_content)))
+
+        self.assertEqual(payload["mode"], "full")
+        self.assertEqual(payload["document_count"], 1)
+        self.assertEqual(payload["filters"], {"last_synced": None, "diff": True})
+        self.assertEqual(payload["documents"], c.get(reverse("document-list")).data)
+        self.assertEqual(payload["documents"], json.loads(json.dumps(live.data["documents"])))
+        self.assertEqual([category["name"] for category in payload["categories"]], ["CatA"])
+
+    def test_plain_client_and_conditional_request(self):
+        c = self._user_client()
+        self._build(c)
+        resp = self._get(c)
+        self.assertNotIn("Content-Encoding", resp)
+        body = b"".join(resp.streaming_content)
+        self.assertEqual(resp["ETag"], f'"{hashlib.sha256(body).hexdigest()}"')
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+
+        resp = self._get(c, if_none_match=resp["ETag"])
+        self.assertEqual(resp.status_code, http_status.HTTP_304_NOT_MODIFIED)
+
+    def test_gzip_follows_accept_encoding_q_values(self):
+        c = self._user_client()
+        self._build(c)
+        for accept_encoding, gzipped in (("gzip;q=0, identity", False), ("br, *;q=0.5", True), ("*;q=0", False)):
+            resp = self._get(c, accept_encoding=accept_encoding)
+            self.assertEqual(resp.get("Content-Encoding") == "gzip", gzipped, accept_encoding)
+
+    def test_snapshot_timestamp_is_taken_before_the_version_is_read(self):
+        read_at = []
+
+        def catalog_version():
+            version = get_catalog_version()
+            read_at.append(timezone.now())
+            return version
+
+        c = self._user_client()
+        with patch("users.snapshots.get_catalog_version", side_effect=catalog_version):
+            self._build(c)
+        payload = json.loads(b"".join(self._get(c).streaming_content))
+        self.assertLessEqual(datetime.fromisoformat(payload["timestamp"]), read_at[-1])
+
+    def test_snapshot_is_built_once_per_version(self):
+        c = self._user_client()
+        self._build(c)
+        first = self._get(c)
+        # Authentication plus the catalog version lookup; nothing touches the catalog tables.
+        with self.assertNumQueries(2):
+            second = self._get(c)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(len(list(self.root.glob("dump-v*.json.gz"))), 1)
+
+    def test_catalog_change_invalidates_snapshot(self):
+        c = self._user_client()
+        self._build(c)
+        before = self._get(c)
+        self._create_document("DOC-SNAP-2")
+        self.assertEqual(self._build(c).data["document_count"], 2)
+        after = self._get(c)
+        self.assertNotEqual(before["ETag"], after["ETag"])
+        self.assertGreater(int(after["X-Catalog-Version"]), int(before["X-Catalog-Version"]))
+        self.assertEqual(json.loads(b"".join(after.streaming_content))["document_count"], 2)
+        self.assertEqual(len(list(self.root.glob("dump-v*.json.gz"))), 1)
+
+    def test_build_for_a_superseded_version_is_skipped(self):
+        c = self._user_client()
+        with patch("users.snapshots.threading.Thread") as thread:
+            self._get(c)
+        self._create_document("DOC-SNAP-2")
+        thread.call_args.kwargs["target"](*thread.call_args.kwargs["args"])
+        self.assertFalse(list(self.root.glob("dump-v*")))
+
+    def test_purge_keeps_newer_versions(self):
+        for name in ("dump-v3-aa.json.gz", "dump-v3.meta.json", "dump-v5-bb.json.gz", "dump-v5.meta.json",
+                     "dump-v7-cc.json.gz", "dump-v7.meta.json"):
+            (self.root / name).write_bytes(b"")
+        self.assertEqual(purge_stale_snapshots(5), 2)
+        self.assertEqual(
+            sorted(path.name for path in self.root.iterdir()),
+            ["dump-v5-bb.json.gz", "dump-v5.meta.json", "dump-v7-cc.json.gz", "dump-v7.meta.json"],
+        )
+
+    def test_change_batch_bumps_version_once(self):
+        version = get_catalog_version()
+        with catalog_change_batch():
+            doc = self._create_document("DOC-BATCH", categories=["CatB"])
+            doc.delete()
+            self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(get_catalog_version(), version + 1)
+
+    def test_filtered_dump_is_not_snapshotted(self):
+        resp = self._user_client().get(reverse("dump"), {"last_synced": "2099-01-01T00:00:00Z"})
+        self.assertEqual(resp.data["mode"], "incremental")
+        resp = self._user_client().get(reverse("dump"), {"diff": "maybe"})
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(list(self.root.glob("dump-v*")))
+
+
+# ===================================================================
+# X.  CHANGE JOURNAL TESTS
+# ===================================================================
+class ChangeJournalTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.doc = self._create_document("DOC-KEEP", categories=["CatA"])
+        self.gone = self._create_document("DOC-GONE")
+        self.client_ = self._user_client()
+        self.cursor = self.client_.get(reverse("dump")).data["cursor"]
+
+    def _delta(self, cursor=None):
+        resp = self.client_.get(reverse("dump"), {"cursor": cursor or self.cursor})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK, resp.data)
+        return resp.data
+
+    def test_delta_returns_upserts_and_tombstones(self):
+        self.doc.name = "Renamed"
+        self.doc.save()
+        self.gone.delete()
+        Category.objects.create(name="CatNew")
+
+        delta = self._delta()
+        self.assertEqual(delta["mode"], "delta")
+        self.assertEqual([row["name"] for row in delta["documents"]], ["Renamed"])
+        self.assertEqual(delta["deleted"]["documents"], ["DOC-GONE"])
+        self.assertEqual([row["name"] for row in delta["categories"]], ["CatNew"])
+        self.assertFalse(delta["has_more"])
+
+        again = self._delta(delta["cursor"])
+        self.assertEqual(again["documents"], [])
+        self.assertEqual(again["cursor"], delta["cursor"])
+
+    def test_relation_changes_touch_documents(self):
+        subhead = Subhead.objects.create(name="Sub", category=Category.objects.get(name="CatA"))
+        self.doc.subhead = subhead
+        self.doc.save()
+        cursor = self._delta()["cursor"]
+
+        subhead_pk = subhead.pk
+        Category.objects.create(name="CatB").documents.add(self.gone)
+        subhead.delete()
+        delta = self._delta(cursor)
+        self.assertEqual(sorted(row["document_id"] for row in delta["documents"]), ["DOC-GONE", "DOC-KEEP"])
+        self.assertIsNone(next(row for row in delta["documents"] if row["document_id"] == "DOC-KEEP")["subhead"])
+        self.assertEqual(delta["deleted"]["subheads"], [subhead_pk])
+
+    def test_posts_are_journaled(self):
+        post = Post.objects.create(user=self.accepted_user, document=self.doc, content="Looks good")
+        delta = self._delta()
+        self.assertEqual([row["id"] for row in delta["posts"]], [post.pk])
+        self.assertEqual(delta["posts"][0]["document_id"], "DOC-KEEP")
+
+        post_pk = post.pk
+        post.delete()
+        self.assertEqual(self._delta(delta["cursor"])["deleted"]["posts"], [post_pk])
+
+    @override_settings(DUMP_DELTA_PAGE_SIZE=2)
+    def test_delta_pages_through_journal(self):
+        for idx in range(3):
+            self._create_document(f"DOC-PAGE-{idx}")
+        first = self._delta()
+        self.assertTrue(first["has_more"])
+        self.assertEqual(len(first["documents"]), 2)
+        second = self._delta(first["cursor"])
+        self.assertFalse(second["has_more"])
+        self.assertEqual([row["document_id"] for row in second["documents"]], ["DOC-PAGE-2"])
+
+    def test_batch_merges_entries_per_object(self):
+        before = CatalogChange.objects.count()
+        with catalog_change_batch():
+            doc = self._create_document("DOC-BATCH", categories=["CatZ"])
+            doc.name = "Batched"
+            doc.save()
+        entries = CatalogChange.objects.filter(id__gt=0)[before:]
+        document_entries = [entry for entry in entries if entry.model == "document"]
+        self.assertEqual([(entry.object_key, entry.action) for entry in document_entries], [("DOC-BATCH", "create")])
+
+    def test_invalid_and_expired_cursors(self):
+        resp = self.client_.get(reverse("dump"), {"cursor": "not a cursor"})
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+
+        self._create_document("DOC-NEWER")
+        CatalogChange.objects.filter(id__lte=CatalogChange.objects.order_by("-id")[1].id).delete()
+        resp = self.client_.get(reverse("dump"), {"cursor": encode_cursor(0)})
+        self.assertEqual(resp.status_code, http_status.HTTP_410_GONE)
+
+
+# ===================================================================
+# Y.  QUERY BUDGET TESTS
+# ===================================================================
+class QueryBudgetTests(APITestMixin, TestCase):
+    """Hot listing endpoints must stay within a fixed query count, however many rows they return."""
+
+    # URL name -> most queries one request may run, authentication included.
+    QUERY_BUDGETS = {
+        "dump": 6,
+        "document-list": 3,
+        "category-list": 2,
+        "subhead-list": 3,
+        "subhead-document-list": 4,
+        "post-list": 2,
+        "feedback-list": 3,
+        "document-logs": 2,
+        "user-logs": 2,
+    }
+
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.category = Category.objects.create(name="CatBudget")
+        self.subhead = Subhead.objects.create(name="SubBudget", category=self.category)
+        self.doc = self._add_rows(2)
+        self.user_client = self._user_client()
+        self.admin_client = self._admin_client()
+
+    def _add_rows(self, count):
+        start = Document.objects.count()
+        for idx in range(start, start + count):
+            doc = self._create_document(f"DOC-BUDGET-{idx}", categories=["CatBudget", f"Extra{idx}"])
+            doc.subhead = self.subhead
+            doc.save()
+            Subhead.objects.create(name=f"Sub{idx}", category=self.category)
+            Post.objects.create(user=self.accepted_user, document=doc, content="Note", post_type="feedback")
+            log_audit(self.accepted_user, "document_view", "document", doc.document_id)
+            log_audit(self.accepted_user, "user_login", "user", "100")
+        return Document.objects.order_by("pk").first()
+
+    def _request(self, name):
+        client = self.admin_client if name.endswith("-logs") else self.user_client
+        args, params = [], {}
+        if name == "subhead-list":
+            args = [self.category.pk]
+        elif name == "subhead-document-list":
+            args = [self.subhead.pk]
+        elif name == "feedback-list":
+            args = [self.doc.document_id]
+        elif name == "post-list":
+            params = {"document_id": self.doc.document_id}
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(reverse(name, args=args), params)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK, name)
+        return len(queries)
+
+    def test_endpoints_stay_within_budget(self):
+        baseline = {name: self._request(name) for name in self.QUERY_BUDGETS}
+        self._add_rows(10)
+        for name, budget in self.QUERY_BUDGETS.items():
+            with self.subTest(endpoint=name):
+                count = self._request(name)
+                self.assertLessEqual(count, budget)
+                self.assertEqual(count, baseline[name], "query count grows with the number of rows")
+
+
+# ===================================================================
+# Z.  KEYSET PAGINATION TESTS
+# ===================================================================
+class KeysetPaginationTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        for name in ("Delta", "Alpha", "Echo", "Charlie", "Bravo"):
+            self._create_document(f"DOC-{name.upper()}", name=name)
+
+    def _walk(self, client, url, params):
+        names, pages = [], 0
+        resp = client.get(url, params)
+        while True:
+            self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+            pages += 1
+            names.extend(resp.data["results"])
+            if not resp.data["next"]:
+                return names, pages
+            resp = client.get(resp.data["next"])
+
+    def test_documents_page_by_name(self):
+        rows, pages = self._walk(self._user_client(), reverse("document-list"), {"page_size": 2})
+        self.assertEqual([row["name"] for row in rows], ["Alpha", "Bravo", "Charlie", "Delta", "Echo"])
+        self.assertEqual(pages, 3)
+
+    def test_cursor_is_stable_across_inserts(self):
+        c = self._user_client()
+        first = c.get(reverse("document-list"), {"page_size": 2})
+        self._create_document("DOC-AARDVARK", name="Aardvark")
+        second = c.get(first.data["next"])
+        self.assertEqual([row["name"] for row in second.data["results"]], ["Charlie", "Delta"])
+
+    def test_audit_logs_page_newest_first(self):
+        for idx in range(5):
+            log_audit(self.accepted_user, "document_view", "document", f"DOC-{idx}")
+        rows, pages = self._walk(self._admin_client(), reverse("document-logs"), {"page_size": 2})
+        self.assertEqual([row["target_id"] for row in rows], [f"DOC-{idx}" for idx in range(4, -1, -1)])
+        self.assertEqual(pages, 3)
+
+    def test_registrations_and_posts_paginate(self):
+        rows, _ = self._walk(self._admin_client(), reverse("registration-list"), {"page_size": 1})
+        self.assertEqual([row["HRMS_ID"] for row in rows], sorted(User.objects.values_list("HRMS_ID", flat=True)))
+
+        doc = Document.objects.get(document_id="DOC-ALPHA")
+        for idx in range(3):
+            Post.objects.create(user=self.accepted_user, document=doc, content=f"Post {idx}")
+        rows, pages = self._walk(self._user_client(), reverse("post-list"), {"document_id": "DOC-ALPHA", "page_size": 2})
+        self.assertEqual([row["content"] for row in rows], ["Post 2", "Post 1", "Post 0"])
+        self.assertEqual(pages, 2)
+
+    def test_plain_list_unless_requested(self):
+        c = self._user_client()
+        self.assertEqual(len(c.get(reverse("document-list")).data), 5)
+        with override_settings(API_PAGINATE_BY_DEFAULT=True, API_PAGE_SIZE=3):
+            resp = c.get(reverse("document-list"))
+        self.assertEqual(len(resp.data["results"]), 3)
+
+    def test_invalid_cursor(self):
+        resp = self._user_client().get(reverse("document-list"), {"cursor": "bogus"})
+        self.assertEqual(resp.status_code, http_status.HTTP_404_NOT_FOUND)
+
+
+# ===================================================================
+# AA. FULL-TEXT SEARCH TESTS
+# ===================================================================
+class DocumentSearchTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.bogie = Subhead.objects.create(name="Bogie Assemblies", category=Category.objects.create(name="Wagons"))
+        self.axle = self._create_document("DOC-AXLE", name="Axle box housing", categories=["Wagons"])
+        self.axle.subhead = self.bogie
+        self.axle.save()
+        self.brake = self._create_document("DOC-BRAKE", name="Brake rigging")
+        self.brake.description = "Includes axle mounted disc"
+        self.brake.save()
+        self.client_ = self._user_client()
+
+    def _search(self, q, **params):
+        resp = self.client_.get(reverse("document-search"), {"q": q, **params})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        return [row["document_id"] for row in resp.data["results"]]
+
+    def test_prefix_match_and_ranking(self):
+        self.assertEqual(self._search("axl"), ["DOC-AXLE", "DOC-BRAKE"])
+        self.assertEqual(self._search("brake rig"), ["DOC-BRAKE"])
+        self.assertEqual(self._search("bogie wagon"), ["DOC-AXLE"])
+        self.assertEqual(self._search("axle", limit=1), ["DOC-AXLE"])
+        self.assertEqual(self.client_.get(reverse("document-search"), {"q": "axle", "limit": 1}).data["count"], 2)
+
+    def test_index_follows_catalog_changes(self):
+        self.brake.name = "Coupler yoke"
+        self.brake.save()
+        self.assertEqual(self._search("coupler"), ["DOC-BRAKE"])
+        self.assertEqual(self._search("rigging"), [])
+
+        self.bogie.name = "Truck Frames"
+        self.bogie.save()
+        self.assertEqual(self._search("truck"), ["DOC-AXLE"])
+
+        Category.objects.create(name="Locomotives").documents.add(self.brake)
+        self.assertEqual(self._search("locomotive"), ["DOC-BRAKE"])
+
+        self.axle.delete()
+        self.assertEqual(self._search("housing"), [])
+
+    def test_batched_changes_are_indexed_at_the_end(self):
+        with catalog_change_batch():
+            self._create_document("DOC-SPRING", name="Helical spring")
+            self.assertEqual(self._search("helical"), [])
+        self.assertEqual(self._search("helical"), ["DOC-SPRING"])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM users_document_fts")
+        self.assertEqual(self._search("axle"), [])
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(self._search("axle"), ["DOC-AXLE", "DOC-BRAKE"])
+
+    def test_bad_requests(self):
+        self.assertEqual(self._search('"*) OR ('), [])
+        self.assertEqual(self.client_.get(reverse("document-search")).status_code, http_status.HTTP_400_BAD_REQUEST)
+        resp = self.client_.get(reverse("document-search"), {"q": "axle", "limit": "0"})
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._anon_client().get(reverse("document-search"), {"q": "axle"}).status_code, 401)
+
+
+# ===================================================================
+# AB. IDENTIFIER SEARCH TESTS
+# ===================================================================
+class DocumentIdentifierSearchTests(APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        identifiers._index = None
+        self._create_document("DOC-101", name="SK-12345 Alt-2 Axle box")
+        self._create_document("DOC-102", name="SK-12345 Alt-3 Axle box")
+        self._create_document("DOC-103", name="WD 89030-S-01 Brake beam")
+        self._create_document("RDSO/SK/K-4521", name="Coupler yoke")
+        self.client_ = self._user_client()
+
+    def _lookup(self, q, **params):
+        resp = self.client_.get(reverse("document-identifier-search"), {"q": q, **params})
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        return resp.data
+
+    def _ids(self, q, **params):
+        return [row["document"]["document_id"] for row in self._lookup(q, **params)["results"]]
+
+    def test_parse_identifier(self):
+        self.assertEqual(identifiers.parse_identifier("sk 12345 alteration no. 3"), (["SK12345"], "3"))
+        self.assertEqual(identifiers.parse_identifier("WD-89030-S-01 alt.A"), (["WD89030S01"], "A"))
+        self.assertEqual(identifiers.parse_identifier("Sheet 2 of drawing"), ([], ""))
+        self.assertEqual(identifiers.parse_identifier("SK-12345 ALT3"), (["SK12345"], "3"))
+        self.assertEqual(identifiers.parse_identifier("ALTERNATOR MOUNTING SK-12345"), (["SK12345"], ""))
+        self.assertEqual(identifiers.parse_identifier("SK-12345 Altitude"), (["SK12345"], ""))
+        self.assertEqual(identifiers.parse_identifier("SK-12345 alt note"), (["SK12345"], ""))
+
+    def test_exact_and_fuzzy_matches(self):
+        data = self._lookup("sk12345")
+        self.assertEqual(data["identifiers"], ["SK12345"])
+        self.assertEqual({row["score"] for row in data["results"]}, {1.0})
+        self.assertEqual(self._ids("wd-89030-s-01"), ["DOC-103"])
+        self.assertEqual(self._ids("RDSO SK K 4521"), ["RDSO/SK/K-4521"])
+        self.assertEqual(self._ids("SK-12354")[:2], ["DOC-101", "DOC-102"])
+        self.assertEqual(self._ids("XY-777"), [])
+
+    def test_alteration_ranks_first(self):
+        self.assertEqual(self._ids("SK-12345 Alt-3"), ["DOC-102", "DOC-101"])
+        self.assertEqual(self._ids("SK 12345 alteration 2"), ["DOC-101", "DOC-102"])
+        self.assertEqual(self._ids("SK-12345 Alt-3", limit=1), ["DOC-102"])
+
+    def test_index_reloads_on_catalog_change(self):
+        self.assertEqual(self._ids("CG-55501"), [])
+        index = identifiers._index
+        self._lookup("SK-12345")
+        self.assertIs(identifiers._index, index)
+
+        self._create_document("DOC-104", name="CG-55501 Spring plank")
+        self.assertEqual(self._ids("CG-55501"), ["DOC-104"])
+        self.assertIsNot(identifiers._index, index)
+
+    def test_bad_requests(self):
+        url = reverse("document-identifier-search")
+        self.assertEqual(self.client_.get(url).status_code, http_status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client_.get(url, {"q": "SK-1", "limit": "x"}).status_code, 400)
+        self.assertEqual(self._anon_client().get(url, {"q": "SK-12345"}).status_code, 401)
+
+
+# ===================================================================
+# AC. DATABASE BENCHMARK TESTS
+# ===================================================================
+class DatabaseBenchmarkTests(APITestMixin, TransactionTestCase):
+    # The benchmark's worker threads open their own connections, so the data must be committed.
+    def setUp(self):
+        self._create_admin()
+        self._create_document("DOC-1")
+
+    def test_reports_latency_per_endpoint(self):
+        out = io.StringIO()
+        call_command(
+            "benchmark_database", "--requests", "4", "--concurrency", "2",
+            "--endpoints", "documents,dump", stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn("Database: sqlite", output)
+        self.assertRegex(output, r"documents\s+n=4\s+errors=0\s+p50=")
+        self.assertRegex(output, r"dump\s+n=4\s+errors=0\s+p50=")
+        self.assertFalse(User.objects.filter(HRMS_ID__startswith="bench-").exists())
+
+    def test_rejects_unknown_endpoint(self):
+        with self.assertRaises(CommandError):
+            call_command("benchmark_database", "--endpoints", "feed", stdout=io.StringIO())
+
+
+# ===================================================================
+# AD. SQLITE TUNING TESTS
+# ===================================================================
+class SQLiteTuningTests(TransactionTestCase):
+    # BEGIN IMMEDIATE only runs outside the transaction every TestCase wraps its tests in.
+    def _pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        self.assertEqual(self._pragma("synchronous"), 1)
+        self.assertEqual(self._pragma("busy_timeout"), settings.SQLITE_BUSY_TIMEOUT_MS)
+        self.assertEqual(self._pragma("cache_size"), settings.SQLITE_CACHE_SIZE)
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+
+    def test_transactions_record_lock_wait(self):
+        before = REGISTRY.get_sample_value("railway_sqlite_lock_wait_seconds_count") or 0
+        with transaction.atomic():
+            Category.objects.create(name="Wagons")
+        self.assertEqual(REGISTRY.get_sample_value("railway_sqlite_lock_wait_seconds_count"), before + 1)
+
+    def test_lock_stats_command(self):
+        with transaction.atomic():
+            Category.objects.create(name="Wagons")
+        out = io.StringIO()
+        call_command("sqlite_lock_stats", "--samples", "3", "--interval", "0", stdout=out)
+        output = out.getvalue()
+        self.assertRegex(output, r"synchronous\s+NORMAL")
+        self.assertRegex(output, r"transaction_mode\s+IMMEDIATE")
+        self.assertRegex(output, r"lock waits: count=[1-9]\d* mean=[\d.]+ms p50<=")
+        self.assertIn("lock errors:", output)
+        self.assertIn("write lock: samples=3 timeouts=0", output)
+
+
+# ===================================================================
+# AE. QUERY PLAN TESTS
+# ===================================================================
+class QueryPlanTests(APITestMixin, TestCase):
+    """EXPLAIN QUERY PLAN of each hot endpoint's main query must search an index, not scan and sort."""
+
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.doc = self._create_document("DOC-1", name="Axle box")
+        for post_type in ("comment", "feedback"):
+            Post.objects.create(user=self.accepted_user, document=self.doc, post_type=post_type, content="x")
+        log_audit(self.admin, "document_view", "document", "DOC-1")
+        log_audit(self.admin, "user_login", "user", ADMIN_HRMS_ID)
+        self.admin_client = self._admin_client()
+        self.user_client = self._user_client()
+
+    def _plan(self, client, url, table, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = client.get(url, params or {})
+            if resp.streaming:
+                b"".join(resp.streaming_content)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        sql = next(
+            query["sql"] for query in ctx.captured_queries
+            if query["sql"].startswith("SELECT") and f'FROM "{table}"' in query["sql"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, plan, index_name, ordered=True):
+        self.assertTrue(any(f"INDEX {index_name}" in step for step in plan), plan)
+        if ordered:
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan), plan)
+
+    def test_audit_logs(self):
+        for name, params in (("document-logs", {}), ("user-logs", {}), ("document-logs", {"page_size": 1})):
+            plan = self._plan(self.admin_client, reverse(name), "users_auditlog", params)
+            self.assertUsesIndex(plan, "auditlog_target_created_idx")
+
+    def test_posts_and_feedback(self):
+        plan = self._plan(self.user_client, reverse("post-list"), "users_post", {"document_id": "DOC-1"})
+        self.assertUsesIndex(plan, "post_document_created_idx")
+        plan = self._plan(self.user_client, reverse("feedback-list", args=["DOC-1"]), "users_post", {"page_size": 5})
+        self.assertUsesIndex(plan, "post_doc_type_created_idx")
+
+    def test_document_listing(self):
+        plan = self._plan(self.user_client, reverse("document-list"), "users_document", {"page_size": 5})
+        self.assertUsesIndex(plan, "document_name_id_idx")
+
+    def test_incremental_dump(self):
+        since = "2020-01-01T00:00:00Z"
+        for params in ({"last_synced": since}, {"last_synced": since, "stream": "true"}):
+            plan = self._plan(self.user_client, reverse("dump"), "users_document", params)
+            self.assertUsesIndex(plan, "document_last_updated_idx", ordered=False)
+
+    def test_active_crawler_run(self):
+        CrawlerRun.objects.create(status=CrawlerRun.STATUS_SUCCEEDED)
+        # Two IN values are merged with a small sort; the index still limits the rows read.
+        plan = self._plan(self.admin_client, reverse("crawler-status"), "users_crawlerrun")
+        self.assertUsesIndex(plan, "crawlerrun_status_created_idx", ordered=False)
+
+
+# ===================================================================
+# AF. CATALOG IMPORT TESTS
+# ===================================================================
+@override_settings(PREVIEW_GENERATE_ON_IMPORT=False, DUMP_SNAPSHOT_ENABLED=False)
+class CatalogImportTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self.root = self._use_temp_storage()
+
+    def _record(self, drawing_id, category="Wagons", subhead="Bogies", **extra):
+        url = f"https://rdso.example/files/{drawing_id}.pdf"
+        return {
+            "id": drawing_id, "category": category, "subhead": subhead,
+            "file_name": f"SK-{drawing_id}", "description": f"Drawing {drawing_id}",
+            "page_url": f"https://rdso.example/drawings/{drawing_id}",
+            "storage_path": f"{category}/{subhead}__s17/SK-{drawing_id}.pdf",
+            "files": [url], **extra,
+        }
+
+    def _import(self, records, *args, meta=None):
+        files = {
+            record["files"][0]: {
+                "stored_file": f"SK-{record['id']}.pdf", "size": 1000 + record["id"],
+                "sha256": f"{record['id']:064d}", "downloaded_at": "2024-05-01T10:00:00Z",
+                **(meta or {}).get(record["id"], {}),
+            }
+            for record in records
+        }
+        Path(self.root, "catalog_flat.json").write_text(json.dumps(records), encoding="utf-8")
+        Path(self.root, "__state__.json").write_text(json.dumps({"files_by_url": files}), encoding="utf-8")
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command("import_rdso_catalog", *args, stdout=out)
+        return out.getvalue(), len(ctx.captured_queries)
+
+    def test_first_import_creates_rows(self):
+        before = CatalogChange.objects.count()
+        output, _ = self._import([self._record(1), self._record(2), self._record(3, subhead="Couplers")])
+        self.assertIn("1 categories created, 2 subheads created, 3 documents created, 0 documents updated", output)
+        self.assertRegex(output, r"Import took [\d.]+s and \d+ queries \(categories ")
+
+        doc = Document.objects.get(drawing_id=1)
+        self.assertEqual((doc.document_id, doc.name, doc.file_size, doc.subhead.name), ("1", "SK-1", 1001, "Bogies"))
+        self.assertEqual(doc.subhead.crawler_id, "s17")
+        self.assertEqual(doc.crawled_at.year, 2024)
+        self.assertEqual(list(doc.category.values_list("name", flat=True)), ["Wagons"])
+        self.assertEqual(dict(Subhead.objects.values_list("name", "drawing_count")), {"Bogies": 2, "Couplers": 1})
+
+        journaled = CatalogChange.objects.order_by("id")[before:]
+        self.assertEqual(
+            sorted(entry.object_key for entry in journaled if entry.model == "document"), ["1", "2", "3"],
+        )
+        self._create_users()
+        resp = self._user_client().get(reverse("document-search"), {"q": "couplers"})
+        self.assertEqual([row["document_id"] for row in resp.data["results"]], ["3"])
+
+    def test_reimport_updates_only_changed_rows(self):
+        self._import([self._record(1), self._record(2), self._record(3)])
+        version = get_catalog_version()
+        output, _ = self._import([self._record(1), self._record(2), self._record(3)])
+        self.assertIn("0 documents created, 0 documents updated, 3 unchanged", output)
+        self.assertEqual(get_catalog_version(), version)
+
+        before = CatalogChange.objects.count()
+        moved = self._record(2, category="Coaches", subhead="Bogies", description="Revised")
+        output, _ = self._import([self._record(1), moved, self._record(3)])
+        self.assertIn("1 categories created, 1 subheads created, 0 documents created, 1 documents updated, 2 unchanged", output)
+        doc = Document.objects.get(drawing_id=2)
+        self.assertEqual(doc.description, "Revised")
+        self.assertEqual(list(doc.category.values_list("name", flat=True)), ["Coaches"])
+        self.assertEqual(
+            sorted(Subhead.objects.values_list("category__name", "drawing_count")), [("Coaches", 1), ("Wagons", 2)],
+        )
+        documents = CatalogChange.objects.order_by("id")[before:].values_list("model", "object_key")
+        self.assertEqual([key for model, key in documents if model == "document"], ["2"])
+        self.assertGreater(get_catalog_version(), version)
+
+    def test_query_count_does_not_grow_with_records(self):
+        counts = []
+        # The first import also creates the catalog version row, so it is not compared; 40 rows
+        # still fit in one bulk insert under SQLite's bound-parameter limit.
+        for size in (3, 3, 40):
+            Category.objects.all().delete()
+            Document.objects.all().delete()
+            _, queries = self._import([self._record(idx, subhead=f"Sub {idx % 3}") for idx in range(1, size + 1)])
+            counts.append(queries)
+        self.assertEqual(counts[1], counts[2])
+
+    def test_recrawl_touches_only_changed_drawings(self):
+        self._import([self._record(1), self._record(2), self._record(3)])
+        Document.objects.update(last_updated="2024-01-01T00:00:00Z")
+        checked = {idx: {"last_checked_at": "2024-06-01T00:00:00Z"} for idx in (1, 2, 3)}
+        checked[3]["etag"] = '"v2"'
+        output, _ = self._import([self._record(1), self._record(2), self._record(3)], meta=checked)
+        self.assertIn("0 documents created, 1 documents updated, 2 unchanged, 0 removed", output)
+        touched = Document.objects.filter(last_updated__year=2024).values_list("drawing_id", flat=True)
+        self.assertEqual(sorted(touched), [1, 2])
+        self.assertEqual(Document.objects.get(drawing_id=3).last_checked_at.month, 6)
+
+    def test_missing_drawings_are_archived_only_when_asked(self):
+        self._import([self._record(1), self._record(2), self._record(3)])
+        self._create_users()
+        Post.objects.create(user=self.accepted_user, document=Document.objects.get(drawing_id=2), content="Keep me")
+        output, _ = self._import([self._record(1), self._record(3)])
+        self.assertIn("2 unchanged, 0 removed", output)
+        self.assertFalse(Document.objects.filter(is_archived=True).exists())
+
+        output, _ = self._import([self._record(1), self._record(3)], "--remove-missing")
+        self.assertIn("2 unchanged, 1 removed", output)
+        self.assertEqual(list(Document.objects.filter(is_archived=True).values_list("drawing_id", flat=True)), [2])
+        self.assertTrue(Post.objects.filter(document__drawing_id=2).exists())
+        self.assertTrue(CatalogChange.objects.filter(model="document", object_key="2", action="update").exists())
+        output, _ = self._import([self._record(1), self._record(3)], "--remove-missing")
+        self.assertIn("0 removed", output)
+
+        output, _ = self._import([self._record(1), self._record(2), self._record(3)], "--remove-missing")
+        self.assertIn("1 documents updated, 2 unchanged, 0 removed", output)
+        self.assertFalse(Document.objects.filter(is_archived=True).exists())
+
+    def test_rows_without_fingerprint_are_backfilled_quietly(self):
+        self._import([self._record(1), self._record(2)])
+        Document.objects.update(catalog_fingerprint="", last_updated="2024-01-01T00:00:00Z")
+        output, _ = self._import([self._record(1), self._record(2, description="Revised")])
+        self.assertIn("1 documents updated, 1 unchanged", output)
+        self.assertEqual(Document.objects.get(drawing_id=1).last_updated.year, 2024)
+        self.assertNotIn("", Document.objects.values_list("catalog_fingerprint", flat=True))
+
+    def test_clear_removes_crawler_documents_first(self):
+        self._import([self._record(1), self._record(2)])
+        output, _ = self._import([self._record(2)], "--clear")
+        self.assertIn("Cleared 2 crawler-imported documents", output)
+        self.assertIn("1 documents created", output)
+        self.assertEqual(list(Document.objects.values_list("drawing_id", flat=True)), [2])
+        self.assertEqual(Subhead.objects.get().drawing_count, 1)
+
+
+# ===================================================================
+# AG. CATALOG IMPORT JOB TESTS
+# ===================================================================
+@override_settings(PREVIEW_GENERATE_ON_IMPORT=False, DUMP_SNAPSHOT_ENABLED=False, CATALOG_IMPORT_USE_QUEUE=False)
+class CatalogImportJobTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self._create_admin()
+        self._create_users()
+        self.root = self._use_temp_storage()
+        self.client_ = self._admin_client()
+
+    def _write_catalog(self, count):
+        records = [
+            {"id": idx, "category": "Wagons", "subhead": "Bogies", "file_name": f"SK-{idx}", "files": []}
+            for idx in range(1, count + 1)
+        ]
+        Path(self.root, "catalog_flat.json").write_text(json.dumps(records), encoding="utf-8")
+
+    def _status(self, **params):
+        resp = self.client_.get(reverse("import-catalog-status"), params)
+        self.assertEqual(resp.status_code, http_status.HTTP_200_OK)
+        return resp.data
+
+    @patch("users.catalog_jobs.execute_catalog_import")
+    def test_post_queues_run_and_rejects_a_second(self, mocked_execute):
+        resp = self.client_.post(reverse("import-catalog"))
+        self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+        run = CatalogImportRun.objects.get(pk=resp.data["run_id"])
+        self.assertEqual((run.status, run.execution_mode), (CatalogImportRun.STATUS_QUEUED, CatalogImportRun.EXECUTION_THREAD))
+        mocked_execute.assert_called_once_with(run.id)
+
+        resp = self.client_.post(reverse("import-catalog"))
+        self.assertEqual(resp.status_code, http_status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.data["run_id"], run.id)
+        self.assertEqual(self._status()["status"], "queued")
+        self.assertEqual(self._user_client().post(reverse("import-catalog")).status_code, http_status.HTTP_403_FORBIDDEN)
+
+    @patch("users.catalog_jobs.execute_catalog_import")
+    def test_abandoned_runs_are_failed_and_replaced(self, mocked_execute):
+        silent_since = timezone.now() - timedelta(seconds=settings.CATALOG_IMPORT_STALE_SECONDS + 1)
+        stale = CatalogImportRun.objects.create(
+            initiated_by=self.admin, status=CatalogImportRun.STATUS_RUNNING,
+            execution_mode=CatalogImportRun.EXECUTION_THREAD, started_at=silent_since, last_heartbeat=silent_since,
+        )
+        with self.assertLogs("users.import_rdso", "WARNING"):
+            resp = self.client_.post(reverse("import-catalog"))
+        self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, CatalogImportRun.STATUS_FAILED)
+        self.assertIn("Abandoned", stale.error_message)
+
+        # A queued run whose RQ job has disappeared is dead however recent it is.
+        lost = CatalogImportRun.objects.get(pk=resp.data["run_id"])
+        CatalogImportRun.objects.filter(pk=lost.pk).update(execution_mode=CatalogImportRun.EXECUTION_QUEUE, job_id="gone")
+        with patch("users.catalog_jobs.rq_job_status", return_value=None), self.assertLogs("users.import_rdso", "WARNING"):
+            resp = self.client_.post(reverse("import-catalog"))
+        self.assertEqual(resp.status_code, http_status.HTTP_202_ACCEPTED)
+        self.assertEqual(CatalogImportRun.objects.get(pk=lost.pk).status, CatalogImportRun.STATUS_FAILED)
+
+    def test_run_reports_phases_progress_and_log(self):
+        self._write_catalog(3)
+        before = REGISTRY.get_sample_value(
+            "railway_catalog_import_phase_duration_seconds_count", {"phase": "documents"},
+        ) or 0
+        run = CatalogImportRun.objects.create(initiated_by=self.admin, execution_mode=CatalogImportRun.EXECUTION_THREAD)
+        execute_catalog_import(run.id)
+
+        data = self._status(run_id=run.id)
+        self.assertEqual((data["status"], data["running"], data["phase"]), ("succeeded", False, "journal"))
+        self.assertEqual((data["records_processed"], data["records_total"]), (3, 3))
+        self.assertEqual(data["stats"]["doc_created"], 3)
+        self.assertEqual(
+            list(data["phase_durations"]),
+            ["read", "categories", "subheads", "documents", "links", "drawing_counts", "journal"],
+        )
+        self.assertIn("Phase: documents", data["lines"])
+        self.assertTrue(any(line.startswith("Import complete: 1 categories created") for line in data["lines"]))
+        self.assertEqual(self._status(run_id=run.id, since=data["offset"])["lines"], [])
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                "railway_catalog_import_phase_duration_seconds_count", {"phase": "documents"},
+            ),
+            before + 1,
+        )
+
+        run.refresh_from_db()
+        self.assertEqual(run.total_log_lines, data["offset"])
+        self.assertEqual(Document.objects.filter(drawing_id__isnull=False).count(), 3)
+
+    def test_missing_catalog_fails_run(self):
+        run = CatalogImportRun.objects.create(initiated_by=self.admin, execution_mode=CatalogImportRun.EXECUTION_THREAD)
+        with self.assertLogs("users.import_rdso", "ERROR"):
+            execute_catalog_import(run.id)
+        data = self._status()
+        self.assertEqual((data["run_id"], data["status"]), (run.id, "failed"))
+        self.assertIn("catalog_flat.json not found", data["error"])
+
+    def test_run_fails_while_a_crawl_holds_the_catalog_files(self):
+        self._write_catalog(1)
+        run = CatalogImportRun.objects.create(initiated_by=self.admin, execution_mode=CatalogImportRun.EXECUTION_THREAD)
+        with catalog_files_lock("crawler run 99"):
+            with self.assertLogs("users.import_rdso", "ERROR"):
+                execute_catalog_import(run.id)
+            # The refused import leaves the crawl's lock in place.
+            self.assertEqual(cache.get(CATALOG_FILES_LOCK_KEY), "crawler run 99")
+        data = self._status(run_id=run.id)
+        self.assertEqual(data["status"], "failed")
+        self.assertIn("in use by crawler run 99", data["error"])
+        self.assertFalse(Document.objects.exists())
+
+        run = CatalogImportRun.objects.create(initiated_by=self.admin, execution_mode=CatalogImportRun.EXECUTION_THREAD)
+        execute_catalog_import(run.id)
+        self.assertEqual(self._status(run_id=run.id)["status"], "succeeded")
+
+    def test_status_without_runs(self):
+        self.assertEqual(self._status()["status"], "idle")
+        resp = self.client_.get(reverse("import-catalog-status"), {"since": "x"})
+        self.assertEqual(resp.status_code, http_status.HTTP_400_BAD_REQUEST)
+
+
+# ===================================================================
+# AH. STREAMING JSON TESTS
+# ===================================================================
+@override_settings(PREVIEW_GENERATE_ON_IMPORT=False, DUMP_SNAPSHOT_ENABLED=False)
+class StreamingJSONTests(TempStorageMixin, APITestMixin, TestCase):
+    TRICKY = ["a\"b\\c]}{[", "ünï", -1.5e10, 123456789, True, None, {"nested": [1, {"k": "}"}]}]
+
+    def setUp(self):
+        self.root = self._use_temp_storage()
+
+    def _write(self, name, data, indent=2):
+        path = Path(self.root, name)
+        path.write_text(json.dumps(data, indent=indent, ensure_ascii=False), encoding="utf-8")
+        return path
+
+    def test_readers_match_json_load_across_chunk_boundaries(self):
+        array_path = self._write("array.json", self.TRICKY)
+        state = {
+            "drawings_by_page_url": {"page": {"files_by_url": {"u2": self.TRICKY}}},
+            "files_by_url": {"u1": {"size": 1}, "u2": self.TRICKY},
+            "summary": {"kind": "crawler_state"},
+        }
+        state_path = self._write("state.json", state)
+        for chunk_size in (1, 3, 16, jsonstream.CHUNK_SIZE):
+            self.assertEqual(list(jsonstream.iter_array(array_path, chunk_size)), self.TRICKY)
+            self.assertEqual(dict(jsonstream.iter_object(state_path, "files_by_url", chunk_size)), state["files_by_url"])
+            self.assertEqual(jsonstream.read_keys(state_path, ["summary"], chunk_size), {"summary": state["summary"]})
+        self.assertEqual(list(jsonstream.iter_object(state_path, "missing")), [])
+
+    def test_malformed_input_raises_value_error(self):
+        for text in ("[1, 2", "[1 2]", '{"a": [1, 2', '{"a" 1}', ""):
+            path = Path(self.root, "bad.json")
+            path.write_text(text, encoding="utf-8")
+            with self.assertRaises(ValueError):
+                list(jsonstream.iter_array(path, 2))
+            with self.assertRaises(ValueError):
+                jsonstream.read_keys(path, ["b"], 2)
+
+    def test_import_keeps_only_catalog_files(self):
+        self._write("catalog_flat.json", [{
+            "id": 7, "category": "Wagons", "subhead": "Bogies", "file_name": "SK-7",
+            "files": ["https://rdso.example/7.pdf"],
+        }])
+        self._write("__state__.json", {
+            "drawings_by_page_url": {"https://rdso.example/d/7": {"files_by_url": {"https://rdso.example/7.pdf": {}}}},
+            "files_by_url": {
+                "https://rdso.example/old.pdf": {"size": 1},
+                "https://rdso.example/7.pdf": {"size": 4096, "sha256": "ab" * 32, "archived_versions": [{"size": 1}]},
+            },
+        })
+        out = io.StringIO()
+        call_command("import_rdso_catalog", stdout=out)
+        self.assertIn("Loaded 1 drawings, 1 file entries from state", out.getvalue())
+        doc = Document.objects.get(drawing_id=7)
+        self.assertEqual((doc.file_size, doc.sha256), (4096, "ab" * 32))
+
+    def test_crawler_status_rereads_meta_only_when_it_changes(self):
+        self._create_admin()
+        client = self._admin_client()
+        self._write("__meta__.json", {
+            "generated_at_utc": "2024-01-01T00:00:00Z",
+            "totals": {"drawing_count": 5},
+            "changes_since_previous_crawl": {"removed_files": ["https://rdso.example/old.pdf"]},
+        })
+        with patch("users.crawler.read_keys", wraps=jsonstream.read_keys) as reader:
+            for _ in range(2):
+                resp = client.get(reverse("crawler-status"))
+            self.assertEqual((resp.data["total_drawings"], resp.data["last_run"]), (5, "2024-01-01T00:00:00Z"))
+            self.assertEqual(reader.call_count, 1)
+
+            self._write("__meta__.json", {"totals": {"drawing_count": 7}}, indent=None)
+            self.assertEqual(client.get(reverse("crawler-status")).data["total_drawings"], 7)
+            self.assertEqual(reader.call_count, 2)
+
+
+# ===================================================================
+# AI. CRAWLER RECORD HANDOFF TESTS
+# ===================================================================
+@override_settings(PREVIEW_GENERATE_ON_IMPORT=False, DUMP_SNAPSHOT_ENABLED=False)
+class CrawlerRecordImportTests(TempStorageMixin, APITestMixin, TestCase):
+    def setUp(self):
+        self.root = self._use_temp_storage()
+
+    def _record(self, drawing_id):
+        url = f"https://rdso.example/files/{drawing_id}.pdf"
+        return {
+            "id": drawing_id, "category": "Wagons", "subhead": "Bogies",
+            "file_name": f"SK-{drawing_id}", "description": f"Drawing {drawing_id}",
+            "page_url": f"https://rdso.example/drawings/{drawing_id}",
+            "storage_path": f"Wagons/Bogies__s17/SK-{drawing_id}", "files": [url],
+            "file_meta": {url: {
+                "stored_file": f"SK-{drawing_id}.pdf", "content_type": None, "size": 1000 + drawing_id,
+                "sha256": f"{drawing_id:064d}", "etag": "e1", "downloaded_at": "2024-05-01T10:00:00Z",
+                "last_checked_at": None,
+            }},
+        }
+
+    def _handoff(self, mode, drawing_ids, crawl_succeeded=True):
+        handoff = CrawlerRecordImport(mode)
+        for drawing_id in drawing_ids:
+            self.assertTrue(handoff.feed(RECORD_PREFIX + json.dumps(self._record(drawing_id))))
+        return handoff, handoff.finish(crawl_succeeded=crawl_succeeded)
+
+    @override_settings(CATALOG_IMPORT_BATCH_SIZE=2)
+    def test_stream_mode_upserts_batches_and_links_once_at_the_end(self):
+        self._handoff("complete", [1, 2, 99])
+        handoff = CrawlerRecordImport("stream")
+        self.assertFalse(handoff.feed("Processing drawing 1/3: SK-3"))
+        for drawing_id in (3, 1, 2):
+            handoff.feed(RECORD_PREFIX + json.dumps(self._record(drawing_id)))
+        # The first two records are written while the crawl is still running; links and counts wait for the end.
+        self.assertEqual(handoff.batches, 1)
+        self.assertFalse(Document.objects.get(drawing_id=3).category.exists())
+        self.assertNotIn("links", handoff.phase_durations)
+
+        lines = handoff.finish(crawl_succeeded=True)
+        self.assertIn(
+            "3 records in 2 batches, 1 documents created, 0 documents updated, 2 unchanged, 0 removed", lines[0],
+        )
+        self.assertEqual(list(Document.objects.get(drawing_id=3).category.values_list("name", flat=True)), ["Wagons"])
+        self.assertEqual(Subhead.objects.get(name="Bogies").drawing_count, 4)
+        self.assertFalse(Document.objects.filter(is_archived=True).exists())
+
+    @override_settings(CRAWLER_IMPORT_REMOVE_MISSING=True)
+    def test_missing_drawings_are_archived_when_enabled(self):
+        self._handoff("complete", [1, 2, 99])
+        self._create_users()
+        Post.objects.create(user=self.accepted_user, document=Document.objects.get(drawing_id=99), content="Keep me")
+        _, lines = self._handoff("stream", [1, 2])
+        self.assertIn("2 unchanged, 1 removed", lines[0])
+        self.assertTrue(Document.objects.get(drawing_id=99).is_archived)
+        self.assertTrue(Post.objects.filter(document__drawing_id=99).exists())
+
+    def test_complete_mode_waits_for_a_successful_crawl(self):
+        handoff, lines = self._handoff("complete", [1, 2], crawl_succeeded=False)
+        self.assertEqual(lines, ["Catalog import (complete): skipped, the crawl did not complete"])
+        self.assertFalse(Document.objects.exists())
+
+        # Records carry the same fields as the JSON files, so neither path rewrites the other's rows.
+        records = [self._record(1), self._record(2)]
+        file_meta = {url: meta for record in records for url, meta in record.pop("file_meta").items()}
+        Path(self.root, "catalog_flat.json").write_text(json.dumps(records), encoding="utf-8")
+        Path(self.root, "__state__.json").write_text(json.dumps({"files_by_url": file_meta}), encoding="utf-8")
+        call_command("import_rdso_catalog", stdout=io.StringIO())
+        version = get_catalog_version()
+        handoff, _ = self._handoff("complete", [1, 2])
+        self.assertEqual((handoff.stats["doc_unchanged"], handoff.stats["doc_updated"]), (2, 0))
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_crawler_run_imports_emitted_records(self):
+        self._create_admin()
+        record_line = RECORD_PREFIX + json.dumps(self._record(5))
+        Path(self.root, "rdso_site_crawler.py").write_text(
+            "import sys\n"
+            "assert '--emit-records' in sys.argv\n"
+            "print('Processing drawing 1/1: SK-5', flush=True)\n"
+            f"print({record_line!r}, flush=True)\n"
+            "print('=== Crawl Complete ===', flush=True)\n",
+            encoding="utf-8",
+        )
+        run = CrawlerRun.objects.create(
+            initiated_by=self.admin, status=CrawlerRun.STATUS_QUEUED, execution_mode=CrawlerRun.EXECUTION_THREAD,
+        )
+        # Run ids are reused across tests, and the log tail is cached per id.
+        self.addCleanup(cache.delete, f"crawler-run:{run.id}:logs")
+        with override_settings(CRAWLER_IMPORT_MODE="stream", PYTHON_EXECUTABLE=sys.executable):
+            execute_crawler_run(run.id)
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, CrawlerRun.STATUS_SUCCEEDED)
+        self.assertEqual(run.log_tail[:2], ["Processing drawing 1/1: SK-5", "=== Crawl Complete ==="])
+        self.assertIn("Catalog import (stream): 1 records in 1 batches, 1 documents created", run.log_tail[2])
+        self.assertEqual(run.total_log_lines, 3)
+        self.assertEqual(run.metadata["catalog_import"]["stats"]["doc_created"], 1)
+        self.assertEqual(Document.objects.get(drawing_id=5).file_size, 1005)
+
+    def test_crawler_without_emit_records_support_skips_the_import(self):
+        self._create_admin()
+        # An older deployed copy whose argparse would reject the unknown flag.
+        Path(self.root, "rdso_site_crawler.py").write_text(
+            "import sys\n"
+            "assert len(sys.argv) == 3, sys.argv\n"
+            "print('=== Crawl Complete ===', flush=True)\n",
+            encoding="utf-8",
+        )
+        run = CrawlerRun.objects.create(
+            initiated_by=self.admin, status=CrawlerRun.STATUS_QUEUED, execution_mode=CrawlerRun.EXECUTION_THREAD,
+        )
+        self.addCleanup(cache.delete, f"crawler-run:{run.id}:logs")
+        with override_settings(CRAWLER_IMPORT_MODE="stream", PYTHON_EXECUTABLE=sys.executable), \
+                self.assertLogs("users.crawler", "WARNING"):
+            execute_crawler_run(run.id)
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, CrawlerRun.STATUS_SUCCEEDED)
+        self.assertIn("does not support --emit-records", run.log_tail[0])
+        self.assertEqual(run.log_tail[1], "=== Crawl Complete ===")
+        self.assertNotIn("catalog_import", run.metadata)
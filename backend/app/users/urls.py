@@ -6,7 +6,10 @@ from .views import (
     FeedbackListView, BatchActionView, DumpView,
     DocumentLogView, UserLogView, HealthCheckView,
     CategoryListView, SubheadListView, SubheadDocumentListView,
-    RunCrawlerView, CrawlerStatusView, CrawlerLogsView, ImportCatalogView,
+    RunCrawlerView, CrawlerStatusView, CrawlerLogsView, ImportCatalogView, CatalogImportStatusView,
+    DocumentArchiveView, DocumentPreviewView, DocumentSearchView, DocumentIdentifierSearchView,
+    DocumentImageView, DocumentTileInfoView, DocumentTileView,
+    WatermarkJobView, WatermarkJobStatusView, WatermarkJobFileView, WatermarkJobArchiveView,
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -20,6 +23,25 @@ urlpatterns = [
     path('create_document/', CreateDocument.as_view(), name='create-document'),
     path('create_post/', CreatePost.as_view(), name='create-post'),
     path('documents/', views.DocumentListView.as_view(), name='document-list'),
+    path('documents/archive/', DocumentArchiveView.as_view(), name='document-archive'),
+    path('documents/search/', DocumentSearchView.as_view(), name='document-search'),
+    path('documents/identifiers/', DocumentIdentifierSearchView.as_view(), name='document-identifier-search'),
+    path('documents/previews/<str:sha256>/', DocumentPreviewView.as_view(), name='document-preview'),
+    path('documents/images/<str:sha256>/', DocumentImageView.as_view(), name='document-image'),
+    path('documents/images/<str:sha256>/tiles/', DocumentTileInfoView.as_view(), name='document-tile-info'),
+    path(
+        'documents/images/<str:sha256>/tiles/<int:level>/<int:col>_<int:row>.jpg',
+        DocumentTileView.as_view(),
+        name='document-tile',
+    ),
+    path('documents/watermark-jobs/', WatermarkJobView.as_view(), name='watermark-job-create'),
+    path('documents/watermark-jobs/<int:pk>/', WatermarkJobStatusView.as_view(), name='watermark-job-status'),
+    path('documents/watermark-jobs/<int:pk>/archive/', WatermarkJobArchiveView.as_view(), name='watermark-job-archive'),
+    path(
+        'documents/watermark-jobs/<int:pk>/files/<str:document_id>/',
+        WatermarkJobFileView.as_view(),
+        name='watermark-job-file',
+    ),
     path('posts/', views.PostListView.as_view(), name='post-list'),
     path('dump/', DumpView.as_view(), name='dump'),
     path('actions/batch/', BatchActionView.as_view(), name='actions-batch'),
@@ -36,4 +58,5 @@ urlpatterns = [
     path('admin/crawler-status/', CrawlerStatusView.as_view(), name='crawler-status'),
     path('admin/crawler-logs/', CrawlerLogsView.as_view(), name='crawler-logs'),
     path('admin/import-catalog/', ImportCatalogView.as_view(), name='import-catalog'),
+    path('admin/import-catalog/status/', CatalogImportStatusView.as_view(), name='import-catalog-status'),
 ]
\ No newline at end of file
@@ -1,62 +1,41 @@
-import io
 import os
 import logging
+import re
 import time
+import tracemalloc
 
 from django.conf import settings
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from urllib.parse import quote
 from rest_framework.response import Response
 from rest_framework import status
 
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas as rl_canvas
-from pypdf import PdfReader, PdfWriter
-
-from .metrics import record_file_serve
-from .models import AuditLog
+from .audit import audit_event, record_audit_events
+from .metrics import record_file_serve, record_file_serve_peak_memory
+from .watermark import iter_file_chunks, watermark_stream
 
 logger = logging.getLogger("users")
 
+_BYTE_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
 
 def log_audit(user, action, target_type, target_id='', metadata=None):
-    AuditLog.objects.create(
-        user=user, action=action,
-        target_type=target_type, target_id=str(target_id),
-        metadata=metadata or {},
-    )
+    record_audit_events([audit_event(user, action, target_type, target_id, metadata)])
 
 
-def watermark_pdf(pdf_path, watermark_text):
-    """Return BytesIO of the PDF at pdf_path with a diagonal watermark on every page."""
-    buf = io.BytesIO()
-    c = rl_canvas.Canvas(buf, pagesize=letter)
-    c.setFont("Helvetica", 36)
-    c.setFillAlpha(0.15)
-    c.translate(letter[0] / 2, letter[1] / 2)
-    c.rotate(45)
-    c.drawCentredString(0, 0, watermark_text)
-    c.save()
-    buf.seek(0)
-    watermark_page = PdfReader(buf).pages[0]
-
-    reader = PdfReader(str(pdf_path))
-    writer = PdfWriter()
-    for page in reader.pages:
-        page.merge_page(watermark_page)
-        writer.add_page(page)
-
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return out
-
-
-def serve_file(document, hrms_id, as_download=False):
-    """Stream the file for a Document. Supports RDSO storage or legacy media path."""
-    started_at = time.perf_counter()
-    mode = 'download' if as_download else 'inline'
+def log_audit_bulk(user, action, target_type, target_ids, metadata=None):
+    """Record one audit row per target as a single batch."""
+    record_audit_events([
+        audit_event(user, action, target_type, target_id, metadata)
+        for target_id in target_ids
+    ])
+
 
+def resolve_document_path(document):
+    """Return (file_path, allowed_root) for a Document in RDSO storage or the legacy media path."""
     if document.storage_path and document.file_name_on_disk:
         file_path = os.path.join(
             str(settings.RDSO_STORAGE_ROOT),
@@ -67,6 +46,172 @@ def serve_file(document, hrms_id, as_download=False):
     else:
         file_path = os.path.join(settings.MEDIA_ROOT, 'documents', f'{document.document_id}.pdf')
         allowed_root = os.path.realpath(str(settings.MEDIA_ROOT))
+    return file_path, allowed_root
+
+
+def checked_document_path(document):
+    """Return the document's file path if it exists inside its allowed root, else None."""
+    file_path, allowed_root = resolve_document_path(document)
+    if not os.path.realpath(file_path).startswith(allowed_root) or not os.path.isfile(file_path):
+        return None
+    return file_path
+
+
+def document_etag(document, file_size, mtime):
+    """Strong validator for a stored file: its sha256 when known, otherwise size and mtime."""
+    if document.sha256:
+        return f'"{document.sha256}-{file_size}"'
+    return f'"{file_size:x}-{int(mtime * 1000):x}"'
+
+
+def parse_byte_range(header, size):
+    """Return (start, end) for a single-range Range header, None to ignore it, or raise ValueError if unsatisfiable."""
+    match = _BYTE_RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError('empty suffix range')
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('range not satisfiable')
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def accel_redirect_uri(resolved_path):
+    """Map a resolved file path to the internal nginx location that serves it, if any."""
+    locations = (
+        (settings.RDSO_STORAGE_ROOT, settings.FILE_SERVE_ACCEL_STORAGE_PREFIX),
+        (settings.MEDIA_ROOT, settings.FILE_SERVE_ACCEL_MEDIA_PREFIX),
+    )
+    for root, prefix in locations:
+        root = os.path.realpath(str(root))
+        if resolved_path.startswith(root + os.sep):
+            relative = os.path.relpath(resolved_path, root).replace(os.sep, '/')
+            return prefix.rstrip('/') + '/' + quote(relative)
+    return None
+
+
+def _accel_redirect_response(resolved_path, content_type):
+    """Hand the transfer to nginx via X-Accel-Redirect, or return None when offload is off or unmapped."""
+    if not settings.FILE_SERVE_ACCEL_REDIRECT:
+        return None
+    uri = accel_redirect_uri(resolved_path)
+    if uri is None:
+        logger.warning("serve_file: no X-Accel-Redirect location for %s, streaming in Python", resolved_path)
+        return None
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = uri
+    return response
+
+
+def _serve_inline(request, file_path, file_size, content_type, etag, last_modified):
+    """Answer an inline view with 304/206/416 where the request's validators and Range allow it.
+
+    With X-Accel-Redirect enabled nginx sends the body and handles Range itself.
+    """
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+    }
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        for header, value in validators.items():
+            response[header] = value
+        return 'not_modified', response
+
+    response = _accel_redirect_response(os.path.realpath(file_path), content_type)
+    if response is not None:
+        for header, value in validators.items():
+            response[header] = value
+        return 'offloaded', response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_byte_range(range_header, file_size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{file_size}'
+            return 'range_not_satisfiable', response
+
+    if byte_range is None:
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type)
+        outcome = 'served'
+    else:
+        start, end = byte_range
+        handle = open(file_path, 'rb')
+        handle.seek(start)
+        response = StreamingHttpResponse(
+            iter_file_chunks(handle, length=end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+        outcome = 'partial'
+
+    for header, value in validators.items():
+        response[header] = value
+    return outcome, response
+
+
+class _MemoryTracedChunks:
+    """Streaming body that keeps tracemalloc running until it has been sent or closed.
+
+    The peak is recorded once, from close(), which Django calls when the response finishes
+    even if the client disconnected before the body was consumed.
+    """
+
+    def __init__(self, chunks, mode):
+        self._chunks = chunks
+        self._mode = mode
+        self._closed = False
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            record_file_serve_peak_memory(self._mode, peak_memory)
+
+
+def serve_file(document, hrms_id, as_download=False, request=None):
+    """Stream the file for a Document. Supports RDSO storage or legacy media path.
+
+    Inline views honour If-None-Match/If-Modified-Since, Range and If-Range when the
+    request is passed in.
+    """
+    started_at = time.perf_counter()
+    mode = 'download' if as_download else 'inline'
+    file_path, allowed_root = resolve_document_path(document)
 
     logger.info("serve_file: doc=%s, download=%s, path=%s", document.document_id, as_download, file_path)
 
@@ -82,20 +227,38 @@ def serve_file(document, hrms_id, as_download=False):
         record_file_serve('not_found', mode, document.content_type, time.perf_counter() - started_at)
         return Response({"detail": "File not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    file_size = os.path.getsize(file_path)
+    file_stat = os.stat(file_path)
+    file_size = file_stat.st_size
     ct = document.content_type or 'application/pdf'
     is_pdf = ct == 'application/pdf'
     safe_name = document.file_name_on_disk or f'{document.document_id}.pdf'
     logger.info("serve_file: file exists, size=%d, content_type=%s", file_size, ct)
 
+    if not as_download and request is not None:
+        etag = document_etag(document, file_size, file_stat.st_mtime)
+        outcome, response = _serve_inline(request, file_path, file_size, ct, etag, file_stat.st_mtime)
+        record_file_serve(outcome, mode, ct, time.perf_counter() - started_at)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_206_PARTIAL_CONTENT):
+            response['Content-Disposition'] = f'inline; filename="{safe_name}"'
+        return response
+
+    # tracemalloc is process-wide, so only measure when nothing else is tracing. Streamed
+    # bodies keep tracing until they have been sent, see _MemoryTracedChunks.
+    track_memory = settings.FILE_SERVE_TRACK_MEMORY and not tracemalloc.is_tracing()
+    if track_memory:
+        tracemalloc.start()
+    peak_memory = None
+    streamed = False
+
     try:
         if as_download and is_pdf:
             now_str = timezone.now().strftime('%d-%m-%Y %H:%M:%S')
             watermark_text = f"Downloaded by {hrms_id} at {now_str}"
-            file_to_serve = watermark_pdf(file_path, watermark_text)
+            file_to_serve = watermark_stream(file_path, watermark_text, sha256=document.sha256)
             disposition = 'attachment'
+            streamed = True
         elif as_download:
-            file_to_serve = open(file_path, 'rb')
+            file_to_serve = _accel_redirect_response(resolved, ct) or open(file_path, 'rb')
             disposition = 'attachment'
         else:
             file_to_serve = open(file_path, 'rb')
@@ -104,8 +267,25 @@ def serve_file(document, hrms_id, as_download=False):
         logger.error("serve_file: processing error for %s: %s", document.document_id, e)
         record_file_serve('processing_error', mode, ct, time.perf_counter() - started_at)
         return Response({"detail": f"File processing error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    finally:
+        if track_memory and not streamed:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
 
-    record_file_serve('served', mode, ct, time.perf_counter() - started_at)
-    response = FileResponse(file_to_serve, content_type=ct)
+    offloaded = isinstance(file_to_serve, HttpResponse)
+    record_file_serve(
+        'offloaded' if offloaded else 'served', mode, ct,
+        time.perf_counter() - started_at, peak_memory_bytes=peak_memory,
+    )
+    if offloaded:
+        response = file_to_serve
+    elif streamed:
+        chunks, output_size = file_to_serve
+        if track_memory:
+            chunks = _MemoryTracedChunks(chunks, mode)
+        response = StreamingHttpResponse(chunks, content_type=ct)
+        response['Content-Length'] = str(output_size)
+    else:
+        response = FileResponse(file_to_serve, content_type=ct)
     response['Content-Disposition'] = f'{disposition}; filename="{safe_name}"'
     return response
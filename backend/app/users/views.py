@@ -1,12 +1,20 @@
 from .api_views import (
     BatchActionView,
+    CatalogImportStatusView,
     CategoryListView,
     CreateDocument,
     CreatePost,
     CrawlerLogsView,
     CrawlerStatusView,
+    DocumentArchiveView,
+    DocumentIdentifierSearchView,
+    DocumentImageView,
     DocumentListView,
     DocumentLogView,
+    DocumentPreviewView,
+    DocumentSearchView,
+    DocumentTileInfoView,
+    DocumentTileView,
     DumpView,
     FeedbackListView,
     HealthCheckView,
@@ -21,17 +29,29 @@ from .api_views import (
     SubheadListView,
     UpdateUserStatusView,
     UserLogView,
+    WatermarkJobArchiveView,
+    WatermarkJobFileView,
+    WatermarkJobStatusView,
+    WatermarkJobView,
 )
 
 __all__ = [
     'BatchActionView',
+    'CatalogImportStatusView',
     'CategoryListView',
     'CreateDocument',
     'CreatePost',
     'CrawlerLogsView',
     'CrawlerStatusView',
+    'DocumentArchiveView',
+    'DocumentIdentifierSearchView',
+    'DocumentImageView',
     'DocumentListView',
     'DocumentLogView',
+    'DocumentPreviewView',
+    'DocumentSearchView',
+    'DocumentTileInfoView',
+    'DocumentTileView',
     'DumpView',
     'FeedbackListView',
     'HealthCheckView',
@@ -46,4 +66,8 @@ __all__ = [
     'SubheadListView',
     'UpdateUserStatusView',
     'UserLogView',
+    'WatermarkJobArchiveView',
+    'WatermarkJobFileView',
+    'WatermarkJobStatusView',
+    'WatermarkJobView',
 ]
\ No newline at end of file
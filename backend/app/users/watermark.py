@@ -0,0 +1,525 @@
+import functools
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    StreamObject,
+)
+from reportlab.lib.rl_accel import escapePDF, fp_str
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas as rl_canvas
+
+from .metrics import record_watermark_cache_lookup, set_watermark_cache_size
+
+logger = logging.getLogger('users.watermark')
+
+WATERMARK_FONT = 'Helvetica'
+WATERMARK_FONT_SIZE = 36
+WATERMARK_ALPHA = 0.15
+WATERMARK_XOBJECT_PREFIX = '/BRWm'
+WATERMARK_MODE_REWRITE = 'rewrite'
+WATERMARK_MODE_INCREMENTAL = 'incremental'
+PREPARED_MANIFEST_VERSION = 1
+
+_STARTXREF_RE = re.compile(rb'startxref\s+(\d+)\s+%%EOF\s*$')
+
+
+@dataclass
+class PreparedPdf:
+    pdf_path: Path
+    manifest: dict
+
+
+@functools.lru_cache(maxsize=128)
+def _overlay_template(width, height):
+    """Render the text-independent part of the overlay for a (width, height) page.
+
+    The template selects the font and transparency and rotates about the page centre;
+    _overlay_page appends the per-request text, so the cache is keyed by page size only.
+    """
+    buf = io.BytesIO()
+    c = rl_canvas.Canvas(buf, pagesize=(width, height), pageCompression=0)
+    c.setFont(WATERMARK_FONT, WATERMARK_FONT_SIZE)
+    c.setFillAlpha(WATERMARK_ALPHA)
+    c.translate(width / 2, height / 2)
+    c.rotate(45)
+    c.save()
+    return buf.getvalue()
+
+
+def _overlay_page(watermark_text, width, height):
+    """Return a single-page overlay sized to (width, height) with the diagonal watermark."""
+    page = PdfReader(io.BytesIO(_overlay_template(width, height))).pages[0]
+    offset = -stringWidth(watermark_text, WATERMARK_FONT, WATERMARK_FONT_SIZE) / 2
+    contents = page.get_contents()
+    contents.set_data(
+        contents.get_data()
+        + f'BT 1 0 0 1 {fp_str(offset)} 0 Tm ({escapePDF(watermark_text)}) Tj ET\n'.encode('latin-1')
+    )
+    page.replace_contents(contents)
+    return page
+
+
+def _page_size_key(page):
+    box = page.mediabox
+    return round(float(box.width), 2), round(float(box.height), 2)
+
+
+def _box_key(box):
+    return [round(float(box.left), 2), round(float(box.bottom), 2), round(float(box.right), 2), round(float(box.top), 2)]
+
+
+def _ref(obj):
+    return [obj.idnum, obj.generation]
+
+
+# ---------------------------------------------------------------------------
+# Prepared (watermark-ready) source cache, keyed by Document.sha256
+# ---------------------------------------------------------------------------
+def _cache_root():
+    return Path(settings.WATERMARK_CACHE_ROOT or Path(settings.RDSO_STORAGE_ROOT) / '_watermark_cache')
+
+
+def _cache_entry_paths(sha256):
+    directory = _cache_root() / sha256[:2]
+    return directory / f'{sha256}.pdf', directory / f'{sha256}.json'
+
+
+def _source_signature(pdf_path):
+    stat = os.stat(pdf_path)
+    return {'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns}
+
+
+def _normalize_pdf(pdf_path, target_path):
+    """Write a copy of pdf_path whose pages can be stamped without touching their content.
+
+    Every page gets a single decompressed content stream wrapped in q/Q, referenced
+    from an indirect /Contents array, plus indirect /Resources and /XObject
+    dictionaries, so a watermark only has to append to those two objects.
+    """
+    reader = PdfReader(str(pdf_path))
+    if reader.is_encrypted:
+        raise ValueError('encrypted PDFs cannot be prepared for watermarking')
+
+    writer = PdfWriter(clone_from=reader)
+    for page in writer.pages:
+        contents = page.get_contents()
+        stream = DecodedStreamObject()
+        stream.set_data(b'q\n' + (contents.get_data() if contents is not None else b'') + b'\nQ\n')
+        page[NameObject('/Contents')] = writer._add_object(ArrayObject([writer._add_object(stream)]))
+
+        resources = page.raw_get('/Resources') if '/Resources' in page else DictionaryObject()
+        if not isinstance(resources, IndirectObject):
+            resources = writer._add_object(resources)
+            page[NameObject('/Resources')] = resources
+        resources = resources.get_object()
+        xobjects = resources.raw_get('/XObject') if '/XObject' in resources else DictionaryObject()
+        if not isinstance(xobjects, IndirectObject):
+            resources[NameObject('/XObject')] = writer._add_object(xobjects)
+
+    writer.compress_identical_objects(remove_identicals=False, remove_orphans=True)
+    with open(target_path, 'wb') as handle:
+        writer.write(handle)
+
+
+def _describe_prepared_pdf(prepared_path):
+    """Build the manifest needed to stamp (or append an incremental update to) a prepared PDF."""
+    with open(prepared_path, 'rb') as handle:
+        handle.seek(-1024, os.SEEK_END)
+        tail = handle.read()
+    match = _STARTXREF_RE.search(tail)
+    if match is None:
+        raise ValueError('prepared PDF has no trailing startxref')
+
+    reader = PdfReader(str(prepared_path))
+    pages = []
+    contents = {}
+    xobjects = {}
+    for page in reader.pages:
+        contents_ref = page.raw_get('/Contents')
+        xobjects_ref = page['/Resources'].raw_get('/XObject')
+        contents[str(contents_ref.idnum)] = [_ref(item) for item in contents_ref.get_object()]
+        xobjects[str(xobjects_ref.idnum)] = {
+            str(name): _ref(value) for name, value in xobjects_ref.get_object().items()
+        }
+        pages.append({
+            'object': _ref(page.indirect_reference),
+            'box': _box_key(page.mediabox),
+            'contents': contents_ref.idnum,
+            'xobjects': xobjects_ref.idnum,
+        })
+
+    trailer = reader.trailer
+    file_id = trailer.get('/ID')
+    return {
+        'version': PREPARED_MANIFEST_VERSION,
+        'size': os.path.getsize(prepared_path),
+        'startxref': int(match.group(1)),
+        'page_count': len(pages),
+        'pages': pages,
+        'contents': contents,
+        'xobjects': xobjects,
+        'trailer': {
+            'size': int(trailer['/Size']),
+            'root': _ref(trailer.raw_get('/Root')),
+            'info': _ref(trailer.raw_get('/Info')) if '/Info' in trailer else None,
+            'id': [item.original_bytes.hex() for item in file_id] if file_id else None,
+        },
+    }
+
+
+def _load_prepared_pdf(pdf_entry, manifest_entry, signature):
+    try:
+        with open(manifest_entry, 'r', encoding='utf-8') as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != PREPARED_MANIFEST_VERSION or not pdf_entry.is_file():
+        return None
+    if any(manifest.get(key) != value for key, value in signature.items()):
+        return None
+    return PreparedPdf(pdf_entry, manifest)
+
+
+def get_prepared_pdf(pdf_path, sha256):
+    """Return the watermark-ready copy of pdf_path for sha256, building it on a cache miss."""
+    pdf_entry, manifest_entry = _cache_entry_paths(sha256)
+    signature = _source_signature(pdf_path)
+
+    prepared = _load_prepared_pdf(pdf_entry, manifest_entry, signature)
+    if prepared is not None:
+        # mtime doubles as the LRU clock for eviction.
+        now = time.time()
+        os.utime(pdf_entry, (now, now))
+        record_watermark_cache_lookup('hit')
+        return prepared
+
+    record_watermark_cache_lookup('miss')
+    started_at = time.perf_counter()
+    pdf_entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp_suffix = f'.{os.getpid()}.tmp'
+    tmp_pdf = pdf_entry.with_name(pdf_entry.name + tmp_suffix)
+    tmp_manifest = manifest_entry.with_name(manifest_entry.name + tmp_suffix)
+    try:
+        _normalize_pdf(pdf_path, tmp_pdf)
+        manifest = {'sha256': sha256, **signature, **_describe_prepared_pdf(tmp_pdf)}
+        with open(tmp_manifest, 'w', encoding='utf-8') as handle:
+            json.dump(manifest, handle)
+        os.replace(tmp_pdf, pdf_entry)
+        os.replace(tmp_manifest, manifest_entry)
+    finally:
+        tmp_pdf.unlink(missing_ok=True)
+        tmp_manifest.unlink(missing_ok=True)
+
+    logger.info(
+        'Prepared watermark source %s (%d pages) in %.3fs',
+        sha256, manifest['page_count'], time.perf_counter() - started_at,
+    )
+    evict_watermark_cache()
+    return PreparedPdf(pdf_entry, manifest)
+
+
+def evict_watermark_cache(max_bytes=None):
+    """Delete least recently used prepared PDFs until the cache fits in max_bytes."""
+    max_bytes = settings.WATERMARK_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for manifest_entry in _cache_root().glob('*/*.json'):
+        pdf_entry = manifest_entry.with_suffix('.pdf')
+        try:
+            pdf_stat = pdf_entry.stat()
+            size = pdf_stat.st_size + manifest_entry.stat().st_size
+        except OSError:
+            continue
+        entries.append((pdf_stat.st_mtime, size, pdf_entry, manifest_entry))
+        total += size
+
+    removed = 0
+    for _, size, pdf_entry, manifest_entry in sorted(entries, key=lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        pdf_entry.unlink(missing_ok=True)
+        manifest_entry.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+
+    if removed:
+        logger.info('Evicted %d prepared watermark sources', removed)
+    set_watermark_cache_size(total)
+    return removed
+
+
+# ---------------------------------------------------------------------------
+# Watermark engines
+# ---------------------------------------------------------------------------
+def _merge_overlays(pdf_path, watermark_text):
+    reader = PdfReader(str(pdf_path))
+    writer = PdfWriter()
+    overlays = {}
+    for page in reader.pages:
+        key = _page_size_key(page)
+        overlay = overlays.get(key)
+        if overlay is None:
+            overlay = _overlay_page(watermark_text, *key)
+            overlays[key] = overlay
+
+        left, bottom = float(page.mediabox.left), float(page.mediabox.bottom)
+        if left or bottom:
+            page.merge_transformed_page(overlay, Transformation().translate(left, bottom))
+        else:
+            page.merge_page(overlay)
+        writer.add_page(page)
+    return writer
+
+
+def _overlay_stamp_objects(watermark_text, box, name, copy_resources):
+    """Return the overlay for box as a Form XObject plus the content stream that paints it as name.
+
+    copy_resources moves the overlay's /Resources into the destination document.
+    """
+    left, bottom, right, top = box
+    width, height = round(right - left, 2), round(top - bottom, 2)
+    overlay = _overlay_page(watermark_text, width, height)
+
+    form = DecodedStreamObject()
+    form.set_data(overlay.get_contents().get_data())
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)]),
+        NameObject('/Resources'): copy_resources(overlay['/Resources']),
+    })
+    paint = DecodedStreamObject()
+    paint.set_data(f'q 1 0 0 1 {left} {bottom} cm {name} Do Q'.encode('ascii'))
+    return form, paint
+
+
+def _add_overlay_stamp(writer, watermark_text, box, index):
+    """Add a Form XObject for the overlay plus the content stream that paints it at box."""
+    name = f'{WATERMARK_XOBJECT_PREFIX}{index}'
+    form, paint = _overlay_stamp_objects(watermark_text, box, name, lambda resources: resources.clone(writer))
+    return name, writer._add_object(form), writer._add_object(paint)
+
+
+def _stamp_prepared(prepared, watermark_text):
+    writer = PdfWriter(clone_from=PdfReader(str(prepared.pdf_path)))
+    stamps = {}
+    for page, page_meta in zip(writer.pages, prepared.manifest['pages']):
+        key = tuple(page_meta['box'])
+        stamp = stamps.get(key)
+        if stamp is None:
+            stamp = _add_overlay_stamp(writer, watermark_text, key, len(stamps))
+            stamps[key] = stamp
+        name, form_ref, paint_ref = stamp
+        page['/Resources']['/XObject'][NameObject(name)] = form_ref
+        page['/Contents'].append(paint_ref)
+    return writer
+
+
+def _copy_object_graph(obj, allocate, objects, copied):
+    """Copy obj for an incremental update, renumbering every indirect object it reaches."""
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in copied:
+            copied[key] = allocate()
+            objects[copied[key]] = _copy_object_graph(obj.get_object(), allocate, objects, copied)
+        return IndirectObject(copied[key], 0, None)
+    if isinstance(obj, StreamObject):
+        stream = DecodedStreamObject()
+        stream.set_data(obj.get_data())
+        for key, value in obj.items():
+            if key not in ('/Filter', '/DecodeParms', '/Length'):
+                stream[key] = _copy_object_graph(value, allocate, objects, copied)
+        return stream
+    if isinstance(obj, DictionaryObject):
+        return DictionaryObject({key: _copy_object_graph(value, allocate, objects, copied) for key, value in obj.items()})
+    if isinstance(obj, ArrayObject):
+        return ArrayObject([_copy_object_graph(item, allocate, objects, copied) for item in obj])
+    return obj
+
+
+def _serialize_object(num, obj):
+    buf = io.BytesIO()
+    buf.write(f'{num} 0 obj\n'.encode('ascii'))
+    obj.write_to_stream(buf)
+    buf.write(b'\nendobj\n')
+    return buf.getvalue()
+
+
+def build_incremental_update(prepared, watermark_text):
+    """Return the bytes of an incremental update that watermarks every page of a prepared PDF.
+
+    The prepared file is left untouched: the update adds one Form XObject per page size and
+    rewrites only the small /Contents arrays and /XObject dictionaries recorded in the manifest.
+    """
+    manifest = prepared.manifest
+    trailer = manifest['trailer']
+    next_num = itertools.count(trailer['size'])
+    allocate = functools.partial(next, next_num)
+    objects = {}
+    copied = {}
+    stamps = {}
+    contents = {}
+    xobjects = {}
+
+    for page_meta in manifest['pages']:
+        key = tuple(page_meta['box'])
+        if key not in stamps:
+            name = f'{WATERMARK_XOBJECT_PREFIX}{len(stamps)}'
+            form, paint = _overlay_stamp_objects(
+                watermark_text, key, name,
+                lambda resources: _copy_object_graph(resources, allocate, objects, copied),
+            )
+            form_num, paint_num = allocate(), allocate()
+            objects[form_num] = form
+            objects[paint_num] = paint
+            stamps[key] = (name, form_num, paint_num)
+
+        name, form_num, paint_num = stamps[key]
+        contents.setdefault(page_meta['contents'], []).append(paint_num)
+        xobjects.setdefault(page_meta['xobjects'], {})[name] = form_num
+
+    for num, paint_nums in contents.items():
+        refs = [IndirectObject(ref_num, gen, None) for ref_num, gen in manifest['contents'][str(num)]]
+        refs.extend(IndirectObject(paint_num, 0, None) for paint_num in paint_nums)
+        objects[num] = ArrayObject(refs)
+    for num, names in xobjects.items():
+        entries = {NameObject(name): IndirectObject(ref_num, gen, None) for name, (ref_num, gen) in manifest['xobjects'][str(num)].items()}
+        entries.update({NameObject(name): IndirectObject(form_num, 0, None) for name, form_num in names.items()})
+        objects[num] = DictionaryObject(entries)
+
+    body = io.BytesIO()
+    body.write(b'\n')
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = manifest['size'] + body.tell()
+        body.write(_serialize_object(num, objects[num]))
+
+    xref_offset = manifest['size'] + body.tell()
+    body.write(b'xref\n0 1\n0000000000 65535 f\r\n')
+    numbers = sorted(offsets)
+    for _, run in itertools.groupby(enumerate(numbers), key=lambda item: item[1] - item[0]):
+        run = [num for _, num in run]
+        body.write(f'{run[0]} {len(run)}\n'.encode('ascii'))
+        for num in run:
+            body.write(f'{offsets[num]:010d} 00000 n\r\n'.encode('ascii'))
+
+    size = max(trailer['size'], numbers[-1] + 1)
+    root_num, root_gen = trailer['root']
+    trailer_entries = [f'/Size {size}', f'/Root {root_num} {root_gen} R', f'/Prev {manifest["startxref"]}']
+    if trailer['info']:
+        trailer_entries.append('/Info {} {} R'.format(*trailer['info']))
+    if trailer['id']:
+        trailer_entries.append('/ID [<{}> <{}>]'.format(*trailer['id']))
+    body.write(f'trailer\n<< {" ".join(trailer_entries)} >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode('ascii'))
+    return body.getvalue()
+
+
+def _prepare_for_watermark(pdf_path, sha256):
+    if not (sha256 and settings.WATERMARK_CACHE_ENABLED):
+        return None
+    try:
+        return get_prepared_pdf(pdf_path, sha256)
+    except Exception:
+        logger.warning('watermark: could not prepare %s, merging directly', pdf_path, exc_info=True)
+        return None
+
+
+def watermark_pdf(pdf_path, watermark_text, sha256=''):
+    """Return a rewound spooled file holding the PDF at pdf_path with a watermark on every page.
+
+    This is the buffered path: the whole document is built and serialized before the caller can
+    send a byte, so it only stays in memory up to WATERMARK_SPOOL_MAX_BYTES before spilling to a
+    temporary file. watermark_stream's incremental mode is the path that actually streams.
+
+    When the document's sha256 is known the pages are stamped onto a cached, pre-normalized
+    copy instead of merging overlays into every content stream. Overlay templates are cached
+    per page size with only the text filled in per request.
+    """
+    prepared = _prepare_for_watermark(pdf_path, sha256)
+    writer = _stamp_prepared(prepared, watermark_text) if prepared else _merge_overlays(pdf_path, watermark_text)
+    out = tempfile.SpooledTemporaryFile(max_size=settings.WATERMARK_SPOOL_MAX_BYTES)
+    writer.write(out)
+    out.seek(0)
+    return out
+
+
+class _IncrementalStream:
+    """The prepared source's chunks followed by the appended revision.
+
+    StreamingHttpResponse calls close() when the response ends, also when the client disconnects
+    before the body was read, so the prepared file is never left open.
+    """
+
+    def __init__(self, handle, update):
+        self._handle = handle
+        self._update = update
+
+    def __iter__(self):
+        yield from iter_file_chunks(self._handle)
+        yield self._update
+
+    def close(self):
+        self._handle.close()
+
+
+def watermark_stream(pdf_path, watermark_text, sha256='', mode=None):
+    """Return (chunks, content_length) for the watermarked PDF using WATERMARK_MODE.
+
+    In incremental mode (the default) the prepared source is streamed verbatim from disk and
+    followed by a small appended revision; anything that cannot be prepared falls back to the
+    buffered rewrite in watermark_pdf.
+    """
+    mode = mode or settings.WATERMARK_MODE
+    if mode == WATERMARK_MODE_INCREMENTAL:
+        prepared = _prepare_for_watermark(pdf_path, sha256)
+        if prepared is not None:
+            update = build_incremental_update(prepared, watermark_text)
+            try:
+                handle = open(prepared.pdf_path, 'rb')
+            except FileNotFoundError:
+                # Evicted since the manifest was read; merge straight from the source instead.
+                logger.info('watermark: prepared copy of %s was evicted, merging directly', pdf_path)
+                handle, sha256 = None, ''
+            if handle is not None:
+                # The entry may have been rebuilt since the manifest was read.
+                if os.fstat(handle.fileno()).st_size == prepared.manifest['size']:
+                    return _IncrementalStream(handle, update), prepared.manifest['size'] + len(update)
+                handle.close()
+
+    out = watermark_pdf(pdf_path, watermark_text, sha256=sha256)
+    size = out.seek(0, os.SEEK_END)
+    out.seek(0)
+    return iter_file_chunks(out), size
+
+
+def iter_file_chunks(handle, chunk_size=None, length=None):
+    """Yield the remaining contents of handle (or its next length bytes) in chunks, closing it once exhausted."""
+    chunk_size = chunk_size or settings.FILE_SERVE_CHUNK_SIZE
+    remaining = length
+    try:
+        while remaining is None or remaining > 0:
+            chunk = handle.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
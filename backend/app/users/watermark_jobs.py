@@ -0,0 +1,238 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .catalog_jobs import rq_job_status
+from .metrics import record_watermark_job_completion, record_watermark_job_item, record_watermark_queue_depth
+from .models import WatermarkJob, WatermarkJobItem
+from .utils import resolve_document_path
+from .watermark import watermark_stream
+
+logger = logging.getLogger('users.watermark')
+
+RUNNING_STATUSES = (WatermarkJob.STATUS_QUEUED, WatermarkJob.STATUS_RUNNING)
+# RQ job states in which the item will never be watermarked.
+_DEAD_JOB_STATUSES = ('finished', 'failed', 'stopped', 'canceled')
+
+
+def job_root():
+    if settings.WATERMARK_JOB_ROOT:
+        return Path(settings.WATERMARK_JOB_ROOT)
+    return Path(settings.RDSO_STORAGE_ROOT) / '_watermark_jobs'
+
+
+def job_output_path(item):
+    return job_root() / str(item.job_id) / item.output_name
+
+
+def _update_queue_depth():
+    if not settings.WATERMARK_USE_QUEUE:
+        record_watermark_queue_depth(0)
+        return
+
+    try:
+        import django_rq
+
+        queue = django_rq.get_queue('watermark')
+        record_watermark_queue_depth(queue.count)
+    except Exception:
+        logger.debug('Could not inspect watermark queue depth', exc_info=True)
+
+
+def purge_expired_watermark_jobs():
+    """Delete finished jobs older than WATERMARK_JOB_TTL together with their output files."""
+    cutoff = timezone.now() - timedelta(seconds=settings.WATERMARK_JOB_TTL)
+    expired = list(
+        WatermarkJob.objects.filter(finished_at__lt=cutoff)
+        .exclude(status__in=RUNNING_STATUSES)
+        .values_list('pk', flat=True)
+    )
+    for job_pk in expired:
+        shutil.rmtree(job_root() / str(job_pk), ignore_errors=True)
+    WatermarkJob.objects.filter(pk__in=expired).delete()
+    return len(expired)
+
+
+def _is_abandoned(job):
+    """True for a running job whose worker is gone: a killed thread pool, or RQ jobs that died mid-item."""
+    last_finished = job.items.exclude(finished_at=None).order_by('-finished_at').values_list('finished_at', flat=True).first()
+    last_seen = max(filter(None, (job.queued_at, job.started_at, last_finished)))
+    if timezone.now() - last_seen <= timedelta(seconds=settings.WATERMARK_JOB_STALE_SECONDS):
+        return False
+    if job.execution_mode != WatermarkJob.EXECUTION_QUEUE:
+        return True
+    # Queued items can legitimately wait behind other work; only give up once none can still run.
+    pending = job.items.filter(status=WatermarkJobItem.STATUS_PENDING).values_list('rq_job_id', flat=True)
+    for rq_job_id in pending.iterator():
+        job_status = rq_job_status(rq_job_id, 'watermark') if rq_job_id else None
+        if job_status is not None and job_status not in _DEAD_JOB_STATUSES:
+            return False
+    return True
+
+
+def recover_abandoned_watermark_job(job):
+    """Fail the pending items of an abandoned job so it finishes with whatever was watermarked.
+
+    Returns True when the job was abandoned.
+    """
+    if job.status not in RUNNING_STATUSES or not _is_abandoned(job):
+        return False
+    finished_at = timezone.now()
+    job.items.filter(status=WatermarkJobItem.STATUS_PENDING).update(
+        status=WatermarkJobItem.STATUS_FAILED,
+        error_message='Abandoned: the worker stopped before watermarking this document',
+        finished_at=finished_at,
+    )
+    for tmp_path in (job_root() / str(job.pk)).glob('*.tmp'):
+        tmp_path.unlink(missing_ok=True)
+    logger.warning('Watermark job %s was abandoned by its worker; pending documents marked failed', job.pk)
+    _finish_job_if_complete(job.pk)
+    return True
+
+
+def recover_abandoned_watermark_jobs():
+    recovered = 0
+    for job in WatermarkJob.objects.filter(status__in=RUNNING_STATUSES):
+        recovered += recover_abandoned_watermark_job(job)
+    return recovered
+
+
+def start_watermark_job(user, documents):
+    purge_expired_watermark_jobs()
+    recover_abandoned_watermark_jobs()
+
+    now_str = timezone.now().strftime('%d-%m-%Y %H:%M:%S')
+    execution_mode = WatermarkJob.EXECUTION_QUEUE if settings.WATERMARK_USE_QUEUE else WatermarkJob.EXECUTION_THREAD
+    job = WatermarkJob.objects.create(
+        requested_by=user,
+        execution_mode=execution_mode,
+        watermark_text=f"Downloaded by {user.HRMS_ID} at {now_str}",
+        total_items=len(documents),
+    )
+    items = WatermarkJobItem.objects.bulk_create([
+        WatermarkJobItem(job=job, document=document) for document in documents
+    ])
+
+    if settings.WATERMARK_USE_QUEUE:
+        try:
+            import django_rq
+
+            queue = django_rq.get_queue('watermark')
+            # One RQ job per document so every running worker can pick up a share.
+            for item in items:
+                rq_job = queue.enqueue(execute_watermark_item, item.pk, job_timeout=settings.WATERMARK_JOB_TIMEOUT)
+                item.rq_job_id = rq_job.id
+            WatermarkJobItem.objects.bulk_update(items, ['rq_job_id'])
+            _update_queue_depth()
+            return job
+        except Exception:
+            logger.exception('Failed to enqueue watermark job %s, falling back to a thread', job.pk)
+            job.execution_mode = WatermarkJob.EXECUTION_THREAD
+            job.save(update_fields=['execution_mode', 'updated_at'])
+
+    threading.Thread(target=execute_watermark_job, args=(job.pk,), daemon=True).start()
+    _update_queue_depth()
+    return job
+
+
+def execute_watermark_job(job_id):
+    """Thread-mode runner: watermark every pending item with a small worker pool."""
+    item_ids = list(
+        WatermarkJobItem.objects.filter(job_id=job_id, status=WatermarkJobItem.STATUS_PENDING)
+        .values_list('pk', flat=True)
+    )
+    workers = min(settings.WATERMARK_JOB_WORKERS, len(item_ids))
+    if workers <= 1:
+        for item_id in item_ids:
+            execute_watermark_item(item_id)
+        return
+
+    def run(item_id):
+        try:
+            execute_watermark_item(item_id)
+        finally:
+            close_old_connections()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='watermark') as pool:
+        list(pool.map(run, item_ids))
+
+
+def execute_watermark_item(item_id):
+    item = WatermarkJobItem.objects.select_related('job', 'document').get(pk=item_id)
+    job = item.job
+    document = item.document
+    started_perf = time.perf_counter()
+
+    WatermarkJob.objects.filter(pk=job.pk, status=WatermarkJob.STATUS_QUEUED).update(
+        status=WatermarkJob.STATUS_RUNNING,
+        started_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+
+    try:
+        file_path, _ = resolve_document_path(document)
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(f'File not found for {document.document_id}')
+
+        if (document.content_type or 'application/pdf') == 'application/pdf':
+            # Only PDFs are watermarked; other formats are served from storage as-is.
+            item.output_name = f'{item.pk}.pdf'
+            output_path = job_output_path(item)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = output_path.with_name(f'{output_path.name}.tmp')
+            try:
+                chunks, _ = watermark_stream(file_path, job.watermark_text, sha256=document.sha256)
+                with open(tmp_path, 'wb') as handle:
+                    for chunk in chunks:
+                        handle.write(chunk)
+                os.replace(tmp_path, output_path)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            item.output_size = output_path.stat().st_size
+        else:
+            item.output_size = os.path.getsize(file_path)
+        item.status = WatermarkJobItem.STATUS_SUCCEEDED
+        item.error_message = ''
+    except Exception as exc:
+        logger.warning('Watermark job %s failed for %s: %s', job.pk, document.document_id, exc)
+        item.status = WatermarkJobItem.STATUS_FAILED
+        item.error_message = str(exc)
+
+    item.finished_at = timezone.now()
+    item.save(update_fields=['status', 'output_name', 'output_size', 'error_message', 'finished_at'])
+    record_watermark_job_item(item.status, time.perf_counter() - started_perf)
+    _finish_job_if_complete(job.pk)
+    _update_queue_depth()
+
+
+def _finish_job_if_complete(job_id):
+    items = WatermarkJobItem.objects.filter(job_id=job_id)
+    if items.filter(status=WatermarkJobItem.STATUS_PENDING).exists():
+        return
+
+    succeeded = items.filter(status=WatermarkJobItem.STATUS_SUCCEEDED).count()
+    job_status = WatermarkJob.STATUS_SUCCEEDED if succeeded else WatermarkJob.STATUS_FAILED
+    finished_at = timezone.now()
+    # Several workers can see the last item finish; the status filter lets only one record it.
+    updated = WatermarkJob.objects.filter(pk=job_id, status__in=RUNNING_STATUSES).update(
+        status=job_status,
+        finished_at=finished_at,
+        updated_at=finished_at,
+        error_message='' if succeeded else 'No document could be watermarked',
+    )
+    if updated:
+        job = WatermarkJob.objects.get(pk=job_id)
+        started_at = job.started_at or job.queued_at
+        record_watermark_job_completion(
+            job.status, job.execution_mode, (finished_at - started_at).total_seconds(),
+        )
@@ -38,6 +38,9 @@ FAILED_DOWNLOADS_FILE_NAME = "failed_downloads.json"
 MAX_DOWNLOAD_ATTEMPTS = 5
 INITIAL_DOWNLOAD_WORKERS = 16
 THROTTLE_SLEEP_SECONDS = 60
+# --emit-records: one stdout line per finished drawing, read by the backend's crawler runner.
+RECORD_PREFIX = "@@catalog-record "
+RECORD_FILE_KEYS = ("stored_file", "content_type", "size", "sha256", "etag", "downloaded_at", "last_checked_at")
 
 FILE_PATTERN = re.compile(
     r'(?:uploadedDrawing|uploaded)/[^\s"\'<>]+\.(?:jpg|jpeg|png|gif|bmp|tif|tiff|pdf)',
@@ -58,6 +61,7 @@ class CrawlContext:
     initial_download_workers: int
     run_started_at: str
     previous_state: dict[str, Any]
+    emit_records: bool = False
 
 
 logger = logging.getLogger("rdso_site_crawler")
@@ -886,6 +890,8 @@ def build_hierarchy(context: CrawlContext, session: requests.Session) -> dict[st
                 drawing_meta["summary"]["file_count"] = drawing_meta["file_count"]
                 drawing_meta["storage"]["file_count"] = drawing_meta["file_count"]
                 write_json(context.storage_root / drawing_meta["relative_path"] / META_FILE_NAME, drawing_meta)
+                if context.emit_records:
+                    emit_catalog_record(drawing_meta)
 
     hierarchy_categories = []
     for category_name in sorted(categories_by_name):
@@ -1004,23 +1010,35 @@ def build_hierarchy(context: CrawlContext, session: requests.Session) -> dict[st
     }
 
 
+def flat_catalog_record(drawing: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": drawing["id"],
+        "file_name": drawing["file_name"],
+        "category": drawing["category"],
+        "subhead": drawing["subhead"],
+        "page_url": drawing["page_url"],
+        "files": [file_item["source_url"] for file_item in drawing["files"]],
+        "description": drawing["description"],
+        "storage_path": drawing["relative_path"],
+    }
+
+
+def emit_catalog_record(drawing: dict[str, Any]) -> None:
+    """Print a drawing's catalog_flat.json record plus the __state__.json fields of its files."""
+    record = flat_catalog_record(drawing)
+    record["file_meta"] = {
+        file_item["source_url"]: {key: file_item.get(key) for key in RECORD_FILE_KEYS}
+        for file_item in drawing["files"]
+    }
+    print(RECORD_PREFIX + json.dumps(record, separators=(",", ":")), flush=True)
+
+
 def build_flat_catalog(hierarchy: dict[str, Any]) -> list[dict[str, Any]]:
     catalog = []
     for category in hierarchy["categories"]:
         for subhead in category["subheads"]:
             for drawing in subhead["drawings"]:
-                catalog.append(
-                    {
-                        "id": drawing["id"],
-                        "file_name": drawing["file_name"],
-                        "category": drawing["category"],
-                        "subhead": drawing["subhead"],
-                        "page_url": drawing["page_url"],
-                        "files": [file_item["source_url"] for file_item in drawing["files"]],
-                        "description": drawing["description"],
-                        "storage_path": drawing["relative_path"],
-                    }
-                )
+                catalog.append(flat_catalog_record(drawing))
     return catalog
 
 
@@ -1170,6 +1188,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--no-download", action="store_true", help="Generate crawl metadata without downloading files.")
     parser.add_argument("--download-workers", type=int, default=INITIAL_DOWNLOAD_WORKERS, help="Initial number of download workers. Defaults to 16.")
     parser.add_argument("--limit-drawings", type=int, help="Process only the first N drawings. Useful for testing.")
+    parser.add_argument("--emit-records", action="store_true", help="Print each finished drawing as a catalog record line on stdout for the backend to import.")
     return parser.parse_args()
 
 
@@ -1189,6 +1208,7 @@ def main() -> None:
         initial_download_workers=max(1, args.download_workers),
         run_started_at=run_started_at,
         previous_state=previous_state,
+        emit_records=args.emit_records,
     )
 
     logger.info("Storage root: %s", storage_root)